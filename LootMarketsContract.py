@@ -19,13 +19,14 @@ inspired by the "Battle Royale" genre of games.
 All aspects of game logic are decided in this contract and it aims to show what a NEO smart contract is capable of.
 """
 
-from boa.builtins import concat, list, range, take, substr, verify_signature, sha256, hash160, hash256
+from boa.builtins import concat, list, range, take, substr, verify_signature, sha256, hash160, hash256, has_key, keys
 from boa.interop.System.ExecutionEngine import GetScriptContainer, GetExecutingScriptHash, GetCallingScriptHash,GetEntryScriptHash
 from boa.interop.Neo.Transaction import Transaction, TransactionInput, GetReferences, GetOutputs, GetUnspentCoins,GetAttributes, GetInputs
 from boa.interop.Neo.Output import GetValue, GetAssetId, GetScriptHash
 from boa.interop.Neo.Attribute import TransactionAttribute
 from boa.interop.Neo.TriggerType import Application, Verification
-from boa.interop.Neo.Storage import Get, Put, Delete, GetContext
+from boa.interop.Neo.Storage import Get, Put, Delete, GetContext, Find
+from boa.interop.Neo.Iterator import IterNext, IterKey, IterValue
 from boa.interop.Neo.Action import RegisterAction
 from boa.interop.Neo.Blockchain import GetHeight, ShowAllContracts, GetContract, GetHeader
 from boa.interop.Neo.Runtime import Notify, Serialize, Deserialize, CheckWitness, GetTrigger
@@ -44,17 +45,45 @@ LootTokenHash = b'i\x9b\xf7\x17L\xd7\x0f\xbe\xea\xe4\xc5R\xe7\xb0\xddX\x8a\x89\x
 LootContract = RegisterAppCall('cbca898a58ddb0e752c5e4eabe0fd74c17f79b69', 'operation', 'args')
 
 # Storage keys
+accrued_fees_key = b'Accrued'  # The fees a marketplace has charged since they were last swept.
+balance_key = b'Balance'  # The LOOT balance of an address, followed by the 20 byte address.
 contract_state_key = b'State'  # Stores the state of the contract.
-inventory_key = b'Inventory'  # The inventory of an address.
-marketplace_key = b'Marketplace'  # The owner of a marketplace
+inventory_key = b'Inventory'  # The inventory of an address, one key per item id holding the amount owned.
+inventory_item_separator = b'/'  # Separates the address from the item id in an inventory key.
+marketplace_key = b'Marketplace'  # The record of a marketplace, its state, fees, owner count and fee address.
 offers_key = b'Offers'  # All the offers available on a marketplace.
 order_key = b'Order'  # Mark an order as complete so it is not completed.
+owner_signer_key = b'Signer'  # Public keys registered by marketplace owners, referred to by index when signing.
+registry_key = b'Registry'  # Every registered marketplace, in the order they were registered.
+
+# Order salts
+# A compact salt is a 16 byte binary GUID, its first 4 bytes are the block height the order expires at.
+# Legacy 32 character hex salts do not expire, so their completion must be stored permanently.
+ORDER_SALT_LENGTH = 16
+ORDER_EXPIRY_LENGTH = 4
+# Orders may expire at most ~1 day of blocks ahead, so every completed compact salt can be pruned.
+MAX_ORDER_LIFETIME = 5760
+
+# Balances are stored as little endian integers of a fixed width, padded with zero bytes.
+# Signed 8 byte integers hold far more than the LOOT supply.
+BALANCE_LENGTH = 8
+BALANCE_PADDING = b'\x00\x00\x00\x00\x00\x00\x00\x00'
+
+# Marketplace records
+# A marketplace is one fixed width record, its first byte is the version of the layout it was written in.
+MARKETPLACE_RECORD_VERSION = b'\x01'
+MARKETPLACE_RECORD_LENGTH = 28
+# get_marketplaces lists at most this many marketplaces per invocation.
+MAX_MARKETPLACES_LISTED = 100
 
 # Fee variables
+# Fees are charged on every exchange, in parts of feeFactor of the price, so a fee is at most the whole price.
 feeFactor = 10000
-MAX_FEE = 10000000
+MAX_FEE = 10000
 
 # Contract States
+# A marketplace's record holds its own state, which the contract's TERMINATED state overrides.
+# A marketplace in PENDING is paused, its orders are refused until it is ACTIVE again.
 TERMINATED = b'\x01'  # Anyone may do any core operations without owners permission e.g. emergency button.
 PENDING = b'\x02'  # The contract needs to be initialized before trading is opened.
 ACTIVE = b'\03'  # All operations are active and managed by the LOOT Marketplace framework.
@@ -66,18 +95,22 @@ ACTIVE = b'\03'  # All operations are active and managed by the LOOT Marketplace
 
 # Stores the rewards that competition owner has placed.
 battle_royale_rewards_key = b'BattleRoyaleRewards'
-# A list of the destroyed zones.
-battle_royale_destroyed_zones_key = b'BattleRoyaleGas'
 # The zone which is marked to be destroyed.
 battle_royale_marked_destroyed_zone_key = b"BRMarkedZone"
-# For more information about every entrant.
-battle_royale_entrant_key = b'BattleRoyaleInformation'
-# A list of players so we can easily iterate through the remaining players.
-battle_royale_current_players_key = b'BattleRoyaleCurrentPlayers'
+# The slot every entrant was given when they signed up.
+battle_royale_entrant_key = b'BRSlot'
+# For more information about every entrant, their records are packed into pages by slot.
+battle_royale_entrant_page_key = b'BREntrants'
+# One byte for every slot, so we can easily iterate through the remaining players.
+battle_royale_current_players_key = b'BRAlive'
+# The players in each zone of the map, so opponents are found without iterating through every player.
+battle_royale_zone_key = b'BRZone'
 # The details of the event.
-battle_royale_details_key = b'BattleRoyaleDetails'
-# Leaderboard results of the event.
-battle_royale_event_results_key = b'BREventResults'
+battle_royale_details_key = b'BRDetails'
+# Events stored in the layout before slots were given, their entrants, players and leaderboard are not readable.
+battle_royale_legacy_details_key = b'BattleRoyaleDetails'
+# Leaderboard results of the event, the count of players on it, then pages of their addresses.
+battle_royale_event_results_key = b'BRLeaderboard'
 
 # Zones start being destroyed at round 4.
 ROUND_DESTROYED_ZONES_GENERATE = 4
@@ -89,6 +122,22 @@ BR_CHANCE_INCREASE_PER_ROUND = 5
 BR_ROUND_TIMEOUT = 10
 BR_UNTRADEABLE_REWARDS = ["Gem", "Ammo", "Crate", "Bounty"]
 
+# Actions are stored as a single byte in entrant records, an unknown action loses every fight.
+BR_ACTION_UNKNOWN = 0
+BR_ACTION_MOVE = 1
+BR_ACTION_LOOT = 2
+BR_ACTION_HIDE = 3
+# Directions 0-3 are UP, DOWN, RIGHT and LEFT, any other direction is stored as none.
+BR_DIRECTION_NONE = 4
+# An entrant's address and their 8 byte record, see encode_BR_entrant.
+BR_ENTRANT_LENGTH = 28
+# Entrants in a page of records, and addresses in a page of the leaderboard, so that a page stays within 1KB of storage.
+BR_ENTRANTS_PER_PAGE = 32
+BR_LEADERBOARD_PAGE_LENGTH = 48
+# A slot's byte in the list of remaining players.
+BR_ALIVE = b'\x01'
+BR_KNOCKED_OUT = b'\x00'
+
 # endregion
 
 
@@ -124,21 +173,96 @@ def Main(operation, args):
                 originator_order_salt = args[12]
                 taker_order_salt = args[13]
 
-                operation_result = exchange(marketplace, marketplace_owner_address, marketplace_owner_signature,
+                fees_charged = []
+                operation_result = exchange(marketplace, 0, marketplace_owner_address, marketplace_owner_signature,
                                             marketplace_owner_public_key, originator_address, originator_signature,
                                             originator_public_key, taker_address, taker_signature, taker_public_key,
-                                            originator_order_salt, taker_order_salt, item_id, price)
+                                            originator_order_salt, taker_order_salt, item_id, price, fees_charged)
+
+                payload = ["exchange", originator_order_salt, marketplace, operation_result, originator_address,
+                           taker_address, item_id, price]
+                # The maker fee and taker fee follow when fees were charged.
+                for value in fees_charged:
+                    payload.append(value)
+                Notify(payload)
+
+                return operation_result
+
+            # The marketplace owner signs with a public key registered through add_owner_wallet.
+            if len(args) == 13:
+                marketplace = args[0]
+                signer_index = args[1]
+                marketplace_owner_signature = args[2]
+                originator_address = args[3]
+                originator_signature = args[4]
+                originator_public_key = args[5]
+                taker_address = args[6]
+                taker_signature = args[7]
+                taker_public_key = args[8]
+                item_id = args[9]
+                price = args[10]
+                originator_order_salt = args[11]
+                taker_order_salt = args[12]
+
+                fees_charged = []
+                operation_result = exchange(marketplace, signer_index, b'', marketplace_owner_signature, b'',
+                                            originator_address, originator_signature, originator_public_key,
+                                            taker_address, taker_signature, taker_public_key,
+                                            originator_order_salt, taker_order_salt, item_id, price, fees_charged)
+
+                payload = ["exchange", originator_order_salt, marketplace, operation_result, originator_address,
+                           taker_address, item_id, price]
+                for value in fees_charged:
+                    payload.append(value)
+                Notify(payload)
+
+                return operation_result
+
+        # Fill many matched orders, verified by the marketplace owner once for the whole batch.
+        if operation == "exchange_batch":
+            if len(args) == 6:
+                marketplace = args[0]
+                marketplace_owner_address = args[1]
+                marketplace_owner_signature = args[2]
+                marketplace_owner_public_key = args[3]
+                atomic = args[4]
+                fills = args[5]
+
+                results = []
+                settled = []
+                operation_result = exchange_batch(marketplace, 0, marketplace_owner_address,
+                                                  marketplace_owner_signature, marketplace_owner_public_key, atomic,
+                                                  fills, results, settled)
+
+                payload = ["exchange_batch", marketplace, results, operation_result, settled]
+                Notify(payload)
 
-                payload = ["exchange", originator_order_salt, marketplace, operation_result]
+                return operation_result
+
+            # The marketplace owner signs with a public key registered through add_owner_wallet.
+            if len(args) == 5:
+                marketplace = args[0]
+                signer_index = args[1]
+                marketplace_owner_signature = args[2]
+                atomic = args[3]
+                fills = args[4]
+
+                results = []
+                settled = []
+                operation_result = exchange_batch(marketplace, signer_index, b'', marketplace_owner_signature, b'',
+                                                  atomic, fills, results, settled)
+
+                payload = ["exchange_batch", marketplace, results, operation_result, settled]
                 Notify(payload)
 
                 return operation_result
 
         if operation == "trade":
             # Trade must have an terminated implementation so users will never lose access to their assets.
-            if get_contract_state() == TERMINATED:
-                if len(args) == 4:
-                    marketplace = args[0]
+            # Only the terminated form reads the state, the contract's TERMINATED state overrides the marketplace's.
+            if len(args) == 4:
+                marketplace = args[0]
+                if is_marketplace_terminated(marketplace):
                     originator_address = args[1]
                     taker_address = args[2]
                     item_id = args[3]
@@ -146,7 +270,11 @@ def Main(operation, args):
                     if not CheckWitness(originator_address):
                         return False
 
-                    operation_result = trade(marketplace, originator_address, taker_address, item_id)
+                    context = GetContext()
+                    operation_result = trade(context, marketplace, originator_address, taker_address, item_id)
+                    transaction_details = ["trade", b'', marketplace, operation_result, originator_address,
+                                           taker_address, item_id]
+                    Notify(transaction_details)
                     return operation_result
 
             if len(args) == 10:
@@ -165,16 +293,17 @@ def Main(operation, args):
                                                   marketplace_owner_address, marketplace_owner_signature,
                                                   marketplace_owner_public_key, originator_signature,
                                                   originator_public_key, originator_order_salt)
-                transaction_details = ["trade", originator_order_salt, marketplace, operation_result]
+                transaction_details = ["trade", originator_order_salt, marketplace, operation_result,
+                                       originator_address, taker_address, item_id]
                 Notify(transaction_details)
 
                 return operation_result
 
         if operation == "give_item":
             # Marketplace owners must be able to still give items without the framework.
-            if get_contract_state() == TERMINATED:
-                if len(args) == 4:
-                    marketplace = args[0]
+            if len(args) == 4:
+                marketplace = args[0]
+                if is_marketplace_terminated(marketplace):
                     originator_address = args[1]
                     taker_address = args[2]
                     item_id = args[3]
@@ -184,10 +313,15 @@ def Main(operation, args):
                     if not is_marketplace_owner(marketplace, originator_address):
                         return False
 
-                    operation_result = trade(marketplace, originator_address, taker_address, item_id)
+                    context = GetContext()
+                    operation_result = trade(context, marketplace, originator_address, taker_address, item_id)
+                    transaction_details = ["trade", b'', marketplace, operation_result, originator_address,
+                                           taker_address, item_id]
+                    Notify(transaction_details)
                     return operation_result
 
-            if len(args) == 7:
+            # An optional 8th argument gives a quantity of the item in a single storage write.
+            if len(args) == 7 or len(args) == 8:
                 marketplace = args[0]
                 address_to = args[1]
                 item_id = args[2]
@@ -195,26 +329,64 @@ def Main(operation, args):
                 marketplace_owner_signature = args[4]
                 marketplace_owner_public_key = args[5]
                 originator_order_salt = args[6]
+                quantity = 0
+                if len(args) == 8:
+                    quantity = args[7]
 
-                operation_result = give_item_verified(marketplace, address_to, item_id, marketplace_owner,
+                operation_result = give_item_verified(marketplace, address_to, item_id, quantity, marketplace_owner,
                                                       marketplace_owner_signature, marketplace_owner_public_key,
                                                       originator_order_salt)
-                payload = ["give_item", originator_order_salt, marketplace, operation_result]
+                payload = ["give_item", originator_order_salt, marketplace, operation_result, address_to, item_id,
+                           quantity]
                 Notify(payload)
                 return operation_result
 
+        # Give many items under a single marketplace owner signature, e.g. rewards after an event.
+        if operation == "give_items_batch":
+            if len(args) == 6:
+                marketplace = args[0]
+                marketplace_owner = args[1]
+                marketplace_owner_signature = args[2]
+                marketplace_owner_public_key = args[3]
+                originator_order_salt = args[4]
+                grants = args[5]
+
+                operation_result = give_items_batch(marketplace, grants, 0, marketplace_owner,
+                                                    marketplace_owner_signature, marketplace_owner_public_key,
+                                                    originator_order_salt)
+                payload = ["give_items_batch", originator_order_salt, marketplace, len(grants), operation_result]
+                Notify(payload)
+                return operation_result
+
+            # The marketplace owner signs with a public key registered through add_owner_wallet.
+            if len(args) == 5:
+                marketplace = args[0]
+                signer_index = args[1]
+                marketplace_owner_signature = args[2]
+                originator_order_salt = args[3]
+                grants = args[4]
+
+                operation_result = give_items_batch(marketplace, grants, signer_index, b'',
+                                                    marketplace_owner_signature, b'', originator_order_salt)
+                payload = ["give_items_batch", originator_order_salt, marketplace, len(grants), operation_result]
+                Notify(payload)
+                return operation_result
 
         if operation == "remove_item":
             # Remove item must have a terminated implementation so users can still access their assets.
-            if get_contract_state() == TERMINATED:
-                if len(args) == 3:
-                    marketplace = args[0]
+            if len(args) == 3:
+                marketplace = args[0]
+                if is_marketplace_terminated(marketplace):
                     originator_address = args[1]
                     item_id = args[2]
 
-                    if CheckWitness(originator_address):
+                    if not CheckWitness(originator_address):
                         return False
-                    operation_result = remove_item(marketplace, originator_address, item_id)
+                    context = GetContext()
+                    storage_key = get_inventory_item_key(marketplace, originator_address, item_id)
+                    operation_result = remove_item(context, storage_key)
+                    payload = ["remove_item", b'', marketplace, operation_result, originator_address, item_id]
+                    Notify(payload)
                     return operation_result
 
             if len(args) == 9:
@@ -232,7 +404,8 @@ def Main(operation, args):
                                                         originator_order_salt, marketplace_owner_address
                                                         , marketplace_owner_signature, marketplace_owner_public_key,
                                                         originator_signature, originator_public_key)
-                payload = ["remove_item", originator_order_salt, marketplace, operation_result]
+                payload = ["remove_item", originator_order_salt, marketplace, operation_result, originator_address,
+                           item_id]
                 Notify(payload)
                 return operation_result
 
@@ -242,16 +415,50 @@ def Main(operation, args):
             if len(args) == 2:
                 marketplace = args[0]
                 address = args[1]
-                inventory_s = get_inventory(marketplace, address)
-                if inventory_s == b'':
-                    inventory = []
-                else:
-                    inventory = Deserialize(inventory_s)
+                inventory = get_inventory(marketplace, address)
 
                 payload = ["get_inventory", marketplace, address, inventory]
                 Notify(payload)
                 return True
 
+        # Anyone may move an inventory stored as a single serialized list into per item keys.
+        if operation == "migrate_inventory":
+            if len(args) == 2:
+                marketplace = args[0]
+                address = args[1]
+                operation_result = migrate_inventory(marketplace, address)
+
+                payload = ["migrate_inventory", marketplace, address, operation_result]
+                Notify(payload)
+                return operation_result
+
+        # Move a balance stored under the bare address to its balance key.
+        if operation == "migrate_balance":
+            if len(args) == 1:
+                address = args[0]
+
+                # Other keys may be 20 bytes long as well, only an address or the contract owner can tell
+                # that the key is a balance.
+                if len(address) != 20:
+                    return False
+                if not CheckWitness(address):
+                    if not CheckWitness(contract_owner):
+                        return False
+
+                operation_result = migrate_balance(address)
+
+                payload = ["migrate_balance", address, operation_result]
+                Notify(payload)
+                return operation_result
+
+        # Anyone may clean up the storage of expired orders, the notification counts the expired salts considered.
+        if operation == "prune_orders":
+            considered = prune_orders(args)
+
+            payload = ["prune_orders", considered]
+            Notify(payload)
+            return considered
+
         if operation == "marketplace_owner":
             if len(args) == 2:
                 marketplace = args[0]
@@ -277,8 +484,9 @@ def Main(operation, args):
 
         if operation == "withdraw":
             # Users will be able to withdraw their funds in a terminated state.
-            if get_contract_state() == TERMINATED:
-                if len(args) == 2:
+            # Balances are shared by every marketplace, so only the contract's state opens this.
+            if len(args) == 2:
+                if get_contract_state() == TERMINATED:
                     originator_address = args[0]
                     amount = args[1]
                     my_hash = GetExecutingScriptHash()
@@ -286,7 +494,11 @@ def Main(operation, args):
                     if not CheckWitness(originator_address):
                         return False
 
-                    operation_result = withdrawal(my_hash, originator_address, amount)
+                    context = GetContext()
+                    operation_result = withdrawal(context, my_hash, originator_address, amount)
+                    if operation_result:
+                        payload = ["withdraw", b'', originator_address, amount]
+                        Notify(payload)
                     return operation_result
 
             if len(args) == 8:
@@ -303,7 +515,6 @@ def Main(operation, args):
 
                 if withdrawal_verified(my_hash, originator_address, tokens, originator_signature, originator_public_key,
                                        owner_address, owner_signature, owner_public_key, originator_order_salt):
-                    order_complete(originator_order_salt)
                     payload = ["withdraw", originator_order_salt, originator_address, tokens]
                     Notify(payload)
                     return True
@@ -327,26 +538,66 @@ def Main(operation, args):
                                                            marketplace_owner_address, marketplace_owner_signature,
                                                            marketplace_owner_public_key, originator_order_salt)
 
-                transaction_details = ["transfer", originator_order_salt, operation_result]
+                transaction_details = ["transfer", originator_order_salt, operation_result, originator_address,
+                                       taker_address, tokens]
                 Notify(transaction_details)
                 return operation_result
 
         if operation == "add_owner_wallet":
-            marketplace = args[0]
-            address = args[1]
-            return add_owner_wallet(marketplace, address)
+            # With a public key, an owner registers it as a signer so orders can refer to it by index.
+            if len(args) == 3:
+                marketplace = args[0]
+                address = args[1]
+                public_key = args[2]
+                signer_index = add_owner_signer(marketplace, address, public_key)
+
+                payload = ["add_owner_signer", marketplace, address, signer_index]
+                Notify(payload)
+                return signer_index
 
+        # Fees are charged on every exchange, so only a marketplace owner may change them.
         if operation == "set_maker_fees":
-            if len(args) == 2:
+            if len(args) == 3:
                 marketplace = args[0]
-                fee = args[1]
-                return set_maker_fee(marketplace, fee)
+                address = args[1]
+                fee = args[2]
+                return set_maker_fee(marketplace, address, fee)
 
         if operation == "set_taker_fees":
+            if len(args) == 3:
+                marketplace = args[0]
+                address = args[1]
+                fee = args[2]
+                return set_taker_fee(marketplace, address, fee)
+
+        # A marketplace owner moves the fees charged so far to the fee address.
+        if operation == "sweep_fees":
+            if len(args) == 2:
+                marketplace = args[0]
+                address = args[1]
+                return sweep_fees(marketplace, address)
+
+        if operation == "get_accrued_fees":
+            if len(args) == 1:
+                marketplace = args[0]
+                return get_accrued_fees(marketplace)
+
+        # The registered marketplaces, for the API and indexer to enumerate.
+        if operation == "get_marketplace_count":
+            return get_marketplace_count()
+
+        if operation == "get_marketplaces":
             if len(args) == 2:
+                start = args[0]
+                count = args[1]
+                return get_marketplaces(start, count)
+
+        # The record of a marketplace, [state, maker_fee, taker_fee, owner_count, fee_address].
+        if operation == "get_marketplace":
+            if len(args) == 1:
                 marketplace = args[0]
-                fee = args[1]
-                return set_taker_fee(marketplace, fee)
+                context = GetContext()
+                return get_marketplace(context, marketplace)
 
         if operation == "get_maker_fee":
             if len(args) == 1:
@@ -378,17 +629,45 @@ def Main(operation, args):
                     address = args[1]
                     maker_fee = args[2]
                     taker_fee = args[3]
-                    return register_marketplace(marketplace, address, maker_fee, taker_fee)
+                    result = register_marketplace(marketplace, address, maker_fee, taker_fee)
+
+                    payload = ["register_marketplace", marketplace, address, result]
+                    Notify(payload)
+                    return result
+
+            # Add another owner to a registered marketplace.
+            if operation == "add_owner_wallet":
+                if len(args) == 2:
+                    marketplace = args[0]
+                    address = args[1]
+                    return add_owner_wallet(marketplace, address)
 
             if operation == "set_contract_state":
                 contract_state = args[0]
                 set_contract_state(contract_state)
                 return True
 
+            # Pause or terminate one marketplace, the others keep trading.
+            if operation == "set_marketplace_state":
+                if len(args) == 2:
+                    marketplace = args[0]
+                    state = args[1]
+                    result = set_marketplace_state(marketplace, state)
+
+                    payload = ["marketplace_state", marketplace, state, result]
+                    Notify(payload)
+                    return result
+
         # State of the contract.
         if operation == "get_state":
             return get_contract_state()
 
+        # State of a marketplace, the contract's TERMINATED state overrides it.
+        if operation == "get_marketplace_state":
+            if len(args) == 1:
+                marketplace = args[0]
+                return resolve_marketplace_state(marketplace)
+
         # ========= Decentralized Games ==========
 
         # Battle Royale
@@ -460,12 +739,12 @@ def Main(operation, args):
         if operation == "BR_get_leaderboard":
             if len(args) == 1:
                 context = GetContext()
+                cache = {}
                 event_code = args[0]
-                leaderboard = get_BR_leaderboard(context, event_code)
-                if leaderboard != b'':
-                    leaderboard = Deserialize(leaderboard)
-                else:
-                    leaderboard = []
+                leaderboard = []
+                leaderboard_count = get_BR_leaderboard_count(context, cache, event_code)
+                for position in range(1, leaderboard_count + 1):
+                    leaderboard.append(get_BR_leaderboard_entry(context, cache, event_code, position))
                 payload = ["BR", event_code, 'leaderboard', leaderboard]
                 Notify(payload)
 
@@ -474,9 +753,10 @@ def Main(operation, args):
         if operation == "BR_get_event_details":
             if len(args) == 1:
                 context = GetContext()
+                cache = {}
 
                 event_code = args[0]
-                event_details = get_BR_event_details(context, event_code)
+                event_details = get_BR_event_details(context, cache, event_code)
                 payload = ["BR", event_code, "event_details", event_details]
                 Notify(payload)
 
@@ -497,57 +777,269 @@ def Main(operation, args):
     return False
 
 
-def exchange(marketplace, marketplace_owner_address, marketplace_owner_signature,
+def exchange(marketplace, signer_index, marketplace_owner_address, marketplace_owner_signature,
              marketplace_owner_public_key, originator_address, originator_signature,
              originator_public_key, taker_address, taker_signature, taker_public_key,
-             originator_order_salt, taker_order_salt, item_id, price):
+             originator_order_salt, taker_order_salt, item_id, price, fees_charged):
     """
     Verify the signatures of two parties and securely swap the item, and tokens between them.
+    The marketplace's fees are charged, see calculate_fees_of_order.
+    :param signer_index: The registered signer of the marketplace owner, or 0 to verify by address and public key.
+    :param fees_charged: A list the maker fee and taker fee are appended to when fees are charged.
     """
+    context = GetContext()
+
+    # The marketplace record holds its state and fees.
+    details = get_marketplace(context, marketplace)
+    if details[0] == PENDING:
+        print("ERROR! The marketplace is paused.")
+        return False
 
-    if order_complete(originator_order_salt):
+    originator_order_key = get_order_key(originator_order_salt)
+    if order_complete(context, originator_order_salt, originator_order_key):
         print("ERROR! This transaction has already occurred!")
         return False
 
-    if order_complete(taker_order_salt):
+    taker_order_key = get_order_key(taker_order_salt)
+    if order_complete(context, taker_order_salt, taker_order_key):
         print("ERROR! This transaction has already occurred!")
         return False
 
-    originator_args = ["put_offer", marketplace, item_id, price, originator_order_salt]
+    # All three parties sign the same order body, each with their own suffix.
+    order_body = encode_order([marketplace, item_id, price])
 
-    if not verify_order(originator_address, originator_signature, originator_public_key, originator_args):
+    originator_hash = hash_order("put_offer", order_body, originator_order_salt)
+    if not verify_order(originator_address, originator_signature, originator_public_key, originator_hash):
         print("ERROR! originator has not signed the order")
         return False
 
-    taker_args = ["buy_offer", marketplace, item_id, price, taker_order_salt]
-    if not verify_order(taker_address, taker_signature, taker_public_key, taker_args):
+    taker_hash = hash_order("buy_offer", order_body, taker_order_salt)
+    if not verify_order(taker_address, taker_signature, taker_public_key, taker_hash):
         print("ERROR! Taker has not signed the order!")
         return False
 
     # A marketplace owner must verify so there are no jumps in the queue.
-    marketplace_owner_args = ["exchange", marketplace, item_id, price, originator_address, taker_address]
+    parties = concat(originator_address, taker_address)
+    marketplace_owner_hash = hash_order("exchange", order_body, parties)
 
-    if not verify_order(marketplace_owner_address, marketplace_owner_signature, marketplace_owner_public_key,
-                        marketplace_owner_args):
+    if not verify_owner_order(marketplace, signer_index, marketplace_owner_address, marketplace_owner_signature,
+                              marketplace_owner_public_key, marketplace_owner_hash):
         print("ERROR! Marketplace owner has not signed the order!")
         return False
 
-    if not trade(marketplace, originator_address, taker_address, item_id):
-        print("ERROR! Items could not be transferred.")
-        return False
-
-    if not transfer_token(taker_address, originator_address, price):
+    if price <= 0:
         print("ERROR! Tokens could not be transferred.")
         return False
 
+    # If the address is trading with itself nothing changes hands.
+    if originator_address != taker_address:
+        # Everything is read and checked before anything is written, so a failed exchange changes nothing.
+        originator_item_key = get_inventory_item_key(marketplace, originator_address, item_id)
+        originator_item_count = Get(context, originator_item_key)
+        if originator_item_count < 1:
+            print("ERROR! Items could not be transferred.")
+            return False
+
+        fees = calculate_fees_of_order(details, price)
+        maker_fee = fees[0]
+        taker_fee = fees[1]
+
+        taker_balance_key = get_balance_key(taker_address)
+        taker_balance = Get(context, taker_balance_key)
+        if taker_balance < price + taker_fee:
+            print("ERROR! Tokens could not be transferred.")
+            return False
+
+        set_item_count(context, originator_item_key, originator_item_count - 1)
+        taker_item_key = get_inventory_item_key(marketplace, taker_address, item_id)
+        give_item(context, taker_item_key, 1)
+
+        set_balance(context, taker_balance_key, taker_balance - price - taker_fee)
+        originator_balance_key = get_balance_key(originator_address)
+        originator_balance = Get(context, originator_balance_key)
+        set_balance(context, originator_balance_key, originator_balance + price - maker_fee)
+
+        # Both fees are added to the marketplace's accrued fees in one write, and swept later with sweep_fees.
+        if maker_fee + taker_fee > 0:
+            accrued_key = get_accrued_fees_key(marketplace)
+            accrued_fees = Get(context, accrued_key)
+            Put(context, accrued_key, accrued_fees + maker_fee + taker_fee)
+            fees_charged.append(maker_fee)
+            fees_charged.append(taker_fee)
+
     # Set the orders as complete so they can only occur once.
-    set_order_complete(originator_order_salt)
-    set_order_complete(taker_order_salt)
+    set_order_complete(context, originator_order_key)
+    set_order_complete(context, taker_order_key)
 
     return True
 
 
 
+def exchange_batch(marketplace, signer_index, marketplace_owner_address, marketplace_owner_signature,
+                   marketplace_owner_public_key, atomic, fills, results, settled):
+    """
+    Verify and settle many matched orders, reading and writing each balance and inventory once for the batch.
+    :param signer_index: The registered signer of the marketplace owner, or 0 to verify by address and public key.
+    :param atomic: If True nothing is settled unless every fill succeeds, otherwise failed fills are skipped.
+    :param fills: A list of fills, each in the form [originator_address, originator_signature,
+                  originator_public_key, taker_address, taker_signature, taker_public_key, item_id, price,
+                  originator_order_salt, taker_order_salt].
+    :param results: A list the result of each fill is appended to, in order.
+    :param settled: A list each settled fill is appended to once the batch is written, in the form
+                    [originator_address, taker_address, item_id, price, maker_fee, taker_fee].
+    :return: True if every fill was settled.
+    """
+
+    # A registered signer was an owner when it was registered.
+    if signer_index == 0:
+        if not is_marketplace_owner(marketplace, marketplace_owner_address):
+            print("ERROR! Only a marketplace owner is allowed to settle a batch.")
+            return False
+
+    # The marketplace owner signs the serialized fills, fixing the order they are settled in.
+    fills_s = Serialize(fills)
+    order_body = encode_order([marketplace, atomic])
+    marketplace_owner_hash = hash_order("exchange_batch", order_body, fills_s)
+
+    if not verify_owner_order(marketplace, signer_index, marketplace_owner_address, marketplace_owner_signature,
+                              marketplace_owner_public_key, marketplace_owner_hash):
+        print("ERROR! Marketplace owner has not signed the batch!")
+        return False
+
+    context = GetContext()
+    cache = {}
+    completed_salts = {}
+    settled_fills = []
+    settled_all = True
+    # The fees are loaded once, and accrued once for the whole batch when it is flushed.
+    details = get_marketplace(context, marketplace)
+    if details[0] == PENDING:
+        print("ERROR! The marketplace is paused.")
+        return False
+
+    for fill in fills:
+        fill_result = settle_fill(context, cache, completed_salts, settled_fills, marketplace, details, fill)
+        results.append(fill_result)
+
+        if not fill_result:
+            settled_all = False
+            if atomic:
+                print("ERROR! A fill failed, the batch has not been settled.")
+                return False
+
+    # Write the final balances and inventories, and set the orders as complete so they can only occur once.
+    flush_cached(context, cache)
+    for salt in keys(completed_salts):
+        set_order_complete(context, completed_salts[salt])
+
+    # The settled fills are only reported once they are written, so they can be indexed from a single notification.
+    for settled_fill in settled_fills:
+        settled.append(settled_fill)
+
+    return settled_all
+
+
+def settle_fill(context, cache, completed_salts, settled_fills, marketplace, details, fill):
+    """
+    Helper method for exchange_batch, verifies a fill and applies it to the cached balances and inventories.
+    The order key of each salt the fill completes is added to completed_salts, and the fill with the fees it was
+    charged to settled_fills.
+    :param details: The record of the marketplace, see get_marketplace.
+    """
+
+    if len(fill) != 10:
+        print("ERROR! A fill must have 10 arguments.")
+        return False
+
+    originator_address = fill[0]
+    originator_signature = fill[1]
+    originator_public_key = fill[2]
+    taker_address = fill[3]
+    taker_signature = fill[4]
+    taker_public_key = fill[5]
+    item_id = fill[6]
+    price = fill[7]
+    originator_order_salt = fill[8]
+    taker_order_salt = fill[9]
+
+    if originator_order_salt == taker_order_salt:
+        print("ERROR! Both orders have the same salt!")
+        return False
+
+    # Orders completed earlier in this batch are not in storage yet.
+    if has_key(completed_salts, originator_order_salt) or has_key(completed_salts, taker_order_salt):
+        print("ERROR! This transaction has already occurred!")
+        return False
+
+    originator_order_key = get_order_key(originator_order_salt)
+    if order_complete(context, originator_order_salt, originator_order_key):
+        print("ERROR! This transaction has already occurred!")
+        return False
+
+    taker_order_key = get_order_key(taker_order_salt)
+    if order_complete(context, taker_order_salt, taker_order_key):
+        print("ERROR! This transaction has already occurred!")
+        return False
+
+    if price <= 0:
+        print("ERROR! The price must be > 0.")
+        return False
+
+    order_body = encode_order([marketplace, item_id, price])
+
+    originator_hash = hash_order("put_offer", order_body, originator_order_salt)
+    if not verify_order(originator_address, originator_signature, originator_public_key, originator_hash):
+        print("ERROR! originator has not signed the order")
+        return False
+
+    taker_hash = hash_order("buy_offer", order_body, taker_order_salt)
+    if not verify_order(taker_address, taker_signature, taker_public_key, taker_hash):
+        print("ERROR! Taker has not signed the order!")
+        return False
+
+    # If the address is trading with itself nothing changes hands.
+    maker_fee = 0
+    taker_fee = 0
+    if originator_address != taker_address:
+        originator_item_key = get_inventory_item_key(marketplace, originator_address, item_id)
+        originator_item_count = read_cached(context, cache, originator_item_key)
+        if originator_item_count < 1:
+            print("ERROR! Items could not be transferred.")
+            return False
+
+        fees = calculate_fees_of_order(details, price)
+        maker_fee = fees[0]
+        taker_fee = fees[1]
+
+        taker_balance_key = get_balance_key(taker_address)
+        taker_balance = read_cached(context, cache, taker_balance_key)
+        if taker_balance < price + taker_fee:
+            print("ERROR! Tokens could not be transferred.")
+            return False
+
+        taker_item_key = get_inventory_item_key(marketplace, taker_address, item_id)
+        taker_item_count = read_cached(context, cache, taker_item_key)
+
+        write_cached(cache, originator_item_key, originator_item_count - 1)
+        write_cached(cache, taker_item_key, taker_item_count + 1)
+        originator_balance_key = get_balance_key(originator_address)
+        originator_balance = read_cached(context, cache, originator_balance_key)
+        # Balances are cached already encoded, so they are flushed like any other value.
+        write_cached(cache, taker_balance_key, encode_balance(taker_balance - price - taker_fee))
+        write_cached(cache, originator_balance_key, encode_balance(originator_balance + price - maker_fee))
+
+        if maker_fee + taker_fee > 0:
+            accrued_key = get_accrued_fees_key(marketplace)
+            accrued_fees = read_cached(context, cache, accrued_key)
+            write_cached(cache, accrued_key, accrued_fees + maker_fee + taker_fee)
+
+    completed_salts[originator_order_salt] = originator_order_key
+    completed_salts[taker_order_salt] = taker_order_key
+    settled_fills.append([originator_address, taker_address, item_id, price, maker_fee, taker_fee])
+
+    return True
+
+
 def trade_verified(marketplace, originator_address, taker_address, item_id,
                    marketplace_owner_address, marketplace_owner_signature,
                    marketplace_owner_public_key, originator_signature,
@@ -560,29 +1052,37 @@ def trade_verified(marketplace, originator_address, taker_address, item_id,
         print("ERROR! Only a marketplace owner is allowed to give items.")
         return False
 
-    if order_complete(salt):
+    context = GetContext()
+    if get_marketplace_state(context, marketplace) == PENDING:
+        print("ERROR! The marketplace is paused.")
+        return False
+
+    order_storage_key = get_order_key(salt)
+    if order_complete(context, salt, order_storage_key):
         print("ERROR! This order has already occurred!")
         return False
 
-    args = ["trade", marketplace, originator_address, taker_address, item_id, salt]
+    order_body = encode_order([marketplace, originator_address, taker_address, item_id])
+    order_hash = hash_order("trade", order_body, salt)
 
-    if not verify_order(marketplace_owner_address, marketplace_owner_signature, marketplace_owner_public_key, args):
+    if not verify_order(marketplace_owner_address, marketplace_owner_signature, marketplace_owner_public_key,
+                        order_hash):
         print("ERROR! The marketplace owner has not permitted the transaction.")
         return False
 
-    if not verify_order(originator_address, originator_signature, originator_public_key, args):
+    if not verify_order(originator_address, originator_signature, originator_public_key, order_hash):
         print("ERROR! The address removing has not signed this!")
         return False
 
-    if trade(marketplace, originator_address, taker_address, item_id):
-        set_order_complete(salt)
+    if trade(context, marketplace, originator_address, taker_address, item_id):
+        set_order_complete(context, order_storage_key)
         return True
 
     print("ERROR! Could not complete the trade")
     return False
 
 
-def trade(marketplace, originator_address, taker_address, item_id):
+def trade(context, marketplace, originator_address, taker_address, item_id):
     """
     Trade an item from one address to another, on a specific marketplace.
     """
@@ -591,56 +1091,126 @@ def trade(marketplace, originator_address, taker_address, item_id):
         return True
 
     # If the removal of the item from the address sending is successful, give the item to the address receiving.
-    if remove_item(marketplace, originator_address, item_id):
-        if give_item(marketplace, taker_address, item_id):
+    originator_item_key = get_inventory_item_key(marketplace, originator_address, item_id)
+    if remove_item(context, originator_item_key):
+        taker_item_key = get_inventory_item_key(marketplace, taker_address, item_id)
+        if give_item(context, taker_item_key, 1):
             return True
 
 
 
 
-def give_item_verified(marketplace, taker_address, item_id,
+def give_item_verified(marketplace, taker_address, item_id, quantity,
                        owner_address, owner_signature,
                        owner_public_key, salt):
     """
     Give an item to an address on a specific marketplace, verified by a marketplace owner.
+    The quantity is signed in the order, orders signed with 0 give a single item.
     """
 
+    if quantity < 0:
+        print("ERROR! Cannot give a negative quantity of an item.")
+        return False
+
     if not is_marketplace_owner(marketplace, owner_address):
-        print("Only a marketplace owner is allowed to give items.")
+        print("ERROR! Only a marketplace owner is allowed to give items.")
         return False
 
-    if order_complete(salt):
-        print("This order has already occurred!")
+    context = GetContext()
+    if get_marketplace_state(context, marketplace) == PENDING:
+        print("ERROR! The marketplace is paused.")
         return False
 
-    args = ["give_item", marketplace, taker_address, item_id, 0, salt]
-    if not verify_order(owner_address, owner_signature, owner_public_key, args):
-        print("A marketplace owner has not signed this order.")
+    order_storage_key = get_order_key(salt)
+    if order_complete(context, salt, order_storage_key):
+        print("ERROR! This order has already occurred!")
+        return False
+
+    order_body = encode_order([marketplace, taker_address, item_id, quantity])
+    order_hash = hash_order("give_item", order_body, salt)
+    if not verify_order(owner_address, owner_signature, owner_public_key, order_hash):
+        print("ERROR! A marketplace owner has not signed this order.")
         return False
 
-    set_order_complete(salt)
+    set_order_complete(context, order_storage_key)
+
+    if quantity == 0:
+        quantity = 1
 
-    give_item(marketplace, taker_address, item_id)
+    storage_key = get_inventory_item_key(marketplace, taker_address, item_id)
+    give_item(context, storage_key, quantity)
 
     return True
 
-def give_item(marketplace, taker_address, item_id):
+def give_items_batch(marketplace, grants, signer_index, owner_address, owner_signature, owner_public_key, salt):
     """
-    Give an item to an address on a specific marketplace.
+    Give many items on a specific marketplace, verified by a marketplace owner once for the whole batch.
+    :param grants: A list of [address, item_id] pairs, an item is given once per pair.
+    :param signer_index: The registered signer of the marketplace owner, or 0 to verify by address and public key.
     """
-    # Get the players inventory from storage.
-    inventory_s = get_inventory(marketplace, taker_address)
 
-    # If the address owns no items create a new list, else grab the pre-existing list and append the new item.
-    if inventory_s == b'':
-        inventory = [item_id]
-    else:
-        inventory = Deserialize(inventory_s)
-        inventory.append(item_id)
+    # A registered signer was an owner when it was registered.
+    if signer_index == 0:
+        if not is_marketplace_owner(marketplace, owner_address):
+            print("ERROR! Only a marketplace owner is allowed to give items.")
+            return False
+
+    context = GetContext()
+    if get_marketplace_state(context, marketplace) == PENDING:
+        print("ERROR! The marketplace is paused.")
+        return False
+
+    order_storage_key = get_order_key(salt)
+    if order_complete(context, salt, order_storage_key):
+        print("ERROR! This order has already occurred!")
+        return False
+
+    # The serialized grants are signed, so the batch cannot be altered or reordered.
+    grants_s = Serialize(grants)
+    order_body = encode_order([marketplace, grants_s])
+    order_hash = hash_order("give_items_batch", order_body, salt)
+    if not verify_owner_order(marketplace, signer_index, owner_address, owner_signature, owner_public_key,
+                              order_hash):
+        print("ERROR! A marketplace owner has not signed this order.")
+        return False
 
-    # Serialize and save the inventory back to the storage.
-    inventory_s = Serialize(inventory)
-    save_inventory(marketplace, taker_address, inventory_s)
+    # Total the quantity given per inventory key first, so that each key is read and written once.
+    quantities = {}
+    storage_keys = []
+    for grant in grants:
+        if len(grant) != 2:
+            print("ERROR! A grant must be an address and an item id.")
+            return False
+
+        address = grant[0]
+        if len(address) != 20:
+            print("ERROR! A grant must be given to an address.")
+            return False
+
+        storage_key = get_inventory_item_key(marketplace, address, grant[1])
+        if has_key(quantities, storage_key):
+            quantities[storage_key] = quantities[storage_key] + 1
+        else:
+            quantities[storage_key] = 1
+            storage_keys.append(storage_key)
+
+    set_order_complete(context, order_storage_key)
+
+    for storage_key in storage_keys:
+        item_count = Get(context, storage_key)
+        Put(context, storage_key, item_count + quantities[storage_key])
+
+    return True
+
+
+def give_item(context, storage_key, quantity):
+    """
+    Give a quantity of an item to an address on a specific marketplace.
+    :param storage_key: The inventory key of the item and address, see get_inventory_item_key.
+    """
+    # Each item id the address owns has its own key, holding how many the address owns.
+    item_count = Get(context, storage_key)
+    Put(context, storage_key, item_count + quantity)
 
     return True
 
@@ -655,58 +1225,98 @@ def remove_item_verified(marketplace, address, item_id, salt, owner_address,
         print("ERROR! Only a marketplace owner is allowed to give items.")
         return False
 
-    if order_complete(salt):
+    context = GetContext()
+    if get_marketplace_state(context, marketplace) == PENDING:
+        print("ERROR! The marketplace is paused.")
+        return False
+
+    order_storage_key = get_order_key(salt)
+    if order_complete(context, salt, order_storage_key):
         print("ERROR! This order has already occurred!")
         return False
 
-    args = ["remove_item", marketplace, address, item_id, 0, salt]
-    if not verify_order(owner_address, owner_signature, owner_public_key, args):
+    order_body = encode_order([marketplace, address, item_id])
+    order_hash = hash_order("remove_item", order_body, salt)
+    if not verify_order(owner_address, owner_signature, owner_public_key, order_hash):
         print("ERROR! A marketplace owner has not signed this order.")
         return False
 
-    owner_args = ["remove_item", marketplace, address, item_id, 0, salt]
-    if not verify_order(address, signature, public_key, owner_args):
+    if not verify_order(address, signature, public_key, order_hash):
         print("ERROR! The address removing has not signed this!")
         return False
 
-    if remove_item(marketplace, address, item_id):
-        set_order_complete(salt)
+    storage_key = get_inventory_item_key(marketplace, address, item_id)
+    if remove_item(context, storage_key):
+        set_order_complete(context, order_storage_key)
         return True
 
     return False
 
 
-def remove_item(marketplace, address, item_id):
+def remove_item(context, storage_key):
     """
     Remove an item from an address on a specific marketplace.
+    :param storage_key: The inventory key of the item and address, see get_inventory_item_key.
     """
-    inventory_s = get_inventory(marketplace, address)
-    if inventory_s != b'':
-        inventory = Deserialize(inventory_s)
-        current_index = 0
+    item_count = Get(context, storage_key)
 
-        for item in inventory:
-            if item == item_id:
-                inventory.remove(current_index)
-                inventory_s = Serialize(inventory)
-                save_inventory(marketplace, address, inventory_s)
-                return True
-            current_index += 1
+    if item_count < 1:
+        return False
 
-    return False
+    set_item_count(context, storage_key, item_count - 1)
+
+    return True
+
+
+def set_item_count(context, storage_key, item_count):
+    """
+    Helper method for inventory operations, the write path of an item count that may reach 0.
+    The key is removed entirely once the last one is gone, so enumerating the inventory skips it.
+    """
+    if item_count > 0:
+        Put(context, storage_key, item_count)
+    else:
+        Delete(context, storage_key)
+
+    return True
+
+
+def encode_order(fields):
+    """
+    The canonical encoding of an order body, every field as a byte array serialized after its length.
+    Fields are converted to byte arrays first, so an item id signed as an integer encodes as it does as bytes.
+    :param fields: The list of fields in the order.
+    :return: The serialized order body.
+    """
+    body = []
+    for field in fields:
+        body.append(concat(b'', field))
+
+    return Serialize(body)
+
+
+def hash_order(operation, body, suffix):
+    """
+    The digest an order signature covers, sha256 over the operation, the encoded order body and a suffix.
+    The body is serialized starting with its type, so the operation and suffix around it are never ambiguous.
+    :param operation: The name of the operation being signed.
+    :param body: The order body, from encode_order.
+    :param suffix: What the signing party adds to the body, usually its order salt.
+    """
+    message = concat(operation, body)
+    message = concat(message, suffix)
 
+    return sha256(message)
 
-def verify_order(address, signature, public_key, args):
+
+def verify_order(address, signature, public_key, order_hash):
     """
     Verify that an order is properly signed by a signature and public key.
+    The signature covers the hash of the order, see hash_order.
     We also ensure the public key can be recreated into the script hash
     so we know that it is the address that signed it.
     """
 
-    message = ""
-    for arg in args:
-        message = concat(message, arg)
-
     # Create the script hash from the given public key, to verify the address.
     redeem_script = b'21' + public_key + b'ac'
     script_hash = hash160(redeem_script)
@@ -716,7 +1326,29 @@ def verify_order(address, signature, public_key, args):
         print("ERROR! The public key does not match with the address who signed the order.")
         return False
 
-    if not verify_signature(public_key, signature, message):
+    if not verify_signature(public_key, signature, order_hash):
+        print("ERROR! Signature has not signed the order.")
+        return False
+
+    return True
+
+
+def verify_owner_order(marketplace, signer_index, address, signature, public_key, order_hash):
+    """
+    Verify an order signed by a marketplace owner.
+    A registered signer's public key was matched to its owner when it was registered, so only the signature
+    is verified, otherwise the address and public key are verified as in verify_order.
+    :param signer_index: The index of the signer registered by add_owner_signer, or 0 if not registered.
+    """
+    if signer_index == 0:
+        return verify_order(address, signature, public_key, order_hash)
+
+    public_key = get_owner_signer(marketplace, signer_index)
+    if public_key == b'':
+        print("ERROR! No signer is registered with this index.")
+        return False
+
+    if not verify_signature(public_key, signature, order_hash):
         print("ERROR! Signature has not signed the order.")
         return False
 
@@ -733,26 +1365,63 @@ def get_contract_state():
 def set_contract_state(state):
     """ Set the state of the contract. """
     context = GetContext()
-    Delete(context, contract_state_key)
     Put(context, contract_state_key, state)
 
     return True
 
 
-def set_order_complete(salt):
-    """ So an order is not repeated, user has signed a salt. """
+def resolve_marketplace_state(marketplace):
+    """
+    The state a marketplace is in. The contract's TERMINATED state overrides every marketplace,
+    otherwise the marketplace's own state applies, or the contract's if it has none.
+    """
+    contract_state = get_contract_state()
+    if contract_state == TERMINATED:
+        return TERMINATED
+
     context = GetContext()
-    key = concat(order_key, salt)
-    Put(context, key, True)
+    state = get_marketplace_state(context, marketplace)
+    if state == b'':
+        return contract_state
+
+    return state
+
+
+def is_marketplace_terminated(marketplace):
+    """
+    Whether anyone may use the terminated forms of trade, give_item and remove_item on a marketplace.
+    """
+    return resolve_marketplace_state(marketplace) == TERMINATED
+
+
+def get_order_key(salt):
+    """ The storage key marking the order signed with a salt as complete. """
+    return concat(order_key, salt)
+
+
+def set_order_complete(context, storage_key):
+    """ So an order is not repeated, user has signed a salt. """
+    Put(context, storage_key, True)
 
     return True
 
 
-def order_complete(salt):
-    """ Check if an order has already been completed."""
-    context = GetContext()
-    key = concat(order_key, salt)
-    exists = Get(context, key)
+def order_complete(context, salt, storage_key):
+    """
+    Check if an order has already been completed, or has expired and can no longer be completed.
+    :param storage_key: The order key of the salt, see get_order_key.
+    """
+    if len(salt) == ORDER_SALT_LENGTH:
+        height = GetHeight()
+        expiry = get_order_expiry(salt)
+        if expiry < height:
+            print("ERROR! This order has expired!")
+            return True
+        if expiry > height + MAX_ORDER_LIFETIME:
+            print("ERROR! This order expires too far in the future!")
+            return True
+
+    exists = Get(context, storage_key)
     if exists != b'':
         return True
 
@@ -760,55 +1429,63 @@ def order_complete(salt):
     # return exists != b''
 
 
-def increase_balance(address, amount):
+def get_order_expiry(salt):
+    """ The block height a compact salt expires at, stored little endian in its first 4 bytes. """
+    expiry = substr(salt, 0, ORDER_EXPIRY_LENGTH)
+    # Append a 0 byte so the height is never read as a negative number.
+    expiry = concat(expiry, b'\x00')
+    return expiry + 0
+
+
+def prune_orders(salts):
     """
-    Called on deposit to increase the amount of LOOT in storage of an address.
+    Delete the completion of expired orders, they are rejected by their expiry and no longer need to be stored.
+    Legacy salts never expire and are kept, as are elements that are not a byte array.
+    Completions are deleted without reading them first, so salts that were never completed or already pruned
+    are counted too.
+    :param salts: A list of compact salts.
+    :return: The number of expired salts considered.
     """
     context = GetContext()
+    height = GetHeight()
+    considered = 0
 
-    # LOOT balance is mapped directly to an address
-    key = address
-
-    current_balance = Get(context, key)
-    new_balance = current_balance + amount
+    for salt in salts:
+        if is_byte_array(salt) and len(salt) == ORDER_SALT_LENGTH:
+            if get_order_expiry(salt) < height:
+                key = concat(order_key, salt)
+                Delete(context, key)
+                considered += 1
 
-    Put(context, key, new_balance)
+    return considered
 
-    # Notify that address there deposit is complete
-    evt = ["deposit", address, amount]
-    Notify(evt)
 
-    return True
+def is_byte_array(item):
+    """ Check if an argument is a byte array rather than an integer, array or map, serializing starts with its type. """
+    item_s = Serialize(item)
+    return take(item_s, 1) == b'\x00'
 
 
-def reduce_balance(address, amount):
+def increase_balance(address, amount):
     """
-    Called on withdrawal, to reduce the amount of LOOT in storage of an address.
+    Called on deposit to increase the amount of LOOT in storage of an address.
     """
     context = GetContext()
-    if amount < 1:
-        print("ERROR! Can only reduce a balance >= 1. ")
-        return False
 
-    # LOOT is mapped directly to address
-    key = address
+    key = get_balance_key(address)
 
     current_balance = Get(context, key)
-    new_balance = current_balance - amount
+    new_balance = current_balance + amount
 
-    if new_balance < 0:
-        print("ERROR! Not enough balance to reduce!")
-        return False
+    set_balance(context, key, new_balance)
 
-    if new_balance > 0:
-        Put(context, key, new_balance)
-    else:
-        Delete(context, key)
+    # Notify that address there deposit is complete
+    evt = ["deposit", address, amount]
+    Notify(evt)
 
     return True
 
 
-
 def transfer_token_verified(originator_address, taker_address, tokens, originator_signature, originator_public_key,
                             owner_address, owner_signature, owner_public_key, salt):
     """
@@ -825,52 +1502,52 @@ def transfer_token_verified(originator_address, taker_address, tokens, originato
         print("ERROR! Address specified is not the contract owner.")
         return False
 
-    if order_complete(salt):
+    context = GetContext()
+    order_storage_key = get_order_key(salt)
+    if order_complete(context, salt, order_storage_key):
         print("ERROR! This order has already occurred!")
         return False
 
-    order_args = ["transfer", originator_address, taker_address, tokens, salt]
+    order_body = encode_order([originator_address, taker_address, tokens])
+    order_hash = hash_order("transfer", order_body, salt)
 
-    if not verify_order(owner_address, owner_signature, owner_public_key, order_args):
+    if not verify_order(owner_address, owner_signature, owner_public_key, order_hash):
         print("ERROR! The contract owner has not signed this order.")
         return False
 
-    if not verify_order(originator_address, originator_signature, originator_public_key, order_args):
+    if not verify_order(originator_address, originator_signature, originator_public_key, order_hash):
         print("ERROR! The address transferring tokens has not signed this!")
         return False
 
-    if transfer_token(originator_address, taker_address, tokens):
-        order_complete(salt)
+    if transfer_token(context, originator_address, taker_address, tokens):
+        set_order_complete(context, order_storage_key)
         return True
 
     return False
 
 
-def transfer_token_to(address_to, amount):
+def transfer_token_to(context, address_to, amount):
     """
     Transfer the specified amount of LOOT to an address within the smart contract..
     """
-    context = GetContext()
-
     # The amount being transferred must be >= 1.
     if amount < 1:
         print("ERROR! Can only transfer an amount >= 1. ")
         return False
 
     # Add the LOOT to the address receiving the tokens and save it to storage.
-    balance_to = balance_of(address_to)
+    balance_to_key = get_balance_key(address_to)
+    balance_to = Get(context, balance_to_key)
     balance_to += amount
-    Delete(context, address_to)
-    Put(context, address_to, balance_to)
+    set_balance(context, balance_to_key, balance_to)
 
     return True
 
 
-def transfer_token(address_from, address_to, amount):
+def transfer_token(context, address_from, address_to, amount):
     """
     Transfer the specified amount of LOOT from an address, to an address.
     """
-    context = GetContext()
 
     # The amount being transferred must be > 0.
     if amount <= 0:
@@ -881,20 +1558,20 @@ def transfer_token(address_from, address_to, amount):
         return True
 
     # If the balance of the address sending the LOOT does not have enough, return False.
-    balance_from = balance_of(address_from)
+    balance_from_key = get_balance_key(address_from)
+    balance_from = Get(context, balance_from_key)
     if balance_from < amount:
         return False
 
     # Subtract the amount from the address sending the LOOT and save it to storage.
     balance_from -= amount
-    Delete(context, address_from)
-    Put(context, address_from, balance_from)
+    set_balance(context, balance_from_key, balance_from)
 
     # Add the LOOT to the address receiving the tokens and save it to storage.
-    balance_to = balance_of(address_to)
+    balance_to_key = get_balance_key(address_to)
+    balance_to = Get(context, balance_to_key)
     balance_to += amount
-    Delete(context, address_to)
-    Put(context, address_to, balance_to)
+    set_balance(context, balance_to_key, balance_to)
 
     return True
 
@@ -928,183 +1605,528 @@ def withdrawal_verified(my_hash, originator_address, tokens, originator_signatur
         print("ERROR! Owner address specified is not the contract owner.")
         return False
 
-    if order_complete(salt):
+    context = GetContext()
+    order_storage_key = get_order_key(salt)
+    if order_complete(context, salt, order_storage_key):
         print("ERROR! This order has already occurred!")
         return False
 
-    order_args = ["withdraw", originator_address, tokens, salt]
+    order_body = encode_order([originator_address, tokens])
+    order_hash = hash_order("withdraw", order_body, salt)
+
+    if not verify_order(owner_address, owner_signature, owner_public_key, order_hash):
+        print("ERROR! The contract owner has not signed this order.")
+        return False
+
+    if not verify_order(originator_address, originator_signature, originator_public_key, order_hash):
+        print("ERROR! The address transferring tokens has not signed this!")
+        return False
+
+    if withdrawal(context, my_hash, originator_address, tokens):
+        set_order_complete(context, order_storage_key)
+        return True
+
+    return False
+
+
+def withdrawal(context, my_hash, originator_address, tokens):
+    """ Withdraw from the smart contract, invoking the Loot NEP-5 contract. """
+
+    storage_key = get_balance_key(originator_address)
+    balance = Get(context, storage_key)
+    if tokens < 1 or tokens > balance:
+        print("ERROR!: Unable to withdraw from contract!")
+        return False
+
+    params = [my_hash, originator_address, tokens]
+    # if the transfer to the nep5 contract was successful, reduce the balance of their address in this contract
+    if LootContract('transfer', params):
+        set_balance(context, storage_key, balance - tokens)
+        return True
+
+    return False
+
+
+def balance_of(address):
+    """
+    Query the LOOT balance of an address.
+    """
+    context = GetContext()
+    key = get_balance_key(address)
+    balance = Get(context, key)
+    return balance
+
+
+def get_balance_key(address):
+    """
+    Helper method for balance operations, the storage key holding the LOOT balance of an address.
+    """
+    return concat(balance_key, address)
+
+
+def set_balance(context, storage_key, balance):
+    """
+    Helper method for balance operations, the single write path of a balance.
+    Put overwrites the stored balance, an empty balance is deleted rather than stored.
+    :param storage_key: The balance key of the address, see get_balance_key.
+    """
+    if balance > 0:
+        Put(context, storage_key, encode_balance(balance))
+    else:
+        Delete(context, storage_key)
+    return True
+
+
+def encode_balance(amount):
+    """
+    Helper method for balance operations, an amount as a BALANCE_LENGTH byte little endian integer.
+    Stored balances still convert to integers by adding 0, the zero padding does not change their value.
+    """
+    return encode_integer(amount, BALANCE_LENGTH)
+
+
+def encode_integer(value, length):
+    """
+    Helper method for fixed width storage, a value as a little endian integer padded with zero bytes to length.
+    """
+    value_bytes = concat(b'', value)
+    padding = take(BALANCE_PADDING, length - len(value_bytes))
+    return concat(value_bytes, padding)
+
+
+def migrate_balance(address):
+    """
+    Move a balance stored under the bare address to its balance key.
+    """
+    context = GetContext()
+
+    balance = Get(context, address)
+    if balance == b'':
+        print("ERROR! There is no balance to migrate.")
+        return False
+
+    key = get_balance_key(address)
+    current_balance = Get(context, key)
+    new_balance = current_balance + balance
+
+    set_balance(context, key, new_balance)
+    Delete(context, address)
+
+    return True
+
+
+# endregion
+
+
+def calculate_fees_of_order(details, price):
+    """When an order has been filled between two parties, the owner of the
+    marketplace can optionally take some fees.
+    Maker gets charged once the order is filled.
+    Taker get charged upon buying the order.
+    :param details: The record of the marketplace, see get_marketplace.
+    :return: A list [maker_fee, taker_fee] of the fees charged on the price."""
+
+    # When a user buys -> they are charged a little extra
+    # When a user sells -> they receive the price they put - some fees
+    maker_fee = (price * details[1]) / feeFactor
+    taker_fee = (price * details[2]) / feeFactor
+
+    return [maker_fee, taker_fee]
+
+
+def get_inventory_prefix(marketplace, address):
+    """
+    Helper method for inventory operations, the storage key prefix shared by every item an address owns.
+    """
+    inventory_marketplace_key = concat(inventory_key, marketplace)
+    inventory_address_key = concat(inventory_marketplace_key, address)
+    return concat(inventory_address_key, inventory_item_separator)
+
+
+def get_inventory_item_key(marketplace, address, item_id):
+    """
+    Helper method for inventory operations, the storage key holding how many of an item an address owns.
+    """
+    inventory_prefix = get_inventory_prefix(marketplace, address)
+    return concat(inventory_prefix, item_id)
+
+
+def get_inventory(marketplace, address):
+    """
+    Get the items the address owns on a marketplace.
+    :return: A list of [item_id, count] pairs.
+    """
+    context = GetContext()
+
+    inventory_prefix = get_inventory_prefix(marketplace, address)
+    prefix_length = len(inventory_prefix)
+
+    inventory = []
+    items = Find(context, inventory_prefix)
+    while IterNext(items):
+        storage_key = IterKey(items)
+        item_id_length = len(storage_key) - prefix_length
+        # Adding 0 converts the stored bytes back into integers.
+        item_id = substr(storage_key, prefix_length, item_id_length) + 0
+        item_count = IterValue(items) + 0
+        inventory.append([item_id, item_count])
+
+    return inventory
+
+
+def migrate_inventory(marketplace, address):
+    """
+    Move an inventory saved as a single serialized list of items into per item keys.
+    Ownership does not change, so anyone may migrate an address.
+    """
+    context = GetContext()
+
+    inventory_marketplace_key = concat(inventory_key, marketplace)
+    legacy_key = concat(inventory_marketplace_key, address)
+    inventory_s = Get(context, legacy_key)
+
+    if inventory_s == b'':
+        print("ERROR! There is no inventory to migrate.")
+        return False
+
+    # The legacy list holds an entry per copy, so copies are counted per item id first and each key written once.
+    inventory = Deserialize(inventory_s)
+    quantities = {}
+    item_ids = []
+    for item_id in inventory:
+        if has_key(quantities, item_id):
+            quantities[item_id] = quantities[item_id] + 1
+        else:
+            quantities[item_id] = 1
+            item_ids.append(item_id)
+
+    for item_id in item_ids:
+        storage_key = get_inventory_item_key(marketplace, address, item_id)
+        give_item(context, storage_key, quantities[item_id])
+
+    Delete(context, legacy_key)
+
+    return True
+
+
+def read_cached(context, cache, storage_key):
+    """
+    Helper method for batched operations, a storage key is only read the first time it is needed.
+    The cache maps each storage key to a list of [stored value, current value].
+    """
+    if has_key(cache, storage_key):
+        entry = cache[storage_key]
+        return entry[1]
+
+    stored_value = Get(context, storage_key)
+    cache[storage_key] = [stored_value, stored_value]
+    return stored_value
+
+
+def write_cached(cache, storage_key, value):
+    """
+    Helper method for batched operations, updates the current value of a key read with read_cached.
+    """
+    entry = cache[storage_key]
+    entry[1] = value
+    return True
+
+
+def flush_cached(context, cache):
+    """
+    Helper method for batched operations, writes every cached key whose value changed.
+    Keys holding an amount of 0 are deleted.
+    """
+    for storage_key in keys(cache):
+        entry = cache[storage_key]
+        if entry[1] != entry[0]:
+            if entry[1] > 0:
+                Put(context, storage_key, entry[1])
+            else:
+                Delete(context, storage_key)
+    return True
+
+
+def storage_get(context, cache, storage_key):
+    """
+    Helper method for storage access, reads a key through the invocation's cache so it is only read once.
+    The cache maps each storage key to its current value, and is kept current by storage_put and storage_delete.
+    """
+    if has_key(cache, storage_key):
+        return cache[storage_key]
+
+    value = Get(context, storage_key)
+    cache[storage_key] = value
+    return value
+
+
+def storage_put(context, cache, storage_key, value):
+    """
+    Helper method for storage access, the single write path of a cached key.
+    Put overwrites the stored value, so nothing needs to be read or deleted first.
+    """
+    Put(context, storage_key, value)
+    cache[storage_key] = value
+    return True
+
 
-    if not verify_order(owner_address, owner_signature, owner_public_key, order_args):
-        print("ERROR! The contract owner has not signed this order.")
-        return False
+def storage_delete(context, cache, storage_key):
+    """
+    Helper method for storage access, deleting a key that does not exist is harmless so it is not read first.
+    """
+    Delete(context, storage_key)
+    cache[storage_key] = b''
+    return True
 
-    if not verify_order(originator_address, originator_signature, originator_public_key, order_args):
-        print("ERROR! The address transferring tokens has not signed this!")
-        return False
 
-    return withdrawal(my_hash, originator_address, tokens)
+# Marketplace Administration
 
+def register_marketplace(marketplace, address, maker_fee, taker_fee):
+    """
+    Register a new marketplace on the blockchain, writing its record and appending it to the registry.
+    They can set their fees, the address registering the marketplace receives them.
+    Marketplaces registered before records existed can be registered again to get one.
+    """
+    context = GetContext()
+    record_key = get_marketplace_key(marketplace)
+    if Get(context, record_key) != b'':
+        print("ERROR! The marketplace is already registered.")
+        return False
 
-def withdrawal(my_hash, originator_address, tokens):
-    """ Withdraw from the smart contract, invoking the Loot NEP-5 contract. """
+    if len(address) != 20:
+        print("ERROR! The owner address must be 20 bytes.")
+        return False
 
-    balance = balance_of(originator_address)
-    if tokens < 1 or tokens > balance:
-        print("ERROR!: Unable to withdraw from contract!")
+    details = [ACTIVE, maker_fee, taker_fee, 1, address]
+    if not set_marketplace(context, marketplace, details):
         return False
 
-    params = [my_hash, originator_address, tokens]
-    # if the transfer to the nep5 contract was successful, reduce the balance of their address in this contract
-    if LootContract('transfer', params):
-        reduce_balance(originator_address, tokens)
-        return True
+    # The registry is append only, the count is stored under the bare key and each name under its index.
+    registry_index = Get(context, registry_key) + 1
+    Put(context, registry_key, registry_index)
+    Put(context, get_registry_entry_key(registry_index), marketplace)
 
-    return False
+    owner_key = get_owner_key(marketplace, address)
+    Put(context, owner_key, address)
 
+    print("Successfully registered marketplace!")
+    return True
 
-def balance_of(address):
+
+def get_marketplace_key(marketplace):
     """
-    Query the LOOT balance of an address.
+    Helper method for marketplace operations, the storage key of the record of a marketplace.
     """
-    context = GetContext()
-    balance = Get(context, address)
-    return balance
+    return concat(marketplace_key, marketplace)
 
 
-# endregion
+def get_marketplace(context, marketplace):
+    """
+    Helper method for marketplace operations, everything about a marketplace is loaded from its record with one Get.
+    :return: A list [state, maker_fee, taker_fee, owner_count, fee_address], see encode_marketplace.
+             An unregistered marketplace has no state or fee address, and charges no fees.
+    """
+    record = Get(context, get_marketplace_key(marketplace))
+    if len(record) < MARKETPLACE_RECORD_LENGTH:
+        return [b'', 0, 0, 0, b'']
 
+    # Every field is at a fixed offset, and no integer field is large enough to be read as negative.
+    state = substr(record, 1, 1)
+    maker_fee = substr(record, 2, 2) + 0
+    taker_fee = substr(record, 4, 2) + 0
+    owner_count = substr(record, 6, 2) + 0
+    fee_address = substr(record, 8, 20)
 
-def calculate_fees_of_order(marketplace, maker_address, taker_address, amount):
-    """When an order has been filled between two parties, the owner of the
-    marketplace can optionally take some fees.
-    Maker gets charged once the order is filled.
-    Taker get charged upon buying the order."""
+    return [state, maker_fee, taker_fee, owner_count, fee_address]
 
-    # Get the fees for this marketplace
-    fee_address = get_fee_address(marketplace)
-    maker_fee_rate = get_maker_fee(marketplace)
-    taker_fee_rate = get_taker_fee(marketplace)
 
-    # When a user buys -> they are charged a little extra
-    # When a user sells -> they receive the price they put - some fees
-    maker_fee = (amount * maker_fee_rate) / feeFactor
-    taker_fee = (amount * taker_fee_rate) / feeFactor
+def set_marketplace(context, marketplace, details):
+    """
+    Helper method for marketplace operations, the single write path of the record of a marketplace.
+    :param details: A list [state, maker_fee, taker_fee, owner_count, fee_address], see get_marketplace.
+    """
+    maker_fee = details[1]
+    taker_fee = details[2]
+    fee_address = details[4]
 
-    print("Maker fee: " + maker_fee)
-    print("Taker fee: " + taker_fee)
-    # Give funds to the marketplace owner.
-    if not transfer_token(maker_address, fee_address, maker_fee):
+    if maker_fee < 0 or maker_fee > MAX_FEE:
+        print("ERROR! The maker fee is out of range.")
         return False
-    if not transfer_token(taker_address, fee_address, taker_fee):
+    if taker_fee < 0 or taker_fee > MAX_FEE:
+        print("ERROR! The taker fee is out of range.")
         return False
+    if len(fee_address) != 20:
+        print("ERROR! The fee address must be 20 bytes.")
+        return False
+
+    record = encode_marketplace(details)
+    Put(context, get_marketplace_key(marketplace), record)
 
     return True
 
 
-def save_inventory(marketplace, address, inventory):
+def encode_marketplace(details):
     """
-    Helper method for inventory operations, saves a serialized list of items to storage.
+    Helper method for marketplace operations, the fixed width record of a marketplace:
+    the record version, the state, 2 byte little endian maker fee, taker fee and owner count, then the fee address.
     """
-    context = GetContext()
+    record = concat(MARKETPLACE_RECORD_VERSION, details[0])
+    record = concat(record, encode_integer(details[1], 2))
+    record = concat(record, encode_integer(details[2], 2))
+    record = concat(record, encode_integer(details[3], 2))
+    return concat(record, details[4])
 
-    # Concatenate the specific storage key, delete the old storage
-    # and add the updated inventory into storage.
-    inventory_marketplace_key = concat(inventory_key, marketplace)
-    storage_key = concat(inventory_marketplace_key, address)
-    Delete(context, storage_key)
-    Put(context, storage_key, inventory)
 
-    return True
+def get_marketplace_state(context, marketplace):
+    """
+    Helper method for marketplace operations, the state held in a marketplace's record without decoding the rest.
+    :return: ACTIVE, PENDING while the marketplace is paused, TERMINATED, or an empty byte array if it has no record.
+    """
+    record = Get(context, get_marketplace_key(marketplace))
+    return substr(record, 1, 1)
 
 
-def get_inventory(marketplace, address):
+def set_marketplace_state(marketplace, state):
     """
-    Get the items the address owns on a marketplace.
+    Pause a marketplace with PENDING, terminate it with TERMINATED or open it again with ACTIVE.
+    A paused marketplace refuses every order, a terminated one also opens the terminated forms of
+    trade, give_item and remove_item to its users.
     """
+    if state != ACTIVE and state != PENDING and state != TERMINATED:
+        print("ERROR! Unknown marketplace state.")
+        return False
+
     context = GetContext()
+    details = get_marketplace(context, marketplace)
+    if details[0] == b'':
+        print("ERROR! The marketplace is not registered.")
+        return False
 
-    # Return the serialized inventory for the address.
-    inventory_marketplace_key = concat(inventory_key, marketplace)
-    storage_key = concat(inventory_marketplace_key, address)
-    items_serialized = Get(context, storage_key)
+    details[0] = state
+    return set_marketplace(context, marketplace, details)
 
-    return items_serialized
 
+def get_registry_entry_key(registry_index):
+    """ The storage key of a marketplace in the registry, the count of marketplaces is stored without the separator. """
+    key = concat(registry_key, "/")
+    return concat(key, registry_index)
 
-# Marketplace Administration
 
-def register_marketplace(marketplace, address, taker_fee, maker_fee):
+def get_marketplace_count():
     """
-    Register a new marketplace on the blockchain.
-    They can set their fees and the address the fees go to.
+    The number of marketplaces in the registry.
     """
-    if not set_maker_fee(marketplace, maker_fee):
-        return False
-    if not set_taker_fee(marketplace, taker_fee):
-        return False
-    if not set_fee_address(marketplace, address):
-        return False
-    if not add_owner_wallet(marketplace, address):
-        return False
-    # Concatenate the owner key and save the address into storage.
-
-    print("Successfully registered marketplace!")
-    return True
+    context = GetContext()
+    count = Get(context, registry_key)
+    return count + 0
 
 
-def set_maker_fee(marketplace, fee):
+def get_marketplaces(start, count):
     """
-    Maker fees, fees for selling.
+    List registered marketplaces in the order they were registered.
+    :param start: The index of the first marketplace, starting at 1.
+    :param count: How many marketplaces to list, at most MAX_MARKETPLACES_LISTED.
+    :return: A list of marketplace names, shorter than count at the end of the registry.
     """
-    if fee > MAX_FEE:
-        return False
-    if fee < 0:
-        return False
     context = GetContext()
+    if count > MAX_MARKETPLACES_LISTED:
+        count = MAX_MARKETPLACES_LISTED
 
-    key = concat("makerFee", marketplace)
-    Put(context, key, fee)
+    end = Get(context, registry_key) + 1
+    if start + count < end:
+        end = start + count
 
-    return True
+    marketplaces = []
+    for registry_index in range(start, end):
+        marketplaces.append(Get(context, get_registry_entry_key(registry_index)))
+
+    return marketplaces
+
+
+def set_maker_fee(marketplace, address, fee):
+    """
+    Maker fees, fees for selling.
+    """
+    return set_fee(marketplace, address, 1, fee)
 
 
-def set_taker_fee(marketplace, fee):
+def set_taker_fee(marketplace, address, fee):
     """
     Taker fees, fees for buying.
     """
-    if fee > MAX_FEE:
+    return set_fee(marketplace, address, 2, fee)
+
+
+def set_fee(marketplace, address, fee_index, fee):
+    """
+    Helper method for set_maker_fee and set_taker_fee, a marketplace owner changes one fee of the marketplace record.
+    :param fee_index: 1 for the maker fee, 2 for the taker fee, their index in the record, see get_marketplace.
+    """
+    if not is_marketplace_owner(marketplace, address):
+        print("ERROR! Only a marketplace owner can set its fees.")
         return False
-    if fee < 0:
+
+    if not CheckWitness(address):
+        print("ERROR! The owner is not a witness of the transaction.")
         return False
 
     context = GetContext()
-    key = concat("takerFee", marketplace)
-    Put(context, key, fee)
+    details = get_marketplace(context, marketplace)
+    if details[0] == b'':
+        print("ERROR! The marketplace is not registered.")
+        return False
+    details[fee_index] = fee
 
-    return True
+    return set_marketplace(context, marketplace, details)
 
 
-def set_fee_address(marketplace, address):
+def get_accrued_fees_key(marketplace):
     """
-    Set who will receive the fees for this marketplace.
+    Helper method for fee operations, the storage key of the fees a marketplace has charged since the last sweep.
     """
-    if len(address) != 20:
-        return False
-    context = GetContext()
-    key = concat("feeAddress", marketplace)
-    Put(context, key, address)
+    return concat(accrued_fees_key, marketplace)
 
-    return True
+
+def get_accrued_fees(marketplace):
+    """
+    Get the fees a marketplace has charged since they were last swept.
+    """
+    context = GetContext()
+    accrued_fees = Get(context, get_accrued_fees_key(marketplace))
+    return accrued_fees + 0
 
 
-def get_fee_address(marketplace):
+def sweep_fees(marketplace, address):
     """
-    Get the taker fees set in a marketplace.
+    Move the fees a marketplace has charged since the last sweep to the balance of its fee address.
+    Exchanges only add to one counter per marketplace, the fee address is written here once for all of them.
+    :param address: A marketplace owner, witnessing the transaction.
+    :return: The amount swept, 0 if nothing was swept.
     """
+    if not is_marketplace_owner(marketplace, address):
+        print("ERROR! Only a marketplace owner can sweep its fees.")
+        return 0
+
+    if not CheckWitness(address):
+        print("ERROR! The owner is not a witness of the transaction.")
+        return 0
+
     context = GetContext()
-    key = concat("feeAddress", marketplace)
-    fee_address = Get(context, key)
-    return fee_address
+    accrued_key = get_accrued_fees_key(marketplace)
+    accrued_fees = Get(context, accrued_key) + 0
+    if accrued_fees < 1:
+        print("ERROR! There are no fees to sweep.")
+        return 0
+
+    details = get_marketplace(context, marketplace)
+    fee_address = details[4]
+    transfer_token_to(context, fee_address, accrued_fees)
+    Delete(context, accrued_key)
+
+    payload = ["sweep_fees", marketplace, fee_address, accrued_fees]
+    Notify(payload)
+
+    return accrued_fees
 
 
 def get_maker_fee(marketplace):
@@ -1112,9 +2134,8 @@ def get_maker_fee(marketplace):
     Get the maker fees set in a marketplace.
     """
     context = GetContext()
-    key = concat("makerFee", marketplace)
-    maker_fee = Get(context, key)
-    return maker_fee
+    details = get_marketplace(context, marketplace)
+    return details[1]
 
 
 def get_taker_fee(marketplace):
@@ -1122,25 +2143,73 @@ def get_taker_fee(marketplace):
     Get the taker fees set in a marketplace.
     """
     context = GetContext()
-    key = concat("takerFee", marketplace)
-    taker_fee = Get(context, key)
-    return taker_fee
+    details = get_marketplace(context, marketplace)
+    return details[2]
 
 
 def add_owner_wallet(marketplace, address):
     """
     Add an owner wallet, giving them exclusive rights to their marketplace.
+    The marketplace record counts its owners.
     """
     context = GetContext()
-    key_part1 = concat("key", address)
-    owner_key = concat(marketplace, key_part1)
-    owner = Get(context, owner_key)
+    owner_key = get_owner_key(marketplace, address)
+    if Get(context, owner_key) != b'':
+        return False
 
-    if owner == b'':
-        Put(context, owner_key, address)
-        return True
+    details = get_marketplace(context, marketplace)
+    if details[0] == b'':
+        print("ERROR! The marketplace is not registered.")
+        return False
+
+    details[3] = details[3] + 1
+    set_marketplace(context, marketplace, details)
+    Put(context, owner_key, address)
+
+    return True
+
+
+def add_owner_signer(marketplace, address, public_key):
+    """
+    Register the public key of a marketplace owner, orders it signs can then refer to it by index
+    instead of carrying the address and public key to be hashed and compared every time.
+    :return: The index of the signer, starting at 1, or 0 if it could not be registered.
+    """
+    if not is_marketplace_owner(marketplace, address):
+        print("ERROR! Only a marketplace owner can register a signer.")
+        return 0
+
+    if not CheckWitness(address):
+        print("ERROR! The owner is not a witness of the transaction.")
+        return 0
+
+    # The public key is matched to the owner's address once, here.
+    redeem_script = b'21' + public_key + b'ac'
+    script_hash = hash160(redeem_script)
+    if script_hash != address:
+        print("ERROR! The public key does not match with the address.")
+        return 0
+
+    context = GetContext()
+    count_key = concat(owner_signer_key, marketplace)
+    signer_index = Get(context, count_key) + 1
+    Put(context, count_key, signer_index)
+    Put(context, get_owner_signer_key(marketplace, signer_index), public_key)
+
+    return signer_index
+
+
+def get_owner_signer_key(marketplace, signer_index):
+    """ The storage key of a registered signer, the count of signers is stored without the separator. """
+    key = concat(owner_signer_key, marketplace)
+    key = concat(key, "/")
+    return concat(key, signer_index)
 
-    return False
+
+def get_owner_signer(marketplace, signer_index):
+    """ The public key of a registered signer, an empty byte array if there is none. """
+    context = GetContext()
+    return Get(context, get_owner_signer_key(marketplace, signer_index))
 
 
 # Saving marketplace owners in seperate storage, costs less to search rather than a less.
@@ -1149,13 +2218,20 @@ def is_marketplace_owner(marketplace, address):
     Check if the address is an owner of a marketplace.
     """
     context = GetContext()
-    key_part1 = concat("key", address)
-    owner_key = concat(marketplace, key_part1)
-    owner = Get(context, owner_key)
+    owner = Get(context, get_owner_key(marketplace, address))
 
     return owner != b''
 
 
+def get_owner_key(marketplace, address):
+    """
+    Helper method for marketplace operations, the storage key marking an address as an owner of a marketplace.
+    Owners are looked up by address, so each keeps its own key rather than a place in the marketplace record.
+    """
+    key_part1 = concat("key", address)
+    return concat(marketplace, key_part1)
+
+
 # endregion
 
 
@@ -1182,21 +2258,29 @@ def BR_create(event_code, marketplace, marketplace_owner_address, rewards):
         return False
 
     context = GetContext()
+    cache = {}
 
     # Ensure an event with this code does not already exist.
-    br_details_s = get_BR_event_details(context, event_code)
+    br_details_s = get_BR_event_details(context, cache, event_code)
 
     if br_details_s != b'':
         print("ERROR! Cannot start event: event code is not unique.")
         return False
 
+    # The code of an event stored in the legacy layout is taken, its rewards and marked zone are under the same keys.
+    legacy_key = concat(battle_royale_legacy_details_key, event_code)
+    if storage_get(context, cache, legacy_key) != b'':
+        print("ERROR! Cannot start event: event code is used by a legacy event.")
+        return False
+
     # Create a new set of details for the event, and save this to storage to be queryable.
     # TODO lists suffice for building, but if necessary these lists can be more neatly done with dictionaries.
-    br_details = [0, 0, marketplace_owner_address, False, 0, 0, 10, marketplace, 0]
-    set_BR_event_details(context, event_code, br_details)
+    # The last four are the live area of the map, its lowest and highest row and column, set when the event starts.
+    br_details = [0, 0, marketplace_owner_address, False, 0, 0, 10, marketplace, 0, 0, 0, 0, 0]
+    set_BR_event_details(context, cache, event_code, br_details)
 
     # Add rewards at stake for the contest, may be any number n, s.t. n <= 12 (16 max parameters, 4 used).
-    set_BR_rewards(context, event_code, rewards)
+    set_BR_rewards(context, cache, event_code, rewards)
 
     return True
 
@@ -1214,8 +2298,9 @@ def BR_start(event_code, address):
         return False
 
     context = GetContext()
+    cache = {}
 
-    br_details = get_BR_event_details(context, event_code)
+    br_details = get_BR_event_details(context, cache, event_code)
 
     if br_details == b'':
         print("ERROR! Cannot start event, it does not exist.")
@@ -1227,13 +2312,13 @@ def BR_start(event_code, address):
         print("ERROR! Cannot start event, is not the owner of the event.")
         return False
 
-    player_list = get_BR_player_list(context, event_code)
-    if player_list == b'':
+    # Every player signed up has a slot.
+    alive_players = get_BR_alive_players(context, cache, event_code)
+    player_count = len(alive_players)
+    if player_count == 0:
         print("ERROR! No players, cannot start the match.")
         return False
 
-    player_list = Deserialize(player_list)
-    player_count = len(player_list)
     # Determine how large the x * y grid will be.
     # Starts at 3 x 3 currently for each player to keep a square shaped grid.
     player_count -= 1
@@ -1243,11 +2328,16 @@ def BR_start(event_code, address):
     # Take one as player can land at zones 0-15.
     grid_capacity -= 1
     br_details[1] = grid_capacity
+    # The whole map is live until zones are destroyed.
+    br_details[9] = 0
+    br_details[10] = grid_length - 1
+    br_details[11] = 0
+    br_details[12] = grid_length - 1
     # Set the event to has begun.
     br_details[3] = True
     # Set the block in which the round has started, used an approximate time reference.
     br_details[4] = GetHeight()
-    set_BR_event_details(context, event_code, br_details)
+    set_BR_event_details(context, cache, event_code, br_details)
 
     return True
 
@@ -1260,9 +2350,10 @@ def BR_sign_up(event_code, address):
     :return: If signed up successfully.
     """
     context = GetContext()
+    cache = {}
 
     # Get the stored details of the event.
-    br_details = get_BR_event_details(context, event_code)
+    br_details = get_BR_event_details(context, cache, event_code)
 
     if br_details == b'':
         print("ERROR! Cannot sign up to the event, there is no event running with this code.")
@@ -1278,24 +2369,21 @@ def BR_sign_up(event_code, address):
         print("ERROR! Cannot sign up to an event, witness is not attached to tx.")
         return False
 
-    stored_entrant = get_BR_entrant_details(context, event_code, address)
+    stored_slot = get_BR_entrant_slot(context, cache, event_code, address)
 
-    if stored_entrant != b'':
+    if stored_slot != b'':
         print("ERROR! Cannot sign up to event, this address is already signed up.")
         return False
 
-    # Add this player to a list of the active players and save into storage.
-    list_of_players = get_BR_player_list(context, event_code)
-    if list_of_players == b'':
-        list_of_players = []
-    else:
-        list_of_players = Deserialize(list_of_players)
-    list_of_players.append(address)
-    set_BR_player_list(context, event_code, list_of_players)
+    # Give this player the next slot and mark it as playing, one byte is added to the remaining players.
+    alive_players = get_BR_alive_players(context, cache, event_code)
+    slot = len(alive_players)
+    set_BR_alive_players(context, cache, event_code, concat(alive_players, BR_ALIVE))
+    set_BR_entrant_slot(context, cache, event_code, address, slot)
 
-    # Create a new entrant information list, and add it into storage so it may be queried.
-    entrant_information = [0, 0, "", 0]
-    set_BR_entrant_details(context, event_code, address, entrant_information)
+    # Create a new entrant information record, and add it into storage so it may be queried.
+    entrant_information = [0, 0, BR_ACTION_UNKNOWN, BR_DIRECTION_NONE]
+    add_BR_entrant(context, cache, event_code, slot, address, entrant_information)
 
     return True
 
@@ -1309,13 +2397,14 @@ def BR_choose_initial_grid_position(event_code, address, zone):
     :return: True if chooses initial zone/grid position.
     """
     context = GetContext()
+    cache = {}
 
     if not CheckWitness(address):
         print("ERROR! Cannot sign up to an event, witness is not attached to tx.")
         return False
 
     # Ensure the event exists.
-    event_details = get_BR_event_details(context, event_code)
+    event_details = get_BR_event_details(context, cache, event_code)
 
     if event_details == b'':
         print("ERROR! Cannot perform initial grid choice, event does not exist.")
@@ -1329,13 +2418,15 @@ def BR_choose_initial_grid_position(event_code, address, zone):
         print("ERROR! Cannot perform spawn, round 0 has finished.")
         return False
 
-    entrant_details = get_BR_entrant_details(context, event_code, address)
+    slot = get_BR_entrant_slot(context, cache, event_code, address)
 
-    if entrant_details == b'':
+    if slot == b'':
         print("ERROR! Cannot perform spawn, entrant does not exist in this event.")
         return False
 
-    entrant_details = Deserialize(entrant_details)
+    slot = slot + 0
+    entrant_details = get_BR_entrant_details(context, cache, event_code, slot)
+    entrant_details = decode_BR_entrant(entrant_details)
 
     # Ensure the entrant is in round 0, e.g. they have not already landed.
     if entrant_details[1] > 0:
@@ -1352,7 +2443,8 @@ def BR_choose_initial_grid_position(event_code, address, zone):
     entrant_details[1] = 1
     # Move them to the zone.
     entrant_details[0] = zone
-    set_BR_entrant_details(context, event_code, address, entrant_details)
+    set_BR_entrant_details(context, cache, event_code, slot, entrant_details)
+    BR_enter_zone(event_code, slot, zone, context, cache)
 
     return True
 
@@ -1368,12 +2460,13 @@ def BR_do_action(event_code, address, action, direction):
     '''
 
     context = GetContext()
+    cache = {}
 
     if not CheckWitness(address):
         print("ERROR: Cannot sign up to an event, witness is not attached to tx.")
         return False
 
-    event_details = get_BR_event_details(context, event_code)
+    event_details = get_BR_event_details(context, cache, event_code)
 
     if event_details == b'':
         print("ERROR: Cannot perform action, event does not exist.")
@@ -1381,13 +2474,15 @@ def BR_do_action(event_code, address, action, direction):
 
     event_details = Deserialize(event_details)
 
-    entrant_details = get_BR_entrant_details(context, event_code, address)
+    slot = get_BR_entrant_slot(context, cache, event_code, address)
 
-    if entrant_details == b'':
+    if slot == b'':
         print("ERROR: Cannot perform action, entrant does not exist in this event.")
         return False
 
-    entrant_details = Deserialize(entrant_details)
+    slot = slot + 0
+    entrant_details = get_BR_entrant_details(context, cache, event_code, slot)
+    entrant_details = decode_BR_entrant(entrant_details)
 
     if not event_details[3]:
         print("ERROR: Cannot resolve action, event has not begun.")
@@ -1405,28 +2500,31 @@ def BR_do_action(event_code, address, action, direction):
 
     # Update player details which will be resolved next.
     entrant_details[1] = event_details[0] + 1
-    entrant_details[2] = action
+    entrant_details[2] = BR_action_code(action)
+    if direction < 0 or direction > 3:
+        direction = BR_DIRECTION_NONE
     entrant_details[3] = direction
 
     # Save details and resolve the round.
-    set_BR_entrant_details(context, event_code, address, entrant_details)
+    set_BR_entrant_details(context, cache, event_code, slot, entrant_details)
 
-    BR_resolve_round(event_code, address, event_details, entrant_details)
+    BR_resolve_round(event_code, address, slot, event_details, entrant_details, context, cache)
 
     return True
 
 
-def BR_resolve_round(event_code, address, event_details, entrant_details):
+def BR_resolve_round(event_code, address, slot, event_details, entrant_details, context, cache):
     """
     Called internally by the smart contract to resolve a round after an address completes an action.
     :param event_code: The unique code of the event.
     :param address: The address performing the action.
+    :param slot: The slot of the address.
     :param event_details: The stored details of the event.
     :param entrant_details: The stored details of the entrant.
+    :param context: The storage context.
+    :param cache: The storage read during this invocation, see storage_get.
     """
 
-    context = GetContext()
-
     zone_caller_in = entrant_details[0]
     round_in = event_details[0]
     # This is why we have to store how many players we started the game so we can calculate boundaries.
@@ -1434,51 +2532,59 @@ def BR_resolve_round(event_code, address, event_details, entrant_details):
     caller_action = entrant_details[2]
 
     # Firstly, if the player is moving, perform that action.
-    if caller_action == 'move':
+    if caller_action == BR_ACTION_MOVE:
 
         # Get the direction we are moving.
         direction_moving = entrant_details[3]
 
         print(direction_moving)
 
-        # Traverse the grid in the direction we are moving.
-        zone_to = zone_caller_in
+        # Traverse the grid in the direction we are moving, by row and column so a move can not wrap around a side.
+        row_to = zone_caller_in / grid_side_length
+        column_to = zone_caller_in % grid_side_length
         # UP
         if direction_moving == 0:
-            zone_to += grid_side_length
+            row_to += 1
         # DOWN
         elif direction_moving == 1:
-            zone_to -= grid_side_length
+            row_to -= 1
         # RIGHT
         elif direction_moving == 2:
-            zone_to += 1
+            column_to += 1
         # LEFT
         elif direction_moving == 3:
-            zone_to -= 1
+            column_to -= 1
 
-        # If doing this move has not made us out of bounds, we can move the player.
-        if not is_player_out_of_bounds(zone_to, grid_side_length, direction_moving, 0):
+        zone_to = row_to * grid_side_length + column_to
+
+        # If doing this move keeps us in the live area, we can move the player.
+        # The live area excludes the side marked to be destroyed, as well as the destroyed sides and the map's edges.
+        if zone_to != zone_caller_in and is_in_live_area(row_to, column_to, event_details):
             # Move zone and save details.
             entrant_details[0] = zone_to
-            set_BR_entrant_details(context, event_code, address, entrant_details)
+            set_BR_entrant_details(context, cache, event_code, slot, entrant_details)
+            BR_leave_zone(event_code, slot, zone_caller_in, context, cache)
+            BR_enter_zone(event_code, slot, zone_to, context, cache)
             zone_caller_in = zone_to
 
-    # Find the complete list of players who are not this address in the same zone.
+    # Find the players who are not this address in the same zone, only the zone's occupants are read.
     list_of_players_in_zone = []
     list_of_player_details_in_zone = []
-    list_of_players = get_BR_player_list(context, event_code)
-    list_of_players = Deserialize(list_of_players)
-
-    for player in list_of_players:  # ~ 10
-        if player != address:
-            entrant = get_BR_entrant_details(context, event_code, player)
-            if entrant != b'':
-                entrant = Deserialize(entrant)
-                # They must be in the same zone as the caller,
-                # and they must of had a chance to perform a move for this round.
-                if entrant[0] == zone_caller_in and entrant[1] == round_in + 1:
-                    list_of_players_in_zone.append(player)
-                    list_of_player_details_in_zone.append(entrant)
+    occupants = get_BR_zone_occupants(context, cache, event_code, zone_caller_in)
+    if occupants == b'':
+        occupants = []
+    else:
+        occupants = Deserialize(occupants)
+
+    for player_slot in occupants:
+        if player_slot != slot:
+            entrant = get_BR_entrant_details(context, cache, event_code, player_slot)
+            entrant = decode_BR_entrant(entrant)
+            # They must be in the same zone as the caller,
+            # and they must of had a chance to perform a move for this round.
+            if entrant[0] == zone_caller_in and entrant[1] == round_in + 1:
+                list_of_players_in_zone.append(player_slot)
+                list_of_player_details_in_zone.append(entrant)
 
     # Resolve the combat for the round, if there is at least one other player in the grid.
     player_count_in_zone = len(list_of_players_in_zone)
@@ -1487,7 +2593,8 @@ def BR_resolve_round(event_code, address, event_details, entrant_details):
         # Get a random player in the zone to fight, and their details.
         player_index_vs = random_number_upper_limit(player_count_in_zone)
 
-        address_vs = list_of_players_in_zone[player_index_vs]
+        slot_vs = list_of_players_in_zone[player_index_vs]
+        address_vs = get_BR_slot_address(context, cache, event_code, slot_vs)
         player_vs_details = list_of_player_details_in_zone[player_index_vs]
         opponent_action = player_vs_details[2]
 
@@ -1499,62 +2606,133 @@ def BR_resolve_round(event_code, address, event_details, entrant_details):
 
         if battle_result:
             print("BATTLE! Win -> removing opponent from battle!")
-            BR_remove_player(event_code, address_vs)
+            BR_remove_players(event_code, [slot_vs], context, cache)
 
         else:
             print("BATTLE! Lost -> removing caller from battle!")
             # Remove and return true as complete.
-            BR_remove_player(event_code, address)
+            BR_remove_players(event_code, [slot], context, cache)
             return False
 
     # If a player is looting and survived the round, we can loot items.
-    if caller_action == "loot":
+    if caller_action == BR_ACTION_LOOT:
         BR_loot_action(event_code, round_in, address)
 
     return True
 
 
-def BR_remove_player(event_code, address):
+def BR_remove_players(event_code, removed_slots, context, cache):
     '''
-    Remove a player from the BR, after they lose determined by the sc.
-    :param event_code:
-    :param address:
-    :return:
+    Remove players from the BR, after they lose determined by the sc.
+    Each player is added to the leaderboard and their slot is marked as knocked out.
+    The list of remaining players and each page of the leaderboard are written once however many are removed.
+    :param event_code: The unique code of the event.
+    :param removed_slots: The slots of the players knocked out, in the order they are added to the leaderboard.
+    :param context: The storage context.
+    :param cache: The storage read during this invocation, see storage_get.
+    :return: True
     '''
-    # remove or mark as destroyed?
-    context = GetContext()
+    if len(removed_slots) == 0:
+        return True
+
+    alive_players = get_BR_alive_players(context, cache, event_code)
+    leaderboard_count = get_BR_leaderboard_count(context, cache, event_code)
+    page_number = leaderboard_count / BR_LEADERBOARD_PAGE_LENGTH
+    page = get_BR_leaderboard_page(context, cache, event_code, page_number)
+
+    for slot in removed_slots:
+        # Simply add the address to the leaderboard,
+        # and we display them in order of being knocked out, last player wins.
+        if leaderboard_count / BR_LEADERBOARD_PAGE_LENGTH != page_number:
+            set_BR_leaderboard_page(context, cache, event_code, page_number, page)
+            page_number = leaderboard_count / BR_LEADERBOARD_PAGE_LENGTH
+            page = b''
+        address = get_BR_slot_address(context, cache, event_code, slot)
+        page = concat(page, address)
+        leaderboard_count += 1
+
+        alive_players = BR_knock_out_slot(alive_players, slot)
+
+        # Take the player off the map, players that never landed are in no zone.
+        entrant = get_BR_entrant_details(context, cache, event_code, slot)
+        entrant = decode_BR_entrant(entrant)
+        if entrant[1] > 0:
+            BR_leave_zone(event_code, slot, entrant[0], context, cache)
+
+        # Delete their slot so they can not perform any other action.
+        remove_BR_entrant_slot(context, cache, event_code, address)
+
+    set_BR_leaderboard_page(context, cache, event_code, page_number, page)
+    set_BR_leaderboard_count(context, cache, event_code, leaderboard_count)
+    set_BR_alive_players(context, cache, event_code, alive_players)
+
+    return True
+
+
+def BR_knock_out_slot(alive_players, slot):
+    '''
+    Mark a slot of the list of remaining players as knocked out.
+    :param alive_players: One byte for every slot, see get_BR_alive_players.
+    :param slot: The slot of the player knocked out.
+    :return: The updated list of remaining players.
+    '''
+    remaining_length = len(alive_players) - slot - 1
+    alive_players_after = substr(alive_players, slot + 1, remaining_length)
+    alive_players_before = take(alive_players, slot)
+    alive_players_before = concat(alive_players_before, BR_KNOCKED_OUT)
+    return concat(alive_players_before, alive_players_after)
+
 
-    # Simply add the address to the leaderboard list,
-    # and we display them in order of being knocked out, last player wins.
-    leaderboard = get_BR_leaderboard(context, event_code)
+def BR_enter_zone(event_code, slot, zone, context, cache):
+    '''
+    Add a player to the occupants of the zone they landed or moved in.
+    :param event_code: The unique code of the event.
+    :param slot: The slot of the player.
+    :param zone: The zone the player is now in.
+    :param context: The storage context.
+    :param cache: The storage read during this invocation, see storage_get.
+    :return: True
+    '''
+    occupants = get_BR_zone_occupants(context, cache, event_code, zone)
 
-    if leaderboard == b'':
-        leaderboard = [address]
+    if occupants == b'':
+        occupants = [slot]
     else:
-        leaderboard = Deserialize(leaderboard)
-        leaderboard.append(address)
+        occupants = Deserialize(occupants)
+        occupants.append(slot)
 
-    set_BR_leaderboard(context, event_code, leaderboard)
+    set_BR_zone_occupants(context, cache, event_code, zone, occupants)
 
-    # Delete the entrant details so they can not perform any other action.
-    half_key = concat(battle_royale_entrant_key, event_code)
-    complete_key = concat(half_key, address)
-    Delete(context, complete_key)
+    return True
+
+
+def BR_leave_zone(event_code, slot, zone, context, cache):
+    '''
+    Remove a player from the occupants of the zone they moved out of or were removed in.
+    :param event_code: The unique code of the event.
+    :param slot: The slot of the player.
+    :param zone: The zone the player was in.
+    :param context: The storage context.
+    :param cache: The storage read during this invocation, see storage_get.
+    :return: True if the player was in the zone.
+    '''
+    occupants = get_BR_zone_occupants(context, cache, event_code, zone)
 
-    # Finally remove the address from the list of active players.
-    list_of_all_players = get_BR_player_list(context, event_code)
-    list_of_all_players = Deserialize(list_of_all_players)
+    if occupants == b'':
+        return False
+
+    occupants = Deserialize(occupants)
 
     current_index = 0
 
-    for player in list_of_all_players:
-        if player == address:
-            list_of_all_players.remove(current_index)
-            set_BR_player_list(context, event_code, list_of_all_players)
-            return list_of_all_players
+    for occupant in occupants:
+        if occupant == slot:
+            occupants.remove(current_index)
+            set_BR_zone_occupants(context, cache, event_code, zone, occupants)
+            return True
         current_index += 1
 
-    return list_of_all_players
+    return False
 
 
 def BR_loot_action(event_code, current_round, address):
@@ -1587,21 +2765,21 @@ def BR_loot_action(event_code, current_round, address):
 def BR_roll_combat(caller_action, opponent_action):
     """
     Internally called by the smart contract to fairly decide the outcome of combat between players.
-    :param caller_action: The action being performed by the caller.
-    :param opponent_action: The action being performed by the opponent.
+    :param caller_action: The action being performed by the caller, see BR_action_code.
+    :param opponent_action: The action being performed by the opponent, see BR_action_code.
     :return: True if the caller wins.
     """
 
-    if caller_action == "loot" or caller_action == "move":
+    if caller_action == BR_ACTION_LOOT or caller_action == BR_ACTION_MOVE:
         # If the caller is looting or moving they are at a disadvantage.
-        if opponent_action == "hide":
+        if opponent_action == BR_ACTION_HIDE:
             caller_win_chance = 40
         else:
             caller_win_chance = 50
 
-    elif caller_action == "hide":
+    elif caller_action == BR_ACTION_HIDE:
         # If the opponent is hiding they are at the advantage.
-        if opponent_action == "hide":
+        if opponent_action == BR_ACTION_HIDE:
             caller_win_chance = 50
         # If the caller is hiding and opponent is not hiding, caller has 60% chance to win
         else:
@@ -1613,6 +2791,21 @@ def BR_roll_combat(caller_action, opponent_action):
     return random_number_0_100() <= caller_win_chance
 
 
+def BR_action_code(action):
+    """
+    The single byte an action is stored as in an entrant record.
+    :param action: The action as given to BR_do_action, "move", "loot" or "hide".
+    :return: BR_ACTION_MOVE, BR_ACTION_LOOT, BR_ACTION_HIDE or BR_ACTION_UNKNOWN.
+    """
+    if action == "move":
+        return BR_ACTION_MOVE
+    if action == "loot":
+        return BR_ACTION_LOOT
+    if action == "hide":
+        return BR_ACTION_HIDE
+    return BR_ACTION_UNKNOWN
+
+
 def BR_finish_round(event_code):
     """
     Called by anyone to finish an event, will only finish if the conditions are met.
@@ -1623,9 +2816,10 @@ def BR_finish_round(event_code):
     """
 
     context = GetContext()
+    cache = {}
     height = GetHeight()
 
-    br_details = get_BR_event_details(context, event_code)
+    br_details = get_BR_event_details(context, cache, event_code)
 
     if br_details == b'':
         print("ERROR! Cannot end round, event does not exist.")
@@ -1642,16 +2836,15 @@ def BR_finish_round(event_code):
 
     # If 10 blocks have past, the round has timed out.
     if height - round_start_height >= BR_ROUND_TIMEOUT:
-        return BR_on_round_finish(event_code, br_details, context, height)
+        return BR_on_round_finish(event_code, br_details, context, cache, height)
     # If we have not timed out we check if every player has completed an action for this round so we can finish early.
     else:
-        list_of_players = get_BR_player_list(context, event_code)
-        list_of_players = Deserialize(list_of_players)
+        alive_players = get_BR_alive_players(context, cache, event_code)
 
-        for player in list_of_players:
-            entrant = get_BR_entrant_details(context, event_code, player)
-            if entrant != b'':
-                entrant = Deserialize(entrant)
+        for slot in range(0, len(alive_players)):
+            if substr(alive_players, slot, 1) == BR_ALIVE:
+                entrant = get_BR_entrant_details(context, cache, event_code, slot)
+                entrant = decode_BR_entrant(entrant)
                 if entrant[1] <= br_details[0]:
                     print("ERROR! A player has not made a move for this round.")
                     payload = ['BR', event_code, 'round_end', br_details[0], False]
@@ -1659,15 +2852,18 @@ def BR_finish_round(event_code):
                     return False
 
         # All players are done!
-        return BR_on_round_finish(event_code, br_details, context, height)
+        return BR_on_round_finish(event_code, br_details, context, cache, height)
 
 
-def BR_on_round_finish(event_code, br_details, context, height):
+def BR_on_round_finish(event_code, br_details, context, cache, height):
     """
     Called internally by the smart contract to conclude a round.
+    Every player is checked once, for an action this round and, once zones are destroyed, for being in bounds,
+    then all the players knocked out are removed together.
     :param event_code: The unique code of the event.
     :param br_details: The details of the BR event.
     :param context: The storage context.
+    :param cache: The storage read during this invocation, see storage_get.
     :param height: The current height of the blockchain.
     :return: True if the round was resolved.
     """
@@ -1675,60 +2871,71 @@ def BR_on_round_finish(event_code, br_details, context, height):
     # Set the height and increment the round.
     br_details[4] = height
     br_details[0] = br_details[0] + 1
+    round_on = br_details[0]
+    grid_length = br_details[8]
+
+    # Get the slots of the active players.
+    alive_players = get_BR_alive_players(context, cache, event_code)
+
+    removed_slots = []
+    remaining_slots = []
+
+    for slot in range(0, len(alive_players)):
+        if substr(alive_players, slot, 1) == BR_ALIVE:
+            entrant = get_BR_entrant_details(context, cache, event_code, slot)
+            entrant = decode_BR_entrant(entrant)
+            player_removed = False
+            # Did they perform an action this round before it timed out ? if not, remove them.
+            if entrant[1] != round_on:
+                player_removed = True
+            # Outside the live area, in a destroyed zone ? if so remove them.
+            else:
+                row = entrant[0] / grid_length
+                column = entrant[0] % grid_length
+                if not is_in_live_area(row, column, br_details):
+                    player_removed = True
+
+            if player_removed:
+                removed_slots.append(slot)
+            else:
+                remaining_slots.append(slot)
+
+    # Notify each removal, in the order they are added to the leaderboard.
+    for slot in removed_slots:
+        payload = ["BR", event_code, "removed_player", get_BR_slot_address(context, cache, event_code, slot)]
+        Notify(payload)
 
-    # Update BR details to next round.
-    set_BR_event_details(context, event_code, br_details)
-
-    # Get the list of active players.
-    list_of_players = get_BR_player_list(context, event_code)
-    list_of_players = Deserialize(list_of_players)
-
-    # Check if zone needs to be destroyed now,
-    # we can bundle that up with checking if they have moved to save gas.
-    if br_details[0] >= ROUND_DESTROYED_ZONES_GENERATE:
-        # Returns a list of players that survived through the destroyed zones.
-        list_of_players = BR_destroy_next_zone(event_code, br_details[0], br_details[8])
-    # If we have not checked players that have not moved yet, do so.
-    else:
-        # Remove players that did not perform an action this turn.
-        # This has to occur is seperate steps or will not work as we cannot mutate a list during iteration.
-        removed_players_address = []
-
-        for player in list_of_players:
-            entrant = get_BR_entrant_details(context, event_code, player)
-            if entrant != b'':
-                entrant = Deserialize(entrant)
-                if entrant[1] != br_details[0]:
-                    removed_players_address.append(player)
-
-        for i in range(0, len(removed_players_address)):
-            # Now we can remove players without mutating the original list during iteration.
-            list_of_players = BR_remove_player(event_code, removed_players_address[i])
-
-            payload = ["BR", event_code, "removed_player", removed_players_address[i]]
-            Notify(payload)
-
-    remaining_player_count = len(list_of_players)
+    remaining_player_count = len(remaining_slots)
 
     print("----- Remaining player count -----")
     print(remaining_player_count)
     print("----------------------------------")
     # If there are <= one player, we should end the event.
     if remaining_player_count <= 1:
-        # If there is a final playing remaining, remove him and end the match.
+        # If there is a final playing remaining, they are added to the leaderboard last and win the match.
         if remaining_player_count > 0:
-            last_player_address = list_of_players[0]
-            BR_remove_player(event_code, last_player_address)
+            removed_slots.append(remaining_slots[0])
+        BR_remove_players(event_code, removed_slots, context, cache)
+
+        return BR_end_event(event_code, br_details, context, cache)
+
+    if len(removed_slots) > 0:
+        BR_remove_players(event_code, removed_slots, context, cache)
 
-        return BR_end_event(event_code, br_details, context)
+    # Zones start being destroyed from round 4.
+    if round_on >= ROUND_DESTROYED_ZONES_GENERATE:
+        BR_destroy_next_zone(event_code, br_details, context, cache)
 
-    payload = ['BR', event_code, 'round_end', br_details[0], True]
+    # Update BR details to next round, with the live area left by the zone marked.
+    set_BR_event_details(context, cache, event_code, br_details)
+
+    payload = ['BR', event_code, 'round_end', round_on, True]
     Notify(payload)
 
     return True
 
 
-def BR_end_event(event_code, event_details, context):
+def BR_end_event(event_code, event_details, context, cache):
     """
     Called from within the contract when the event ends.
     Pays out items to the top x players dependent on the length
@@ -1736,18 +2943,19 @@ def BR_end_event(event_code, event_details, context):
     :param event_code: The unique event code of the event.
     :param event_details: The details of the event.
     :param context: The storage context.
+    :param cache: The storage read during this invocation, see storage_get.
     :return: True if the event ended.
     """
 
-    # Remove the event as it is complete to clean up storage.
+    # Remove the event and the records of its entrants as it is complete to clean up storage.
     # The leaderboard remains.
-    remove_BR_event_details(context, event_code)
+    remove_BR_event_details(context, cache, event_code)
+    remove_BR_entrants(context, cache, event_code)
 
-    leaderboard = get_BR_leaderboard(context, event_code)
-    leaderboard = Deserialize(leaderboard)
+    leaderboard_count = get_BR_leaderboard_count(context, cache, event_code)
 
     # Get the rewards of the event.
-    rewards = get_BR_rewards(context, event_code)
+    rewards = get_BR_rewards(context, cache, event_code)
 
     if rewards == b'':
         print("ERROR: No rewards exist for this event.")
@@ -1756,20 +2964,19 @@ def BR_end_event(event_code, event_details, context):
     rewards = Deserialize(rewards)
 
     for i in range(0, len(rewards)):
-        # As we are giving it to the last added addresses to the list, those whom survived the longest.
-        if len(leaderboard) > 0 and i <= len(leaderboard) - 1:
-            # Winners are the last x players s.t. x == len(rewards) for now.
-            index = len(leaderboard) - 1
-            # Get the last player - i in the list.
-            index = index - i
-            address = leaderboard[index]
+        # As we are giving it to the last added addresses to the leaderboard, those whom survived the longest.
+        # Winners are the last x players s.t. x == len(rewards) for now, positions start at 1.
+        position = leaderboard_count - i
+        if position > 0:
+            address = get_BR_leaderboard_entry(context, cache, event_code, position)
             reward = rewards[i]
             marketplace = event_details[7]
 
-            give_item(marketplace, address, reward)
+            storage_key = get_inventory_item_key(marketplace, address, reward)
+            give_item(context, storage_key, 1)
 
             # Acknowledge that a user received a reward.
-            payload = ["BR", event_code, "received_reward", address, reward]
+            payload = ["BR", event_code, "received_reward", address, reward, marketplace]
             Notify(payload)
 
     # Can then query the leaderboard to see winners outside.
@@ -1779,198 +2986,158 @@ def BR_end_event(event_code, event_details, context):
     return True
 
 
-def BR_destroy_next_zone(event_code, round_on, grid_length):
+def BR_destroy_next_zone(event_code, br_details, context, cache):
     """
-    This is only called after advancing a zone.
-    Mark a zone for destruction, and destroy a previous
-    zone if there is one.
+    This is only called after advancing a zone, once the players in the destroyed zones were removed.
+    Mark a zone for destruction, the live area shrinks by a row or column on that side straight away,
+    and players still in it are removed when the next round finishes.
     This encourages the player to move from their zone.
     This way, the next side that will be stripped from the map will always be random .
     :param event_code: The unique code of the event.
-    :param round_on: The current round the event is on.
-    :param grid_length: The length of a side of the grid map.
-    :return: List of players which were not in a destroyed zone.
+    :param br_details: The details of the BR event, the live area is updated in them and saved by the caller.
+    :param context: The storage context.
+    :param cache: The storage read during this invocation, see storage_get.
+    :return: The side that was marked.
     """
 
-    context = GetContext()
-
     print("-----Destroying next marked zone.-----")
 
-    # Check if there is a previous marked zone.
-    # Marked zone will be a marked side, so the side the gas is coming in on.
-    current_destroyed_depths = get_BR_destroyed_zone_depths(context, event_code)
-
-    # Grab the list of remaining players.
-    player_list = get_BR_player_list(context, event_code)
-    player_list = Deserialize(player_list)
-
-    # If the depths have been initialized.
-    if current_destroyed_depths != b'':
-        current_destroyed_depths = Deserialize(current_destroyed_depths)
-
-        removed_address_list = []
-
-        # The grid has 4 sides that can be marked off, iterate through these.
-        for i in range(0, 4):
-            # If the current depth is > 0, meaning the side has been destroyed.
-            current_depth = current_destroyed_depths[i]
-            if current_depth > 0:
-                # If there is a depth change here, we can check once per side if the player is out of range.
-                # We are now checking to see if the player is out of bounds.
-                for player in player_list:  # ~10
-                    entrant = get_BR_entrant_details(context, event_code, player)
-                    if entrant != b'':
-                        entrant = Deserialize(entrant)
-                        zone_entrant_is_in = entrant[0]
-                        # Out of bounds ? if so remove them.
-                        entrant_out_of_bounds = is_player_out_of_bounds(zone_entrant_is_in, grid_length, i,
-                                                                        current_destroyed_depths[i])
-                        # Did they perform an action this round before it timed out ? if not, remove them.
-                        entrant_did_not_do_action = entrant[1] != round_on
-                        if entrant_out_of_bounds or entrant_did_not_do_action:
-                            removed_address_list.append(player)
-
-        # Remove the list of players for the remaining players list and notify each removal.
-        for i in range(0, len(removed_address_list)):
-            player_list = BR_remove_player(event_code, removed_address_list[i])
-
-            payload = ["BR", event_code, "removed_player", removed_address_list[i]]
-            Notify(payload)
-
-    else:
-        # Initialize the list of depths the "poison" has consumed the sides,
-        # and has in turn stripped down the grid map area.
-        current_destroyed_depths = [0, 0, 0, 0]
-
     # Pick a new random side for the gas to come from next round, and notify the event.
-    # So we can increment to say the depth of that row has increased, that will be checked next round to give players
-    # a chance to move.
     side_gas_is_coming = random_number_upper_limit(4)
-    value = current_destroyed_depths[side_gas_is_coming]
-    current_destroyed_depths[side_gas_is_coming] = value + 1
-    set_BR_destroyed_zone_depths(context, event_code, current_destroyed_depths)
 
-    # Notify players that a zone has been marked so they have a chance to move.
-    payload = ["BR", event_code, "zone_marked", side_gas_is_coming]
+    # TOP
+    if side_gas_is_coming == 0:
+        br_details[10] = br_details[10] - 1
+    # BOTTOM
+    elif side_gas_is_coming == 1:
+        br_details[9] = br_details[9] + 1
+    # EAST
+    elif side_gas_is_coming == 2:
+        br_details[12] = br_details[12] - 1
+    # WEST
+    else:
+        br_details[11] = br_details[11] + 1
+
+    # Notify players that a zone has been marked so they have a chance to move,
+    # with the live area as the lowest and highest row and column.
+    payload = ["BR", event_code, "zone_marked", side_gas_is_coming,
+               br_details[9], br_details[10], br_details[11], br_details[12]]
     Notify(payload)
 
-    return player_list
+    return side_gas_is_coming
 
 
-def is_player_out_of_bounds(zone_on, grid_length, side, depth):
+def is_in_live_area(row, column, event_details):
     """
-    Check if a player is outside the bounds of the map.
-    :param zone_on: The zone the player is currently on.
-    :param grid_length: The length of the grid, determined at the beginning of the match.
-    :param side: The side we are checking if out of bounds. As a player can only move one square at a time.
-    :param depth: The depth of the side that is "eliminated", essentially how many times the "poison" has occurred.
-                The players row/column must be within this depth.
-                Can check if the player is out of bounds of the normal map with depth = 0.
-    :return: True if out of bounds.
+    Check if a position is inside the live area of the map, the rectangle that is not destroyed or marked
+    to be destroyed. The map's edges are the live area before any zone is destroyed.
+    Rows count up from the BOTTOM side to the TOP side, columns from the WEST side to the EAST side.
+    :param row: The row of the position, zone / grid length.
+    :param column: The column of the position, zone % grid length.
+    :param event_details: The details of the event, holding the live area.
+    :return: True if the position is in the live area.
     """
-    # We can calculate the boundaries of the grid and check if the player is out of bounds.
-
-    # TOP
-    if side == 0:
-        row_in = zone_on / grid_length
-
-        row_in = (grid_length - row_in) - 1
-
-        if row_in <= depth - 1:
-            return True
-    # BOTTOM
-    elif side == 1:
-        row_in = zone_on / grid_length
-        # e.g. if we are row 0, and depth is 1, we are out
-        # if we are row 1 and depth is 1 we are fine
-        if row_in <= depth - 1:
-            return True
-    # EAST
-    elif side == 2:
-
-        t = grid_length - 1
-        b = zone_on % grid_length
-        column_in = t - b
-        # If the column we are in is
-        if column_in <= depth - 1:
-            return True
-    # WEST
-    elif side == 3:
-        column_in = zone_on % grid_length
+    if row < event_details[9] or row > event_details[10]:
+        return False
 
-        if column_in <= depth - 1:
-            return True
+    if column < event_details[11] or column > event_details[12]:
+        return False
 
-    return False
+    return True
 
 
 # BR Mutators
 
-def set_BR_event_details(context, event_code, details):
+def set_BR_event_details(context, cache, event_code, details):
     ''' Details of the BR event, capacity, owner, etc.'''
     key = concat(battle_royale_details_key, event_code)
-    br_details_s = Get(context, key)
-    if br_details_s != b'':
-        Delete(context, key)
     br_details_s = Serialize(details)
-    Put(context, key, br_details_s)
+    storage_put(context, cache, key, br_details_s)
+    return True
+
+
+def set_BR_entrant_details(context, cache, event_code, slot, details):
+    ''' Details of the entrant, round action, action, etc. Only their record in its page is replaced.'''
+    key = get_BR_entrant_page_key(event_code, slot / BR_ENTRANTS_PER_PAGE)
+    page = storage_get(context, cache, key)
+    # The record follows the address.
+    offset = (slot % BR_ENTRANTS_PER_PAGE) * BR_ENTRANT_LENGTH + 20
+    record = encode_BR_entrant(details)
+    updated_page = concat(take(page, offset), record)
+    updated_page = concat(updated_page, substr(page, offset + 8, len(page) - offset - 8))
+    storage_put(context, cache, key, updated_page)
+    return True
+
+
+def add_BR_entrant(context, cache, event_code, slot, address, details):
+    ''' A new entrant, slots are given in order so they are always added at the end of the last page.'''
+    key = get_BR_entrant_page_key(event_code, slot / BR_ENTRANTS_PER_PAGE)
+    page = storage_get(context, cache, key)
+    entrant = concat(address, encode_BR_entrant(details))
+    storage_put(context, cache, key, concat(page, entrant))
     return True
 
 
-def set_BR_entrant_details(context, event_code, address, details):
-    ''' Details of the entrant, round action, action, etc.'''
+def set_BR_entrant_slot(context, cache, event_code, address, slot):
+    ''' The slot of an entrant, 2 bytes so that slot 0 is not empty.'''
     half_key = concat(battle_royale_entrant_key, event_code)
     complete_key = concat(half_key, address)
-    stored_entrant_s = Get(context, complete_key)
-    if stored_entrant_s != b'':
-        Delete(context, complete_key)
-    details_s = Serialize(details)
-    Put(context, complete_key, details_s)
+    storage_put(context, cache, complete_key, encode_integer(slot, 2))
     return True
 
 
-def set_BR_destroyed_zone_depths(context, event_code, zones):
-    ''' A list of zones that any player on them will be disqualified. '''
-    br_destroyed_zones_key = concat(battle_royale_destroyed_zones_key, event_code)
-    destroyed_zones_s = Get(context, br_destroyed_zones_key)
-    if destroyed_zones_s != b'':
-        Delete(context, br_destroyed_zones_key)
-    zones_s = Serialize(zones)
-    Put(context, br_destroyed_zones_key, zones_s)
-    return True
+def encode_BR_entrant(details):
+    '''
+    The fixed width record of an entrant: the zone as a 4 byte little endian integer,
+    the round as 2 bytes, then the action and the direction as one byte each.
+    :param details: A list [zone, round, action, direction], see decode_BR_entrant.
+    '''
+    record = encode_integer(details[0], 4)
+    record = concat(record, encode_integer(details[1], 2))
+    record = concat(record, encode_integer(details[2], 1))
+    return concat(record, encode_integer(details[3], 1))
 
 
-def set_BR_rewards(context, event_code, rewards):
+def set_BR_rewards(context, cache, event_code, rewards):
     ''' A list of the rewards of a BR event.'''
     rewards_s = Serialize(rewards)
     key = concat(battle_royale_rewards_key, event_code)
-    Put(context, key, rewards_s)
+    storage_put(context, cache, key, rewards_s)
     return True
 
 
-def set_BR_marked_zone(context, event_code, zone):
+def set_BR_marked_zone(context, cache, event_code, zone):
     key = concat(battle_royale_marked_destroyed_zone_key, event_code)
-    Put(context, key, zone)
+    storage_put(context, cache, key, zone)
     return True
 
 
-def set_BR_leaderboard(context, event_code, leaders):
+def set_BR_leaderboard_page(context, cache, event_code, page_number, page):
+    key = get_BR_leaderboard_key(event_code, page_number)
+    storage_put(context, cache, key, page)
+    return True
+
+
+def set_BR_leaderboard_count(context, cache, event_code, count):
     key = concat(battle_royale_event_results_key, event_code)
-    leaderboard_s = Get(context, key)
-    if leaderboard_s != b'':
-        Delete(context, key)
-    leaders_s = Serialize(leaders)
-    Put(context, key, leaders_s)
+    storage_put(context, cache, key, count)
     return True
 
 
-def set_BR_player_list(context, event_code, players):
+def set_BR_alive_players(context, cache, event_code, alive_players):
     key = concat(battle_royale_current_players_key, event_code)
-    players_s = Get(context, key)
-    if players_s != b'':
-        Delete(context, key)
-    players_s = Serialize(players)
-    Put(context, key, players_s)
+    storage_put(context, cache, key, alive_players)
+    return True
+
+
+def set_BR_zone_occupants(context, cache, event_code, zone, occupants):
+    ''' The players in a zone of the map, the key is removed once the zone is empty. '''
+    key = get_BR_zone_key(event_code, zone)
+    if len(occupants) == 0:
+        storage_delete(context, cache, key)
+    else:
+        occupants_s = Serialize(occupants)
+        storage_put(context, cache, key, occupants_s)
     return True
 
 
@@ -1982,62 +3149,142 @@ Note: When getting from storage we must send these values in the serialized form
 """
 
 
-def get_BR_event_details(context, event_code):
+def get_BR_event_details(context, cache, event_code):
     ''' Details of the BR event, capacity, owner, etc.'''
     key = concat(battle_royale_details_key, event_code)
-    br_details = Get(context, key)
+    br_details = storage_get(context, cache, key)
     return br_details
 
 
-def get_BR_entrant_details(context, event_code, address):
-    ''' Details of the entrant, round action, action, etc.'''
+def get_BR_entrant_details(context, cache, event_code, slot):
+    ''' Details of the entrant, round action, action, etc. The record of a slot, see decode_BR_entrant.'''
+    key = get_BR_entrant_page_key(event_code, slot / BR_ENTRANTS_PER_PAGE)
+    page = storage_get(context, cache, key)
+    offset = (slot % BR_ENTRANTS_PER_PAGE) * BR_ENTRANT_LENGTH + 20
+    return substr(page, offset, 8)
+
+
+def get_BR_slot_address(context, cache, event_code, slot):
+    ''' The address of the entrant in a slot.'''
+    key = get_BR_entrant_page_key(event_code, slot / BR_ENTRANTS_PER_PAGE)
+    page = storage_get(context, cache, key)
+    offset = (slot % BR_ENTRANTS_PER_PAGE) * BR_ENTRANT_LENGTH
+    return substr(page, offset, 20)
+
+
+def get_BR_entrant_slot(context, cache, event_code, address):
+    ''' The slot of an entrant, or an empty byte array if the address did not sign up.'''
     half_key = concat(battle_royale_entrant_key, event_code)
     complete_key = concat(half_key, address)
-    stored_entrant = Get(context, complete_key)
-    # stored_entrant = Deserialize(stored_entrant_s)
-    return stored_entrant
+    return storage_get(context, cache, complete_key)
+
 
+def get_BR_entrant_page_key(event_code, page):
+    ''' The page follows a separator, as page 0 concatenates to nothing. '''
+    key = concat(battle_royale_entrant_page_key, event_code)
+    key = concat(key, "/")
+    return concat(key, page)
 
-def get_BR_destroyed_zone_depths(context, event_code):
-    ''' A list of zones that any player on them will be disqualified. '''
-    br_destroyed_zones_key = concat(battle_royale_destroyed_zones_key, event_code)
-    destroyed_zones = Get(context, br_destroyed_zones_key)
-    # destroyed_zones = [] if destroyed_zones_s == b'' else Deserialize(destroyed_zones_s)
-    return destroyed_zones
 
+def decode_BR_entrant(record):
+    '''
+    The details of an entrant from their record, see encode_BR_entrant.
+    No field is large enough to be read as negative.
+    :return: A list [zone, round, action, direction].
+    '''
+    zone = substr(record, 0, 4) + 0
+    entrant_round = substr(record, 4, 2) + 0
+    action = substr(record, 6, 1) + 0
+    direction = substr(record, 7, 1) + 0
+    return [zone, entrant_round, action, direction]
 
-def get_BR_rewards(context, event_code):
+
+def get_BR_rewards(context, cache, event_code):
     ''' A list of the rewards of a BR event.'''
     key = concat(battle_royale_rewards_key, event_code)
-    rewards = Get(context, key)
+    rewards = storage_get(context, cache, key)
     # rewards = [] if rewards_s == b'' else Deserialize(rewards_s)
     return rewards
 
 
-def get_BR_marked_zones(context, event_code):
+def get_BR_marked_zones(context, cache, event_code):
     key = concat(battle_royale_marked_destroyed_zone_key, event_code)
-    zone = Get(context, key)
+    zone = storage_get(context, cache, key)
     return zone
 
 
-def get_BR_player_list(context, event_code):
+def get_BR_alive_players(context, cache, event_code):
+    ''' One byte for every slot in the order players signed up, BR_ALIVE until they are knocked out.'''
     key = concat(battle_royale_current_players_key, event_code)
-    players = Get(context, key)
-    return players
+    alive_players = storage_get(context, cache, key)
+    return alive_players
+
+
+def get_BR_zone_key(event_code, zone):
+    ''' The zone follows a separator, as zone 0 concatenates to nothing. '''
+    key = concat(battle_royale_zone_key, event_code)
+    key = concat(key, "/")
+    return concat(key, zone)
+
+
+def get_BR_zone_occupants(context, cache, event_code, zone):
+    ''' The players in a zone of the map. '''
+    key = get_BR_zone_key(event_code, zone)
+    occupants = storage_get(context, cache, key)
+    return occupants
+
+
+def get_BR_leaderboard_key(event_code, page_number):
+    ''' The leaderboard is append only, each page of addresses is its own key after the count. '''
+    key = concat(battle_royale_event_results_key, event_code)
+    key = concat(key, "/")
+    return concat(key, page_number)
 
 
-def get_BR_leaderboard(context, event_code):
+def get_BR_leaderboard_count(context, cache, event_code):
+    ''' The number of players on the leaderboard, the last of them won. '''
     key = concat(battle_royale_event_results_key, event_code)
-    leaderboard = Get(context, key)
-    # leaderboard = [] if leaderboard_s == b'' else Deserialize(leaderboard_s)
-    return leaderboard
+    count = storage_get(context, cache, key)
+    return count + 0
+
+
+def get_BR_leaderboard_entry(context, cache, event_code, position):
+    ''' The address knocked out at a position of the leaderboard, starting at 1. '''
+    index = position - 1
+    page = get_BR_leaderboard_page(context, cache, event_code, index / BR_LEADERBOARD_PAGE_LENGTH)
+    offset = (index % BR_LEADERBOARD_PAGE_LENGTH) * 20
+    return substr(page, offset, 20)
 
 
-def remove_BR_event_details(context, event_code):
+def get_BR_leaderboard_page(context, cache, event_code, page_number):
+    ''' A page of the addresses on the leaderboard, in order of being knocked out. '''
+    key = get_BR_leaderboard_key(event_code, page_number)
+    page = storage_get(context, cache, key)
+    return page
+
+
+def remove_BR_event_details(context, cache, event_code):
     key = concat(battle_royale_details_key, event_code)
-    br_details_s = Get(context, key)
-    if br_details_s != b'':
-        Delete(context, key)
+    storage_delete(context, cache, key)
+    return True
+
+
+def remove_BR_entrant_slot(context, cache, event_code, address):
+    half_key = concat(battle_royale_entrant_key, event_code)
+    complete_key = concat(half_key, address)
+    storage_delete(context, cache, complete_key)
+    return True
+
+
+def remove_BR_entrants(context, cache, event_code):
+    ''' The pages of entrant records and the list of remaining players, once every player is knocked out. '''
+    alive_players = get_BR_alive_players(context, cache, event_code)
+    page_count = (len(alive_players) + BR_ENTRANTS_PER_PAGE - 1) / BR_ENTRANTS_PER_PAGE
+    for page_number in range(0, page_count):
+        key = get_BR_entrant_page_key(event_code, page_number)
+        storage_delete(context, cache, key)
+    key = concat(battle_royale_current_players_key, event_code)
+    storage_delete(context, cache, key)
     return True
 
 
@@ -0,0 +1,9 @@
+"""
+Off-chain tooling for the Loot Marketplace Framework.
+
+The offline harness runs LootMarketsContract.py without a NEO node, against
+in-memory storage, and estimates the GAS every operation costs.
+"""
+
+from lootframework.harness import ContractHarness, Invocation
+from lootframework.interop import Account, CallStats, MemoryStorage
@@ -0,0 +1,115 @@
+"""
+Export every LOOT balance held in LootMarketsContract in one streaming pass.
+
+Balances are stored under the Balance prefix followed by the 20 byte address, as
+fixed width integers, so all of them can be read with a single prefix scan of
+contract storage instead of a balance_of query per address. Marketplace owner keys
+start with the marketplace's name, so keys under the prefix are only taken as
+balances when they are exactly one address longer than it.
+
+    with open('balances.csv', 'w') as out:
+        count, total = export_balances(storage.find(BALANCE_KEY), out)
+
+Everything deposited into the contract is held by the contract on the NEP-5 LOOT
+contract, so the total of the export, together with the marketplace fees not yet
+swept into a balance, reconciles against that one balance:
+
+    python -m lootframework.benchmark -s exchange_batch_fills_30 --dump-storage storage.jsonl
+    python -m lootframework.balances storage.jsonl --out balances.csv --nep5-balance 1000
+"""
+
+import argparse
+import sys
+
+from lootframework.interop import read_storage_dump
+from lootframework.views import ACCRUED_FEES_KEY, BALANCE_KEY, is_balance_key, is_registry_entry_key
+from lootframework.vm import bytes_to_int, to_bytes
+
+
+def iter_balances(entries):
+    """
+    The balances among storage entries, entries under other prefixes are skipped.
+    :param entries: iterable of (key, value) storage entries, e.g. storage.find(BALANCE_KEY) or a storage dump.
+    :return: iterator of (address, balance).
+    """
+    prefix_length = len(BALANCE_KEY)
+    for key, value in entries:
+        if is_balance_key(key):
+            yield key[prefix_length:], bytes_to_int(value)
+
+
+def iter_accrued_fees(entries, marketplaces):
+    """
+    The fees each marketplace has charged since they were last swept, entries of other keys are skipped.
+    Marketplace names have no fixed length, so a key is only taken as accrued fees if the prefix is followed
+    by the name of a registered marketplace.
+    :param entries: iterable of (key, value) storage entries.
+    :param marketplaces: iterable of the names of the registered marketplaces, e.g. views.read_registry(storage).
+    :return: iterator of (marketplace, amount).
+    """
+    keys = set(ACCRUED_FEES_KEY + to_bytes(marketplace) for marketplace in marketplaces)
+    prefix_length = len(ACCRUED_FEES_KEY)
+    for key, value in entries:
+        if key in keys:
+            yield key[prefix_length:].decode(), bytes_to_int(value)
+
+
+def export_balances(entries, out):
+    """
+    Write every balance as a CSV line of the hex address and the amount.
+    :param entries: iterable of (key, value) storage entries, read once.
+    :param out: A text file to write to.
+    :return: (int, int) The number of balances and their total.
+    """
+    count = 0
+    total = 0
+    out.write('address,balance\n')
+    for address, balance in iter_balances(entries):
+        out.write('%s,%d\n' % (address.hex(), balance))
+        count += 1
+        total += balance
+    return count, total
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export the LOOT balances held in LootMarketsContract.")
+    parser.add_argument('dump', help="Contract storage, one JSON object per entry, see interop.write_storage_dump.")
+    parser.add_argument('--out', help="Write the balances as CSV here, by default to stdout.")
+    parser.add_argument('--nep5-balance', type=int,
+                        help="The contract's balance on the NEP-5 LOOT contract, the total must match it.")
+    options = parser.parse_args(argv)
+
+    # The dump is read once, the few accrued fee entries and registry names are kept aside while balances are
+    # exported, since the registry that tells accrued fees apart may come after them.
+    accrued_entries = []
+    marketplaces = []
+
+    def entries():
+        for key, value in read_storage_dump(options.dump):
+            if key.startswith(ACCRUED_FEES_KEY):
+                accrued_entries.append((key, value))
+            elif is_registry_entry_key(key):
+                marketplaces.append(to_bytes(value).decode())
+            yield key, value
+
+    out = open(options.out, 'w') if options.out else sys.stdout
+    try:
+        count, total = export_balances(entries(), out)
+    finally:
+        if options.out:
+            out.close()
+
+    report = sys.stderr if not options.out else sys.stdout
+    report.write('%d balances, %d LOOT in total\n' % (count, total))
+    accrued = sum(amount for marketplace, amount in iter_accrued_fees(accrued_entries, marketplaces))
+    if accrued:
+        report.write('%d LOOT of marketplace fees not swept yet\n' % accrued)
+    if options.nep5_balance is not None and options.nep5_balance != total + accrued:
+        report.write('MISMATCH the contract holds %d LOOT on the NEP-5 contract, %+d from the balances and fees\n'
+                     % (options.nep5_balance, options.nep5_balance - total - accrued))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,553 @@
+"""
+Benchmark suite of marketplace and Battle Royale workloads.
+
+Replays scripted workloads against the offline harness and reports storage
+operations, bytes, serialized bytes and estimated GAS per operation. Scenario
+totals are compared against a stored baseline, and any scenario that became
+more expensive is flagged as a regression.
+
+    python -m lootframework.benchmark                      # Run and compare with the baseline.
+    python -m lootframework.benchmark --update-baseline    # Accept the current costs.
+    python -m lootframework.benchmark -s battle_royale_10  # Run a single scenario.
+"""
+
+import argparse
+import json
+import os
+import sys
+
+from lootframework.harness import ContractHarness
+from lootframework.indexer import Recorder
+from lootframework.interop import GAS_PER_UNIT, Account, CallStats, write_storage_dump
+from lootframework.orders import encode_order
+from lootframework.vm import serialize
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+
+# Scenario totals compared against the baseline, state_bytes is the size of the storage left behind.
+METRICS = ('gas_units', 'storage_ops', 'bytes', 'serialized_bytes', 'state_bytes')
+
+MARKETPLACE = 'LootClicker'
+
+# Blocks until the orders signed by the fixture expire.
+ORDER_LIFETIME = 100
+
+
+class BenchmarkError(Exception):
+    """ Raised when a workload does not behave as scripted, so its costs would be meaningless. """
+
+
+class MarketFixture(object):
+    """
+    A deployed contract with a registered marketplace, and helpers that sign and
+    invoke operations the way the framework relays them.
+    Only invocations made while `recording` is set are counted towards the scenario.
+
+    :param legacy_salts: bool Sign orders with 32 character hex salts that never expire, instead of compact salts.
+    """
+
+    def __init__(self, legacy_salts=False):
+        self.owner = Account('contract_owner')
+        self.harness = ContractHarness(owner=self.owner)
+        self.marketplace_owner = self.harness.account('marketplace_owner')
+        self.recording = False
+        self.operations = {}
+        self.legacy_salts = legacy_salts
+        self.signer_index = None
+        self.recorder = None
+        self._salt = 0
+
+        self.invoke('register_marketplace', [MARKETPLACE, self.marketplace_owner.address, 0, 0],
+                    witnesses=[self.owner.address])
+
+    def invoke(self, operation, args, witnesses=(), caller=None, expect=True):
+        """
+        Invoke an operation, recording its costs if recording.
+        :param expect: The result the workload expects, None to accept any result.
+        """
+        invocation = self.harness.invoke(operation, args, witnesses=witnesses, caller=caller)
+        if self.recorder is not None:
+            self.recorder.record(invocation)
+        if invocation.fault is not None:
+            raise BenchmarkError("%s faulted: %r" % (operation, invocation.fault))
+        if expect is not None and bool(invocation.value) != expect:
+            raise BenchmarkError("%s returned %r" % (operation, invocation.value))
+        if self.recording:
+            record = self.operations.get(operation)
+            if record is None:
+                record = self.operations[operation] = [0, CallStats()]
+            record[0] += 1
+            record[1].add(invocation.stats)
+        return invocation
+
+    def salt(self):
+        """
+        A unique order salt, a 16 byte binary GUID whose first 4 bytes are the block height it expires at.
+        Legacy salts are the same GUID as 32 hex characters.
+        """
+        self._salt += 1
+        if self.legacy_salts:
+            return '%032x' % self._salt
+        expiry = self.harness.height + ORDER_LIFETIME
+        return expiry.to_bytes(4, 'little') + self._salt.to_bytes(12, 'little')
+
+    # region Marketplace operations
+
+    def register_signer(self):
+        """ Register the marketplace owner's public key, later batches and exchanges refer to it by index. """
+        invocation = self.invoke('add_owner_wallet', [MARKETPLACE, self.marketplace_owner.address,
+                                                      self.marketplace_owner.public_key],
+                                 witnesses=[self.marketplace_owner.address])
+        self.signer_index = invocation.value
+        return invocation
+
+    def set_fees(self, maker_fee, taker_fee):
+        """ Charge fees on later exchanges, in parts of 10000 of the price, paid to the marketplace owner. """
+        witnesses = [self.marketplace_owner.address]
+        self.invoke('set_maker_fees', [MARKETPLACE, self.marketplace_owner.address, maker_fee], witnesses=witnesses)
+        self.invoke('set_taker_fees', [MARKETPLACE, self.marketplace_owner.address, taker_fee], witnesses=witnesses)
+
+    def sweep_fees(self):
+        return self.invoke('sweep_fees', [MARKETPLACE, self.marketplace_owner.address],
+                           witnesses=[self.marketplace_owner.address])
+
+    def give_item(self, address, item_id, quantity=None):
+        salt = self.salt()
+        signature = self.marketplace_owner.sign('give_item', [MARKETPLACE, address, item_id, quantity or 0], salt)
+        args = [MARKETPLACE, address, item_id, self.marketplace_owner.address, signature,
+                self.marketplace_owner.public_key, salt]
+        if quantity is not None:
+            args.append(quantity)
+        return self.invoke('give_item', args)
+
+    def give_items_batch(self, grants):
+        """ :param grants: list of (address, item_id) pairs. """
+        salt = self.salt()
+        grants = [[address, item_id] for address, item_id in grants]
+        signature = self.marketplace_owner.sign('give_items_batch', [MARKETPLACE, serialize(grants)], salt)
+        if self.signer_index:
+            return self.invoke('give_items_batch', [MARKETPLACE, self.signer_index, signature, salt, grants])
+        args = [MARKETPLACE, self.marketplace_owner.address, signature, self.marketplace_owner.public_key, salt,
+                grants]
+        return self.invoke('give_items_batch', args)
+
+    def exchange(self, seller, buyer, item_id, price, expect=True):
+        seller_salt = self.salt()
+        buyer_salt = self.salt()
+        # The three signatures share one encoded order body.
+        body = encode_order([MARKETPLACE, item_id, price])
+        owner_signature = self.marketplace_owner.sign('exchange', body, seller.address + buyer.address)
+        if self.signer_index:
+            args = [MARKETPLACE, self.signer_index, owner_signature]
+        else:
+            args = [MARKETPLACE, self.marketplace_owner.address, owner_signature, self.marketplace_owner.public_key]
+        args += [seller.address, seller.sign('put_offer', body, seller_salt), seller.public_key,
+                 buyer.address, buyer.sign('buy_offer', body, buyer_salt), buyer.public_key, item_id, price,
+                 seller_salt, buyer_salt]
+        return self.invoke('exchange', args, expect=expect)
+
+    def fill(self, seller, buyer, item_id, price):
+        """ A matched pair of signed orders, in the form exchange_batch settles them. """
+        seller_salt = self.salt()
+        buyer_salt = self.salt()
+        body = encode_order([MARKETPLACE, item_id, price])
+        return [seller.address, seller.sign('put_offer', body, seller_salt), seller.public_key, buyer.address,
+                buyer.sign('buy_offer', body, buyer_salt), buyer.public_key, item_id, price, seller_salt, buyer_salt]
+
+    def exchange_batch(self, fills, atomic=True, expect=True):
+        signature = self.marketplace_owner.sign('exchange_batch', [MARKETPLACE, atomic], serialize(fills))
+        if self.signer_index:
+            return self.invoke('exchange_batch', [MARKETPLACE, self.signer_index, signature, atomic, fills],
+                               expect=expect)
+        args = [MARKETPLACE, self.marketplace_owner.address, signature, self.marketplace_owner.public_key, atomic,
+                fills]
+        return self.invoke('exchange_batch', args, expect=expect)
+
+    def deposit(self, account, amount):
+        args = [account.address, self.harness.interop.script_hash, amount]
+        return self.invoke('receiving', args, caller=self.harness.contract.LootTokenHash)
+
+    def withdraw(self, account, amount):
+        salt = self.salt()
+        body = encode_order([account.address, amount])
+        args = [account.address, amount, account.sign('withdraw', body, salt), account.public_key,
+                self.owner.address, self.owner.sign('withdraw', body, salt), self.owner.public_key, salt]
+        return self.invoke('withdraw', args)
+
+    # endregion
+
+    # region Battle Royale operations
+
+    def br_create(self, event_code, rewards):
+        args = [event_code, self.marketplace_owner.address, MARKETPLACE] + list(rewards)
+        return self.invoke('BR_create', args, witnesses=[self.marketplace_owner.address])
+
+    def br_sign_up(self, event_code, player):
+        return self.invoke('BR_sign_up', [event_code, player.address], witnesses=[player.address])
+
+    def br_start(self, event_code):
+        return self.invoke('BR_start', [event_code, self.marketplace_owner.address],
+                           witnesses=[self.marketplace_owner.address])
+
+    def br_choose_initial_zone(self, event_code, player, zone):
+        return self.invoke('BR_choose_initial_zone', [event_code, player.address, zone], witnesses=[player.address])
+
+    def br_do_action(self, event_code, player, action, direction):
+        return self.invoke('BR_do_action', [event_code, player.address, action, direction],
+                           witnesses=[player.address])
+
+    def br_finish_round(self, event_code):
+        return self.invoke('BR_finish_round', [event_code], expect=None)
+
+    # endregion
+
+
+# region Scenarios
+
+def scenario_give_item_mint(fixture):
+    """ Bulk minting, 300 items given to 3 players so each inventory grows to 100 items. """
+    players = [fixture.harness.account('player%d' % i) for i in range(3)]
+    fixture.recording = True
+    for item_id in range(300):
+        fixture.give_item(players[item_id % 3].address, 1000 + item_id)
+
+
+def scenario_give_item_stack_grant(fixture):
+    """ Bulk grants, 30 stacks of 10 copies of an item given in one invocation each. """
+    players = [fixture.harness.account('player%d' % i) for i in range(3)]
+    fixture.recording = True
+    for grant in range(30):
+        fixture.give_item(players[grant % 3].address, 1000 + grant % 5, 10)
+
+
+def scenario_give_items_batch_mint(fixture):
+    """ The same 300 items as give_item_mint, dropped in 3 batches of 100. """
+    players = [fixture.harness.account('player%d' % i) for i in range(3)]
+    fixture.recording = True
+    for batch in range(3):
+        grants = [(players[item_id % 3].address, 1000 + item_id) for item_id in range(batch * 100, batch * 100 + 100)]
+        fixture.give_items_batch(grants)
+
+
+def scenario_give_items_batch_event_drop(fixture):
+    """ An event drop of 5 item types to 40 players, in batches of 100 grants with repeated items per player. """
+    players = [fixture.harness.account('player%d' % i) for i in range(40)]
+    grants = []
+    for player in players:
+        for item_id in (1, 1, 2, 2, 3):
+            grants.append((player.address, item_id))
+    fixture.recording = True
+    for start in range(0, len(grants), 100):
+        fixture.give_items_batch(grants[start:start + 100])
+
+
+def scenario_give_item_mint_legacy_salts(fixture):
+    """ give_item_mint signed with legacy hex salts, whose completion is stored permanently. """
+    fixture.legacy_salts = True
+    scenario_give_item_mint(fixture)
+
+
+def scenario_prune_expired_orders(fixture):
+    """ 300 items are given, the orders expire and their completed salts are pruned in batches of 100. """
+    players = [fixture.harness.account('player%d' % i) for i in range(3)]
+    salts = []
+    for item_id in range(300):
+        invocation = fixture.give_item(players[item_id % 3].address, 1000 + item_id)
+        salts.append(invocation.notifications[0][1])
+    fixture.harness.advance(ORDER_LIFETIME + 1)
+    fixture.recording = True
+    for start in range(0, len(salts), 100):
+        fixture.invoke('prune_orders', salts[start:start + 100])
+
+
+def make_exchange_scenario(inventory_size):
+    def scenario(fixture):
+        seller = fixture.harness.account('seller')
+        buyer = fixture.harness.account('buyer')
+        for item_id in range(inventory_size):
+            fixture.give_item(seller.address, 1000 + item_id)
+        fixture.deposit(buyer, 10 ** 12)
+
+        # Fill orders for the most recently minted items, the last in the seller's inventory.
+        fixture.recording = True
+        for item_id in range(inventory_size - 1, max(inventory_size - 4, -1), -1):
+            fixture.exchange(seller, buyer, 1000 + item_id, 100000000)
+    scenario.__doc__ = " Exchange fills against a seller holding %d items. " % inventory_size
+    return scenario
+
+
+def make_exchange_fills_scenario(batched, registered_signer=False, fees=None):
+    def scenario(fixture):
+        if registered_signer:
+            fixture.register_signer()
+        if fees:
+            fixture.set_fees(*fees)
+        sellers = [fixture.harness.account('seller%d' % i) for i in range(3)]
+        buyers = [fixture.harness.account('buyer%d' % i) for i in range(2)]
+        for i, seller in enumerate(sellers):
+            fixture.give_item(seller.address, 1000 + i, 10)
+        for buyer in buyers:
+            fixture.deposit(buyer, 10 ** 12)
+
+        fills = []
+        for i in range(30):
+            fills.append((sellers[i % 3], buyers[i % 2], 1000 + i % 3, 100000000))
+
+        fixture.recording = True
+        if batched:
+            fixture.exchange_batch([fixture.fill(*fill) for fill in fills])
+        else:
+            for fill in fills:
+                fixture.exchange(*fill)
+        if fees:
+            fixture.sweep_fees()
+    if batched:
+        scenario.__doc__ = " 30 fills between 3 sellers and 2 buyers settled in one exchange_batch. "
+    else:
+        scenario.__doc__ = " 30 fills between 3 sellers and 2 buyers relayed as separate exchanges. "
+    if registered_signer:
+        scenario.__doc__ += "The marketplace owner signs with a registered signer. "
+    if fees:
+        scenario.__doc__ += ("The marketplace charges a maker fee of %d and a taker fee of %d in 10000, "
+                             "swept once after the fills. " % fees)
+    return scenario
+
+
+def scenario_deposit_withdraw_churn(fixture):
+    """ 20 players each deposit and withdraw 5 times. """
+    players = [fixture.harness.account('player%d' % i) for i in range(20)]
+    fixture.recording = True
+    for cycle in range(5):
+        for player in players:
+            fixture.deposit(player, 500000000)
+            fixture.withdraw(player, 200000000)
+
+
+# Players cycle through these actions, landing in a few zones so that fights happen every round.
+BR_ACTIONS = ('hide', 'loot', 'move')
+BR_LANDING_ZONES = 4
+# Blocks until a round times out, as in the contract.
+BR_ROUND_TIMEOUT = 10
+
+
+def make_battle_royale_scenario(entrants, idle=0):
+    def scenario(fixture):
+        event_code = 'BR%d' % entrants
+        players = [fixture.harness.account('entrant%d' % i) for i in range(entrants)]
+        addresses = dict((p.address, p) for p in players)
+        fixture.recording = True
+
+        fixture.br_create(event_code, [1, 2, 3])
+        for player in players:
+            fixture.br_sign_up(event_code, player)
+        fixture.br_start(event_code)
+        for i, player in enumerate(players):
+            fixture.br_choose_initial_zone(event_code, player, i % BR_LANDING_ZONES)
+        fixture.harness.advance()
+        fixture.br_finish_round(event_code)
+
+        alive = list(players)
+        idle_players = players[:idle]
+        for round_number in range(1, 10 * entrants + 10):
+            for i, player in enumerate(list(alive)):
+                if player not in alive or player in idle_players:
+                    continue
+                action = BR_ACTIONS[(i + round_number) % len(BR_ACTIONS)]
+                invocation = fixture.br_do_action(event_code, player, action, (i + round_number) % 4)
+                for payload in invocation.notifications:
+                    if payload[2] == b'fight':
+                        loser = addresses[payload[5] if payload[6] else payload[4]]
+                        if loser in alive:
+                            alive.remove(loser)
+
+            if any(player in alive for player in idle_players):
+                fixture.harness.advance(BR_ROUND_TIMEOUT)
+            else:
+                fixture.harness.advance()
+            invocation = fixture.br_finish_round(event_code)
+            for payload in invocation.notifications:
+                if payload[2] == b'removed_player' and addresses[payload[3]] in alive:
+                    alive.remove(addresses[payload[3]])
+                elif payload[2] == b'event_complete':
+                    return
+        raise BenchmarkError("Battle Royale with %d entrants did not finish" % entrants)
+    scenario.__doc__ = " A complete Battle Royale event with %d entrants. " % entrants
+    if idle:
+        scenario.__doc__ += "%d of them never act and time out of the first round together. " % idle
+    return scenario
+
+
+SCENARIOS = [
+    ('give_item_mint', scenario_give_item_mint),
+    ('give_item_mint_legacy_salts', scenario_give_item_mint_legacy_salts),
+    ('give_item_stack_grant', scenario_give_item_stack_grant),
+    ('give_items_batch_mint', scenario_give_items_batch_mint),
+    ('give_items_batch_event_drop', scenario_give_items_batch_event_drop),
+    ('exchange_inventory_1', make_exchange_scenario(1)),
+    ('exchange_inventory_10', make_exchange_scenario(10)),
+    ('exchange_inventory_100', make_exchange_scenario(100)),
+    ('exchange_inventory_500', make_exchange_scenario(500)),
+    ('exchange_fills_30', make_exchange_fills_scenario(False)),
+    ('exchange_fills_30_registered_signer', make_exchange_fills_scenario(False, registered_signer=True)),
+    ('exchange_batch_fills_30', make_exchange_fills_scenario(True)),
+    ('exchange_fills_30_fees', make_exchange_fills_scenario(False, fees=(25, 50))),
+    ('exchange_batch_fills_30_fees', make_exchange_fills_scenario(True, fees=(25, 50))),
+    ('deposit_withdraw_churn', scenario_deposit_withdraw_churn),
+    ('prune_expired_orders', scenario_prune_expired_orders),
+    ('battle_royale_2', make_battle_royale_scenario(2)),
+    ('battle_royale_10', make_battle_royale_scenario(10)),
+    ('battle_royale_50', make_battle_royale_scenario(50)),
+    ('battle_royale_200', make_battle_royale_scenario(200)),
+    ('battle_royale_200_idle_100', make_battle_royale_scenario(200, idle=100)),
+]
+
+# endregion
+
+
+def _summary(calls, stats):
+    return {
+        'calls': calls,
+        'gas_units': stats.gas_units,
+        'storage_ops': stats.storage_ops,
+        'bytes': stats.bytes_read + stats.bytes_written,
+        'serialized_bytes': stats.serialized_bytes,
+    }
+
+
+def run_scenario(scenario, record=None, dump=None):
+    """
+    Run a scenario on a fresh deployment.
+    :param record: str If given, record the notifications of the scenario's invocations here, see indexer.Recorder.
+    :param dump: str If given, write the storage left by the scenario here, see interop.write_storage_dump.
+    :return: dict Totals per operation, and for the whole scenario under 'total'.
+    """
+    fixture = MarketFixture()
+    if record is not None:
+        fixture.recorder = Recorder(record, fixture.harness.interop.script_hash)
+    try:
+        scenario(fixture)
+    finally:
+        if fixture.recorder is not None:
+            fixture.recorder.close()
+    if dump is not None:
+        write_storage_dump(fixture.harness.storage, dump)
+
+    result = {'operations': {}}
+    total = CallStats()
+    total_calls = 0
+    for operation, (calls, stats) in sorted(fixture.operations.items()):
+        result['operations'][operation] = _summary(calls, stats)
+        total.add(stats)
+        total_calls += calls
+    result['total'] = _summary(total_calls, total)
+    # Bytes of keys and values left in storage, what the deployment pays to keep around.
+    result['total']['state_bytes'] = sum(len(k) + len(v) for k, v in fixture.harness.storage.items.items())
+    return result
+
+
+def run(names=None, record=None, dump=None):
+    results = {}
+    for name, scenario in SCENARIOS:
+        if names and name not in names:
+            continue
+        results[name] = run_scenario(scenario, record, dump)
+    return results
+
+
+def compare(results, baseline, tolerance=0.0):
+    """
+    Compare scenario totals with the baseline.
+    :return: list of (scenario, metric, baseline value, current value) that regressed.
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        for metric in METRICS:
+            if metric not in baseline[name]['total']:
+                continue
+            expected = baseline[name]['total'][metric]
+            current = result['total'][metric]
+            if current > expected * (1 + tolerance):
+                regressions.append((name, metric, expected, current))
+    return regressions
+
+
+def _per_call(summary, metric):
+    return float(summary[metric]) / summary['calls'] if summary['calls'] else 0.0
+
+
+def format_report(results, baseline=None):
+    lines = []
+    header = '%-36s %-24s %7s %12s %12s %12s %12s' % ('scenario', 'operation', 'calls', 'storage/op', 'bytes/op',
+                                                      'serial/op', 'GAS/op')
+    lines.append(header)
+    lines.append('-' * len(header))
+    for name, result in results.items():
+        rows = sorted(result['operations'].items()) + [('total', result['total'])]
+        for operation, summary in rows:
+            gas = _per_call(summary, 'gas_units') * float(GAS_PER_UNIT)
+            lines.append('%-36s %-24s %7d %12.1f %12.1f %12.1f %12.3f' % (
+                name, operation, summary['calls'], _per_call(summary, 'storage_ops'), _per_call(summary, 'bytes'),
+                _per_call(summary, 'serialized_bytes'), gas))
+
+        total_gas = result['total']['gas_units'] * GAS_PER_UNIT
+        if baseline is not None and name in baseline:
+            before = baseline[name]['total']['gas_units'] * GAS_PER_UNIT
+            change = (float(total_gas) / float(before) - 1) * 100 if before else 0.0
+            lines.append('%-36s total GAS %s (baseline %s, %+.1f%%)' % (name, total_gas, before, change))
+        else:
+            lines.append('%-36s total GAS %s' % (name, total_gas))
+        lines.append('%-36s state bytes %d' % (name, result['total']['state_bytes']))
+        lines.append('')
+    return '\n'.join(lines)
+
+
+def load_baseline(path=BASELINE_PATH):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_baseline(results, path=BASELINE_PATH):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark LootMarketsContract workloads on the offline harness.")
+    parser.add_argument('-s', '--scenario', action='append', help="Run only this scenario, may be repeated.")
+    parser.add_argument('--baseline', default=BASELINE_PATH, help="Path of the stored baseline.")
+    parser.add_argument('--update-baseline', action='store_true', help="Store the results as the new baseline.")
+    parser.add_argument('--tolerance', type=float, default=0.0,
+                        help="Allowed relative increase before a scenario is a regression, e.g. 0.01.")
+    parser.add_argument('--record', help="Record the notifications of the scenario as blocks for the indexer.")
+    parser.add_argument('--dump-storage', help="Write the contract storage left by the scenario.")
+    options = parser.parse_args(argv)
+    if options.record and (not options.scenario or len(options.scenario) != 1):
+        parser.error("--record needs exactly one --scenario")
+    if options.dump_storage and (not options.scenario or len(options.scenario) != 1):
+        parser.error("--dump-storage needs exactly one --scenario")
+
+    baseline = load_baseline(options.baseline)
+    results = run(options.scenario, options.record, options.dump_storage)
+    print(format_report(results, baseline))
+
+    if options.update_baseline:
+        if options.scenario:
+            baseline.update(results)
+            results = baseline
+        save_baseline(results, options.baseline)
+        print("Baseline updated: %s" % options.baseline)
+        return 0
+
+    regressions = compare(results, baseline, options.tolerance)
+    for name, metric, expected, current in regressions:
+        print("REGRESSION %s: %s %s -> %s" % (name, metric, expected, current))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
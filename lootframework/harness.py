@@ -0,0 +1,314 @@
+"""
+Offline execution harness for LootMarketsContract.
+
+Loads the contract source with in-memory stand-ins for the boa modules it imports,
+then runs Main(operation, args) as an invocation transaction would, metering every
+storage, runtime and blockchain call into a CallStats with an estimated GAS cost.
+
+    harness = ContractHarness()
+    result = harness.invoke("balance_of", [address])
+    print(result.value, result.stats.gas)
+"""
+
+import ast
+import os
+import sys
+import types
+
+from lootframework.interop import Account, CallStats, Interop, MemoryStorage
+from lootframework.vm import (VMFault, concat, has_key, hash160, keys, normalize, substr, take, to_bytes, values,
+                              vm_div, vm_len, vm_list, vm_mod)
+
+DEFAULT_CONTRACT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                     'LootMarketsContract.py')
+
+
+class Invocation(object):
+    """ The outcome of a single invocation of the contract. """
+
+    def __init__(self, operation, args, value, fault, notifications, logs, stats, height):
+        self.operation = operation
+        self.args = args
+        self.value = value
+        self.fault = fault
+        self.notifications = notifications
+        self.logs = logs
+        self.stats = stats
+        self.height = height
+
+    @property
+    def succeeded(self):
+        """ True if the VM halted and the operation returned a truthy result. """
+        return self.fault is None and bool(self.value)
+
+    def __repr__(self):
+        return 'Invocation(%r, value=%r, fault=%r, %r)' % (self.operation, self.value, self.fault, self.stats)
+
+
+class _VMArithmetic(ast.NodeTransformer):
+    """
+    Rewrites division and modulo into calls with NEO's truncating semantics,
+    as neo-boa compiles `/` to the DIV opcode rather than true division.
+    """
+
+    OPERATORS = {ast.Div: '__vm_div__', ast.FloorDiv: '__vm_div__', ast.Mod: '__vm_mod__'}
+
+    def visit_BinOp(self, node):
+        self.generic_visit(node)
+        name = self.OPERATORS.get(type(node.op))
+        if name is None:
+            return node
+        call = ast.Call(func=ast.Name(id=name, ctx=ast.Load()), args=[node.left, node.right], keywords=[])
+        return ast.copy_location(call, node)
+
+    def visit_AugAssign(self, node):
+        self.generic_visit(node)
+        name = self.OPERATORS.get(type(node.op))
+        if name is None or not isinstance(node.target, ast.Name):
+            return node
+        load = ast.Name(id=node.target.id, ctx=ast.Load())
+        call = ast.Call(func=ast.Name(id=name, ctx=ast.Load()), args=[load, node.value], keywords=[])
+        return ast.copy_location(ast.Assign(targets=[node.target], value=call), node)
+
+
+class _StandInModule(types.ModuleType):
+    """ A stand-in boa module, names the harness does not emulate FAULT when called. """
+
+    def __init__(self, name, interop, members):
+        types.ModuleType.__init__(self, name)
+        self.__dict__.update(members)
+        self.__dict__['__path__'] = []
+        self._interop = interop
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return self._interop.unsupported(name)
+
+
+class ContractHarness(object):
+    """
+    Runs the contract against in-memory storage.
+
+    :param contract_path: str Path of the contract source, LootMarketsContract.py by default.
+    :param storage: MemoryStorage Storage to run against, a new empty storage by default.
+    :param height: int The initial block height.
+    :param owner: Account If given, replaces contract_owner so the harness can sign as the contract owner.
+    :param trace_steps: bool Count executed contract lines as an approximation of ordinary opcodes.
+    """
+
+    def __init__(self, contract_path=None, storage=None, height=1, owner=None, trace_steps=True):
+        self.contract_path = os.path.abspath(contract_path or DEFAULT_CONTRACT_PATH)
+        self.storage = storage if storage is not None else MemoryStorage()
+        with open(self.contract_path, 'rb') as f:
+            source = f.read()
+        self.interop = Interop(self.storage, bytes(hash160(source)), height=height)
+        self.contract = self._load(source)
+        self.trace_steps = trace_steps
+        if owner is not None:
+            self.contract.contract_owner = owner.address
+
+    # region Loading
+
+    def _stand_in_modules(self):
+        interop = self.interop
+        builtins = {
+            'concat': concat,
+            'list': vm_list,
+            'range': range,
+            'take': take,
+            'substr': substr,
+            'has_key': has_key,
+            'keys': keys,
+            'values': values,
+            'verify_signature': interop.verify_signature,
+            'sha256': interop.sha256,
+            'hash160': interop.hash160,
+            'hash256': interop.hash256,
+        }
+        storage = {
+            'Get': interop.Get,
+            'Put': interop.Put,
+            'Delete': interop.Delete,
+            'GetContext': interop.GetContext,
+            'Find': interop.Find,
+        }
+        iterator = {
+            'IterNext': interop.IterNext,
+            'IterKey': interop.IterKey,
+            'IterValue': interop.IterValue,
+        }
+        runtime = {
+            'Notify': interop.Notify,
+            'Log': interop.Log,
+            'Serialize': interop.Serialize,
+            'Deserialize': interop.Deserialize,
+            'CheckWitness': interop.CheckWitness,
+            'GetTrigger': interop.GetTrigger,
+        }
+        blockchain = {
+            'GetHeight': interop.GetHeight,
+            'GetHeader': interop.GetHeader,
+        }
+        execution_engine = {
+            'GetExecutingScriptHash': interop.GetExecutingScriptHash,
+            'GetCallingScriptHash': interop.GetCallingScriptHash,
+            'GetEntryScriptHash': interop.GetEntryScriptHash,
+        }
+        modules = {
+            'boa': {},
+            'boa.builtins': builtins,
+            'boa.interop': {},
+            'boa.interop.System': {},
+            'boa.interop.System.ExecutionEngine': execution_engine,
+            'boa.interop.Neo': {},
+            'boa.interop.Neo.Storage': storage,
+            'boa.interop.Neo.Iterator': iterator,
+            'boa.interop.Neo.Runtime': runtime,
+            'boa.interop.Neo.Blockchain': blockchain,
+            'boa.interop.Neo.TriggerType': {'Application': interop.Application, 'Verification': interop.Verification},
+            'boa.interop.Neo.App': {'RegisterAppCall': interop.RegisterAppCall},
+            'boa.interop.Neo.Transaction': {},
+            'boa.interop.Neo.Output': {},
+            'boa.interop.Neo.Attribute': {},
+            'boa.interop.Neo.Action': {},
+            'boa.interop.Neo.Header': {},
+        }
+        return dict((name, _StandInModule(name, interop, members)) for name, members in modules.items())
+
+    def _load(self, source):
+        tree = _VMArithmetic().visit(ast.parse(source, self.contract_path))
+        ast.fix_missing_locations(tree)
+        code = compile(tree, self.contract_path, 'exec')
+
+        contract = types.ModuleType('LootMarketsContract')
+        contract.__file__ = self.contract_path
+        contract.__dict__.update({
+            '__vm_div__': vm_div,
+            '__vm_mod__': vm_mod,
+            # neo-boa compiles print to Runtime.Log.
+            'print': self.interop.Log,
+            'len': vm_len,
+        })
+
+        stand_ins = self._stand_in_modules()
+        saved = dict((name, sys.modules.get(name)) for name in stand_ins)
+        sys.modules.update(stand_ins)
+        try:
+            exec(code, contract.__dict__)
+        finally:
+            for name, module in saved.items():
+                if module is None:
+                    sys.modules.pop(name, None)
+                else:
+                    sys.modules[name] = module
+        return contract
+
+    # endregion
+
+    # region Chain state
+
+    @property
+    def height(self):
+        return self.interop.height
+
+    @height.setter
+    def height(self, value):
+        self.interop.height = value
+
+    def advance(self, blocks=1):
+        """ Move the chain forward, a new block also means new random numbers. """
+        self.interop.height += blocks
+        return self.interop.height
+
+    def set_app_call_handler(self, handler):
+        """
+        Handle calls the contract makes to other contracts, e.g. the LOOT NEP-5 transfer on withdrawal.
+        :param handler: callable(script_hash, operation, args) returning the result of the call.
+        """
+        self.interop.app_call_handler = handler
+
+    # endregion
+
+    # region Invocation
+
+    def invoke(self, operation, args=(), witnesses=(), caller=None):
+        """
+        Invoke Main(operation, args) as a single transaction.
+        Storage changes are rolled back if the contract faults.
+        :param operation: str The operation to invoke.
+        :param args: list The arguments, str and bytes become byte arrays.
+        :param witnesses: list Script hashes for which CheckWitness succeeds.
+        :param caller: bytes The calling script hash, e.g. the LOOT token contract for deposits.
+        :return: Invocation
+        """
+        interop = self.interop
+        stats = CallStats()
+        interop.stats = stats
+        interop.witnesses = set(to_bytes(w) for w in witnesses)
+        interop.calling_script_hash = to_bytes(caller) if caller is not None else b''
+        interop.notifications = []
+        interop.logs = []
+        stack_args = normalize(list(args))
+
+        fault = None
+        self.storage.begin()
+        try:
+            value = self._run(operation, stack_args)
+            self.storage.commit()
+        except Exception as e:
+            self.storage.rollback()
+            # Anything else is a bug in the harness rather than the contract faulting, and must not pass for one.
+            if not self._is_fault(e):
+                raise
+            fault = e
+            value = False
+            interop.notifications = []
+
+        stats.gas_units += stats.steps
+        return Invocation(operation, args, value, fault, interop.notifications, interop.logs, stats, interop.height)
+
+    def _is_fault(self, error):
+        """
+        Whether an error raised during an invocation is one the VM faults with: a VMFault raised by the stand-ins,
+        an arithmetic error, or an index or key looked up by the contract's own code that does not exist,
+        which the VM's PICKITEM faults on too.
+        """
+        if isinstance(error, (VMFault, ArithmeticError)):
+            return True
+        if isinstance(error, (IndexError, KeyError)):
+            traceback = error.__traceback__
+            while traceback.tb_next is not None:
+                traceback = traceback.tb_next
+            return traceback.tb_frame.f_code.co_filename == self.contract_path
+        return False
+
+    def _run(self, operation, args):
+        if not self.trace_steps:
+            return self.contract.Main(operation, args)
+
+        stats = self.interop.stats
+        filename = self.contract_path
+
+        def count_lines(frame, event, arg):
+            if event == 'line':
+                stats.steps += 1
+            return count_lines
+
+        def trace_calls(frame, event, arg):
+            if frame.f_code.co_filename == filename:
+                return count_lines
+            return None
+
+        previous = sys.gettrace()
+        sys.settrace(trace_calls)
+        try:
+            return self.contract.Main(operation, args)
+        finally:
+            sys.settrace(previous)
+
+    # endregion
+
+    def account(self, name):
+        """ A deterministic key pair, the same name always yields the same address. """
+        return Account(name)
@@ -0,0 +1,456 @@
+"""
+Off-chain indexer for the events LootMarketsContract emits with Runtime.Notify.
+
+Every payload shape the contract notifies is decoded into a typed record, e.g.
+["exchange", salt, marketplace, result] becomes ExchangeEvent(height, txid, salt,
+marketplace, result). Blocks are ingested in order and the last indexed height is
+persisted to a checkpoint, so a restarted indexer resumes where it stopped instead
+of rescanning the chain.
+
+    indexer = Indexer(Checkpoint('indexer.json'))
+    indexer.subscribe(ExchangeEvent, handle_exchange)
+    indexer.ingest(read_recording('blocks.jsonl'))
+
+Blocks are read from a recording, one JSON object per line in the form a node's
+getapplicationlog reports notifications:
+
+    {"height": 12, "notifications": [{"txid": "0x..", "contract": "0x..",
+                                      "state": {"type": "Array", "value": [...]}}]}
+
+Run `python -m lootframework.indexer blocks.jsonl` to index a recording and report
+the events per second, or `python -m lootframework.benchmark -s <scenario> --record
+blocks.jsonl` to record the notifications of a benchmark workload.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from collections import namedtuple
+
+from lootframework.vm import bytes_to_int, to_bytes
+
+
+# region Field decoders
+
+def _text(value):
+    return to_bytes(value).decode('utf-8', 'replace')
+
+
+def _bytes(value):
+    return to_bytes(value)
+
+
+def _int(value):
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, int):
+        return value
+    return bytes_to_int(to_bytes(value))
+
+
+def _bool(value):
+    if isinstance(value, (bool, int)):
+        return bool(value)
+    return any(to_bytes(value))
+
+
+def _bool_list(value):
+    return [_bool(item) for item in value]
+
+
+def _bytes_list(value):
+    return [_bytes(item) for item in value]
+
+
+def _inventory(value):
+    return [(_int(entry[0]), _int(entry[1])) for entry in value]
+
+
+def _settled_fills(value):
+    return [SettledFill(_bytes(fill[0]), _bytes(fill[1]), _int(fill[2]), _int(fill[3]), _int(fill[4]),
+                        _int(fill[5])) for fill in value]
+
+
+# endregion
+
+
+# region Event records
+
+# Every record starts with the block height and the transaction that emitted it.
+RECORD_FIELDS = ('height', 'txid')
+
+# A fill exchange_batch settled, with the fees it was charged.
+SettledFill = namedtuple('SettledFill', ('originator', 'taker', 'item_id', 'price', 'maker_fee', 'taker_fee'))
+
+# Marketplace events, keyed by the first element of the payload: (name, record, fields).
+MARKET_EVENTS = [
+    ('exchange', 'ExchangeEvent', [('salt', _bytes), ('marketplace', _text), ('result', _bool),
+                                   ('originator', _bytes), ('taker', _bytes), ('item_id', _int), ('price', _int),
+                                   ('maker_fee', _int), ('taker_fee', _int)]),
+    ('exchange_batch', 'ExchangeBatchEvent', [('marketplace', _text), ('results', _bool_list), ('result', _bool),
+                                              ('fills', _settled_fills)]),
+    ('trade', 'TradeEvent', [('salt', _bytes), ('marketplace', _text), ('result', _bool), ('originator', _bytes),
+                             ('taker', _bytes), ('item_id', _int)]),
+    ('give_item', 'GiveItemEvent', [('salt', _bytes), ('marketplace', _text), ('result', _bool), ('address', _bytes),
+                                    ('item_id', _int), ('quantity', _int)]),
+    ('give_items_batch', 'GiveItemsBatchEvent', [('salt', _bytes), ('marketplace', _text), ('count', _int),
+                                                 ('result', _bool)]),
+    ('remove_item', 'RemoveItemEvent', [('salt', _bytes), ('marketplace', _text), ('result', _bool),
+                                        ('address', _bytes), ('item_id', _int)]),
+    ('get_inventory', 'InventoryEvent', [('marketplace', _text), ('address', _bytes), ('inventory', _inventory)]),
+    ('migrate_inventory', 'MigrateInventoryEvent', [('marketplace', _text), ('address', _bytes),
+                                                    ('result', _bool)]),
+    ('migrate_balance', 'MigrateBalanceEvent', [('address', _bytes), ('result', _bool)]),
+    ('prune_orders', 'PruneOrdersEvent', [('considered', _int)]),
+    ('register_marketplace', 'RegisterMarketplaceEvent', [('marketplace', _text), ('address', _bytes),
+                                                          ('result', _bool)]),
+    ('marketplace_state', 'MarketplaceStateEvent', [('marketplace', _text), ('state', _bytes), ('result', _bool)]),
+    ('marketplace_owner', 'MarketplaceOwnerEvent', [('marketplace', _text), ('address', _bytes), ('result', _bool)]),
+    ('add_owner_signer', 'AddOwnerSignerEvent', [('marketplace', _text), ('address', _bytes),
+                                                 ('signer_index', _int)]),
+    ('deposit', 'DepositEvent', [('address', _bytes), ('amount', _int)]),
+    ('withdraw', 'WithdrawEvent', [('salt', _bytes), ('address', _bytes), ('amount', _int)]),
+    ('transfer', 'TransferEvent', [('salt', _bytes), ('result', _bool), ('originator', _bytes), ('taker', _bytes),
+                                   ('amount', _int)]),
+    ('balance_of', 'BalanceEvent', [('address', _bytes), ('balance', _int)]),
+    ('sweep_fees', 'SweepFeesEvent', [('marketplace', _text), ('fee_address', _bytes), ('amount', _int)]),
+]
+
+# Battle Royale events, ["BR", event_code, name, ...], keyed by the name.
+BR_EVENTS = [
+    ('BR_create', 'BRCreateEvent', [('address', _bytes), ('result', _bool)]),
+    ('BR_sign_up', 'BRSignUpEvent', [('address', _bytes), ('result', _bool)]),
+    ('BR_start', 'BRStartEvent', [('address', _bytes), ('result', _bool)]),
+    ('leaderboard', 'BRLeaderboardEvent', [('leaderboard', _bytes_list)]),
+    ('event_details', 'BREventDetailsEvent', [('details', _bytes)]),
+    ('fight', 'BRFightEvent', [('round', _int), ('address', _bytes), ('opponent', _bytes), ('won', _bool)]),
+    ('loot', 'BRLootEvent', [('address', _bytes), ('reward', _int)]),
+    ('round_end', 'BRRoundEndEvent', [('round', _int), ('ended', _bool)]),
+    ('removed_player', 'BRRemovedPlayerEvent', [('address', _bytes)]),
+    ('received_reward', 'BRReceivedRewardEvent', [('address', _bytes), ('reward', _int), ('marketplace', _text)]),
+    ('event_complete', 'BRCompleteEvent', [('result', _bool)]),
+    ('zone_marked', 'BRZoneMarkedEvent', [('side', _int), ('min_row', _int), ('max_row', _int), ('min_column', _int),
+                                          ('max_column', _int)]),
+]
+
+# A payload the indexer does not recognise is kept whole rather than dropped.
+UnknownEvent = namedtuple('UnknownEvent', RECORD_FIELDS + ('payload',))
+
+
+def _record_type(record, fields):
+    return namedtuple(record, RECORD_FIELDS + tuple(name for name, decode in fields))
+
+
+# name -> (record type, decoders), the record types are also module attributes, e.g. ExchangeEvent.
+_MARKET_DECODERS = {}
+_BR_DECODERS = {}
+EVENT_TYPES = []
+
+for _name, _record, _fields in MARKET_EVENTS:
+    _type = _record_type(_record, _fields)
+    _MARKET_DECODERS[_name] = (_type, tuple(decode for field, decode in _fields))
+    EVENT_TYPES.append(_type)
+    globals()[_record] = _type
+
+for _name, _record, _fields in BR_EVENTS:
+    _type = _record_type(_record, (('event_code', _text),) + tuple(_fields))
+    _BR_DECODERS[_name] = (_type, tuple(decode for field, decode in _fields))
+    EVENT_TYPES.append(_type)
+    globals()[_record] = _type
+
+del _name, _record, _fields, _type
+
+
+def _decode_fields(record_type, decoders, height, txid, head, values):
+    """ Fields missing from the end of a payload are None, extra fields are ignored. """
+    decoded = [height, txid] + head
+    for i, decode in enumerate(decoders):
+        decoded.append(decode(values[i]) if i < len(values) else None)
+    return record_type(*decoded)
+
+
+def decode_event(height, txid, payload):
+    """
+    Decode a notification payload into its event record.
+    :param height: int The height of the block the notification was emitted in.
+    :param txid: str The transaction that emitted it.
+    :param payload: list The payload, as notified by the contract or decoded by decode_parameter.
+    :return: The event record, an UnknownEvent if the payload is not one the contract emits.
+    """
+    if not isinstance(payload, list) or len(payload) == 0:
+        return UnknownEvent(height, txid, payload)
+
+    name = _text(payload[0]) if isinstance(payload[0], (bytes, str)) else None
+    if name == 'BR' and len(payload) >= 3:
+        entry = _BR_DECODERS.get(_text(payload[2]))
+        if entry is not None:
+            return _decode_fields(entry[0], entry[1], height, txid, [_text(payload[1])], payload[3:])
+    else:
+        entry = _MARKET_DECODERS.get(name)
+        if entry is not None:
+            return _decode_fields(entry[0], entry[1], height, txid, [], payload[1:])
+
+    return UnknownEvent(height, txid, payload)
+
+
+# endregion
+
+
+# region Contract parameters
+
+def decode_parameter(parameter):
+    """
+    Convert a contract parameter, as reported by a node's RPC, to the value the contract notified.
+    Byte arrays become bytes, integers int and booleans bool.
+    """
+    kind = parameter['type']
+    value = parameter.get('value')
+    if kind == 'ByteArray':
+        return bytes.fromhex(value)
+    if kind == 'Integer':
+        return int(value)
+    if kind == 'Boolean':
+        return value if isinstance(value, bool) else value == 'true'
+    if kind == 'String':
+        return value.encode('utf-8')
+    if kind == 'Array':
+        return [decode_parameter(item) for item in value]
+    if kind == 'Map':
+        return dict((decode_parameter(entry['key']), decode_parameter(entry['value'])) for entry in value)
+    return value
+
+
+def encode_parameter(value):
+    """ The inverse of decode_parameter, used to record notifications in the form a node reports them. """
+    if isinstance(value, bool):
+        return {'type': 'Boolean', 'value': value}
+    if isinstance(value, int):
+        return {'type': 'Integer', 'value': str(value)}
+    if isinstance(value, (bytes, bytearray, str)):
+        return {'type': 'ByteArray', 'value': to_bytes(value).hex()}
+    if isinstance(value, (list, tuple)):
+        return {'type': 'Array', 'value': [encode_parameter(item) for item in value]}
+    if isinstance(value, dict):
+        return {'type': 'Map', 'value': [{'key': encode_parameter(k), 'value': encode_parameter(v)}
+                                         for k, v in value.items()]}
+    raise ValueError("Cannot encode %r as a contract parameter" % (value,))
+
+
+# endregion
+
+
+# region Blocks and recordings
+
+Block = namedtuple('Block', ('height', 'notifications'))
+
+# A notification as reported by a node, `state` is the payload as a contract parameter.
+Notification = namedtuple('Notification', ('txid', 'contract', 'state'))
+
+
+def read_recording(path):
+    """
+    Iterate the blocks of a recording, one JSON object per line.
+    :return: generator of Block
+    """
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            block = json.loads(line)
+            notifications = [Notification(n.get('txid'), n.get('contract'), n['state'])
+                             for n in block.get('notifications', ())]
+            yield Block(block['height'], notifications)
+
+
+class Recorder(object):
+    """
+    Records the notifications of harness invocations as blocks, to replay through the indexer.
+    Invocations at the same height are recorded in the same block.
+
+    :param path: str The recording to write, one block per line.
+    :param script_hash: bytes The hash of the contract the notifications come from.
+    """
+
+    def __init__(self, path, script_hash):
+        self.path = path
+        self.contract = '0x' + to_bytes(script_hash)[::-1].hex()
+        self._file = open(path, 'w')
+        self._block = None
+        self._transactions = 0
+
+    def record(self, invocation):
+        if self._block is not None and self._block['height'] != invocation.height:
+            self._flush()
+        if self._block is None:
+            self._block = {'height': invocation.height, 'notifications': []}
+
+        # Transactions have no hash in the harness, a counter keeps them unique within the recording.
+        self._transactions += 1
+        txid = '0x' + hashlib.sha256(b'tx%d' % self._transactions).hexdigest()
+        for payload in invocation.notifications:
+            self._block['notifications'].append({'txid': txid, 'contract': self.contract,
+                                                 'state': encode_parameter(payload)})
+
+    def _flush(self):
+        if self._block is not None and self._block['notifications']:
+            self._file.write(json.dumps(self._block, separators=(',', ':')))
+            self._file.write('\n')
+        self._block = None
+
+    def close(self):
+        self._flush()
+        self._file.close()
+
+
+# endregion
+
+
+# region Indexer
+
+class Checkpoint(object):
+    """
+    The height of the last block indexed, persisted to a JSON file.
+    The file is replaced atomically, so a crash leaves either the old or the new height.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        """ :return: int The last indexed height, -1 if nothing has been indexed. """
+        if not os.path.exists(self.path):
+            return -1
+        with open(self.path) as f:
+            return json.load(f)['height']
+
+    def save(self, height):
+        temporary = self.path + '.tmp'
+        with open(temporary, 'w') as f:
+            json.dump({'height': height}, f)
+        os.replace(temporary, self.path)
+
+
+class Indexer(object):
+    """
+    Decodes the notifications of each block into event records and passes them to subscribers.
+
+    :param checkpoint: Checkpoint Where the last indexed height is persisted, None to keep it in memory.
+    :param script_hash: str Only index notifications from this contract, e.g. '0x..', None for every contract.
+    :param checkpoint_interval: int Persist the checkpoint every this many blocks, and when ingest returns.
+        Blocks after the last persisted checkpoint are indexed again after a restart.
+    """
+
+    def __init__(self, checkpoint=None, script_hash=None, checkpoint_interval=1):
+        self.checkpoint = checkpoint
+        self.script_hash = script_hash
+        self.checkpoint_interval = checkpoint_interval
+        self.height = checkpoint.load() if checkpoint is not None else -1
+        self.events = 0
+        self._subscribers = {}
+        self._all_subscribers = []
+        self._block_subscribers = []
+        self._unsaved_blocks = 0
+
+    def subscribe(self, event_type, handler):
+        """
+        Call handler(event) for every event of a type, in chain order.
+        :param event_type: The record type, e.g. ExchangeEvent, None for every event.
+        """
+        if event_type is None:
+            self._all_subscribers.append(handler)
+        else:
+            self._subscribers.setdefault(event_type, []).append(handler)
+
+    def subscribe_blocks(self, handler):
+        """ Call handler(height) after the events of each block have been passed to subscribers. """
+        self._block_subscribers.append(handler)
+
+    def ingest_block(self, block):
+        """
+        Index a block, blocks at or below the checkpoint have already been indexed and are skipped.
+        :return: int The number of events indexed.
+        """
+        height = block.height
+        if height <= self.height:
+            return 0
+
+        count = 0
+        subscribers = self._subscribers
+        all_subscribers = self._all_subscribers
+        for notification in block.notifications:
+            if self.script_hash is not None and notification.contract != self.script_hash:
+                continue
+            event = decode_event(height, notification.txid, decode_parameter(notification.state))
+            for handler in subscribers.get(type(event), ()):
+                handler(event)
+            for handler in all_subscribers:
+                handler(event)
+            count += 1
+
+        self.height = height
+        self.events += count
+        for handler in self._block_subscribers:
+            handler(height)
+        self._unsaved_blocks += 1
+        if self._unsaved_blocks >= self.checkpoint_interval:
+            self.save_checkpoint()
+        return count
+
+    def ingest(self, blocks):
+        """
+        Index blocks in order, then persist the checkpoint.
+        :param blocks: iterable of Block, e.g. read_recording(path).
+        :return: int The number of events indexed.
+        """
+        count = 0
+        try:
+            for block in blocks:
+                count += self.ingest_block(block)
+        finally:
+            self.save_checkpoint()
+        return count
+
+    def save_checkpoint(self):
+        if self.checkpoint is not None and self._unsaved_blocks:
+            self.checkpoint.save(self.height)
+        self._unsaved_blocks = 0
+
+
+# endregion
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Index the LootMarketsContract notifications of a recording.")
+    parser.add_argument('recording', help="Blocks to index, one JSON object per line.")
+    parser.add_argument('--checkpoint', help="Persist the last indexed height here and resume from it.")
+    parser.add_argument('--checkpoint-interval', type=int, default=1000,
+                        help="Persist the checkpoint every this many blocks.")
+    parser.add_argument('--script-hash', help="Only index notifications from this contract.")
+    options = parser.parse_args(argv)
+
+    checkpoint = Checkpoint(options.checkpoint) if options.checkpoint else None
+    indexer = Indexer(checkpoint, options.script_hash, options.checkpoint_interval)
+    counts = {}
+
+    def count(event):
+        name = type(event).__name__
+        counts[name] = counts.get(name, 0) + 1
+    indexer.subscribe(None, count)
+
+    start = time.perf_counter()
+    total = indexer.ingest(read_recording(options.recording))
+    elapsed = time.perf_counter() - start
+
+    for name, number in sorted(counts.items()):
+        print('%-26s %8d' % (name, number))
+    rate = total / elapsed if elapsed else 0.0
+    print('%d events up to height %d in %.3fs, %.0f events/s' % (total, indexer.height, elapsed, rate))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
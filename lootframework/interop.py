@@ -0,0 +1,451 @@
+"""
+In-memory stand-ins for the boa.interop services used by the contract.
+
+Every storage, runtime and blockchain call is metered into a CallStats record
+and priced with NEO 2.x's ApplicationEngine price table, so that an offline
+invocation yields an estimated GAS cost without deploying to a node.
+"""
+
+import hashlib
+import json
+from decimal import Decimal
+
+from lootframework.orders import encode_order, hash_order
+from lootframework.vm import (VMBytes, VMFault, deserialize, hash160, hash256, normalize, plain, serialize, sha256,
+                              to_bytes)
+
+# region Price table
+
+# One unit of the price table is 0.001 GAS.
+GAS_PER_UNIT = Decimal('0.001')
+
+# Opcodes that cost more than the default of 1 unit.
+OPCODE_PRICES = {
+    'APPCALL': 10,
+    'TAILCALL': 10,
+    'SHA1': 10,
+    'SHA256': 10,
+    'HASH160': 20,
+    'HASH256': 20,
+    'CHECKSIG': 100,
+    'VERIFY': 100,
+}
+
+# Syscalls that cost more than the default of 1 unit, Storage.Put is priced by size.
+SYSCALL_PRICES = {
+    'Neo.Runtime.CheckWitness': 200,
+    'Neo.Blockchain.GetHeader': 100,
+    'Neo.Blockchain.GetBlock': 200,
+    'Neo.Blockchain.GetTransaction': 100,
+    'Neo.Blockchain.GetContract': 100,
+    'Neo.Storage.Get': 100,
+    'Neo.Storage.Delete': 100,
+}
+
+DEFAULT_PRICE = 1
+
+
+def storage_put_price(key, value):
+    """
+    Price of Storage.Put, 1000 units per started KiB of key and value.
+    """
+    size = len(key) + len(value)
+    return ((size - 1) // 1024 + 1) * 1000
+
+
+# endregion
+
+
+class CallStats(object):
+    """
+    Counters for a single contract invocation, or an aggregate of several.
+    """
+
+    FIELDS = ('steps', 'syscalls', 'storage_reads', 'storage_writes', 'storage_deletes', 'bytes_read',
+              'bytes_written', 'serializations', 'deserializations', 'serialized_bytes', 'notifications',
+              'witness_checks', 'signature_checks', 'hashes', 'app_calls', 'gas_units')
+
+    def __init__(self):
+        for field in self.FIELDS:
+            setattr(self, field, 0)
+
+    @property
+    def storage_ops(self):
+        return self.storage_reads + self.storage_writes + self.storage_deletes
+
+    @property
+    def gas(self):
+        """ The estimated GAS consumed, before the free allowance. """
+        return self.gas_units * GAS_PER_UNIT
+
+    def add(self, other):
+        """ Accumulate the counters of another CallStats into this one. """
+        for field in self.FIELDS:
+            setattr(self, field, getattr(self, field) + getattr(other, field))
+        return self
+
+    def as_dict(self):
+        result = dict((field, getattr(self, field)) for field in self.FIELDS)
+        result['storage_ops'] = self.storage_ops
+        result['gas'] = str(self.gas)
+        return result
+
+    def __repr__(self):
+        return 'CallStats(storage_ops=%d, bytes_written=%d, gas=%s)' % (self.storage_ops, self.bytes_written,
+                                                                        self.gas)
+
+
+class StorageContext(object):
+    """ Returned by Storage.GetContext, identifies the storage being accessed. """
+
+    def __init__(self, storage):
+        self.storage = storage
+
+
+class MemoryStorage(object):
+    """
+    In-memory contract storage.
+    Writes are journaled during an invocation so that a FAULT can roll them back.
+    """
+
+    def __init__(self, items=None):
+        self.items = dict(items or {})
+        self._journal = None
+
+    def get(self, key):
+        return self.items.get(key, b'')
+
+    def put(self, key, value):
+        self._record(key)
+        self.items[key] = value
+
+    def delete(self, key):
+        self._record(key)
+        self.items.pop(key, None)
+
+    def find(self, prefix):
+        """ All (key, value) pairs whose key starts with the prefix, ordered by key. """
+        return sorted((k, v) for k, v in self.items.items() if k.startswith(prefix))
+
+    def begin(self):
+        self._journal = {}
+
+    def commit(self):
+        self._journal = None
+
+    def rollback(self):
+        for key, value in self._journal.items():
+            if value is None:
+                self.items.pop(key, None)
+            else:
+                self.items[key] = value
+        self._journal = None
+
+    def copy(self):
+        return MemoryStorage(self.items)
+
+    def _record(self, key):
+        if self._journal is not None and key not in self._journal:
+            self._journal[key] = self.items.get(key)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def write_storage_dump(storage, path):
+    """
+    Write every entry of a MemoryStorage in key order, one JSON object with the hex key and value per line.
+    """
+    with open(path, 'w') as f:
+        for key, value in sorted(storage.items.items()):
+            f.write(json.dumps({'key': key.hex(), 'value': value.hex()}) + '\n')
+
+
+def read_storage_dump(path):
+    """
+    Read a storage dump written by write_storage_dump, one entry at a time.
+    :return: iterator of (key, value) bytes pairs.
+    """
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                yield bytes.fromhex(entry['key']), bytes.fromhex(entry['value'])
+
+
+class StorageIterator(object):
+    """ Returned by Storage.Find, iterates a snapshot of the matching entries in key order. """
+
+    def __init__(self, interop, entries):
+        self._interop = interop
+        self._entries = entries
+        self._index = -1
+
+    def next(self):
+        self._index += 1
+        if self._index >= len(self._entries):
+            return False
+        self._interop.stats.bytes_read += len(self._entries[self._index][1])
+        return True
+
+    def key(self):
+        return VMBytes(self._entries[self._index][0])
+
+    def value(self):
+        return VMBytes(self._entries[self._index][1])
+
+    # Method style access, e.g. iterator.IterNext().
+    def IterNext(self):
+        return self._interop.IterNext(self)
+
+    def IterKey(self):
+        return self._interop.IterKey(self)
+
+    def IterValue(self):
+        return self._interop.IterValue(self)
+
+
+class Header(object):
+    """ The parts of a block header read by the contract. """
+
+    def __init__(self, index, consensus_data):
+        self.Index = index
+        self.ConsensusData = consensus_data
+
+
+class Interop(object):
+    """
+    The interop services of a NEO node for one deployed contract.
+    The harness binds these methods into stand-in boa modules before loading the contract.
+    """
+
+    TRIGGER_VERIFICATION = 0x00
+    TRIGGER_APPLICATION = 0x10
+
+    def __init__(self, storage, script_hash, height=1, seed=b'LootMarketsContract'):
+        self.storage = storage
+        self.context = StorageContext(storage)
+        self.script_hash = script_hash
+        self.height = height
+        self.seed = seed
+        self.trigger = self.TRIGGER_APPLICATION
+        self.witnesses = set()
+        self.calling_script_hash = b''
+        self.notifications = []
+        self.logs = []
+        self.app_call_handler = None
+        # callable(public_key, signature, message) checking real signatures, the harness's own by default.
+        self.signature_verifier = None
+        self.stats = CallStats()
+
+    # region Metering
+
+    def charge_syscall(self, name, price=None):
+        self.stats.syscalls += 1
+        if price is None:
+            price = SYSCALL_PRICES.get(name, DEFAULT_PRICE)
+        self.stats.gas_units += price
+
+    def charge_opcode(self, name):
+        self.stats.gas_units += OPCODE_PRICES.get(name, DEFAULT_PRICE)
+
+    # endregion
+
+    # region Storage
+
+    def GetContext(self):
+        self.charge_syscall('Neo.Storage.GetContext')
+        return self.context
+
+    def Get(self, context, key):
+        key = to_bytes(key)
+        value = context.storage.get(key)
+        self.charge_syscall('Neo.Storage.Get')
+        self.stats.storage_reads += 1
+        self.stats.bytes_read += len(value)
+        return VMBytes(value)
+
+    def Put(self, context, key, value):
+        key = to_bytes(key)
+        value = to_bytes(value)
+        self.charge_syscall('Neo.Storage.Put', storage_put_price(key, value))
+        self.stats.storage_writes += 1
+        self.stats.bytes_written += len(key) + len(value)
+        context.storage.put(key, value)
+
+    def Delete(self, context, key):
+        key = to_bytes(key)
+        self.charge_syscall('Neo.Storage.Delete')
+        self.stats.storage_deletes += 1
+        context.storage.delete(key)
+
+    def Find(self, context, prefix):
+        prefix = to_bytes(prefix)
+        self.charge_syscall('Neo.Storage.Find')
+        self.stats.storage_reads += 1
+        return StorageIterator(self, context.storage.find(prefix))
+
+    def IterNext(self, iterator):
+        self.charge_syscall('Neo.Iterator.Next')
+        return iterator.next()
+
+    def IterKey(self, iterator):
+        self.charge_syscall('Neo.Iterator.Key')
+        return iterator.key()
+
+    def IterValue(self, iterator):
+        self.charge_syscall('Neo.Iterator.Value')
+        return iterator.value()
+
+    # endregion
+
+    # region Runtime
+
+    def GetTrigger(self):
+        self.charge_syscall('Neo.Runtime.GetTrigger')
+        return self.trigger
+
+    def Application(self):
+        return self.TRIGGER_APPLICATION
+
+    def Verification(self):
+        return self.TRIGGER_VERIFICATION
+
+    def CheckWitness(self, hash_or_pubkey):
+        self.charge_syscall('Neo.Runtime.CheckWitness')
+        self.stats.witness_checks += 1
+        return to_bytes(hash_or_pubkey) in self.witnesses
+
+    def Notify(self, state):
+        self.charge_syscall('Neo.Runtime.Notify')
+        self.stats.notifications += 1
+        # Notifications leave the VM as byte arrays, integers and booleans, as a node reports them.
+        self.notifications.append(plain(normalize(state)))
+
+    def Log(self, *message):
+        self.charge_syscall('Neo.Runtime.Log')
+        self.logs.append(' '.join(str(m) for m in message))
+
+    def Serialize(self, item):
+        self.charge_syscall('Neo.Runtime.Serialize')
+        data = serialize(item)
+        self.stats.serializations += 1
+        self.stats.serialized_bytes += len(data)
+        return data
+
+    def Deserialize(self, data):
+        self.charge_syscall('Neo.Runtime.Deserialize')
+        self.stats.deserializations += 1
+        return deserialize(data)
+
+    # endregion
+
+    # region Blockchain
+
+    def GetHeight(self):
+        self.charge_syscall('Neo.Blockchain.GetHeight')
+        return self.height
+
+    def GetHeader(self, height):
+        self.charge_syscall('Neo.Blockchain.GetHeader')
+        return Header(height, self.consensus_data(height))
+
+    def consensus_data(self, height):
+        """ The block nonce, derived deterministically from the seed so games replay identically. """
+        digest = hashlib.sha256(self.seed + int(height).to_bytes(8, 'little')).digest()
+        return int.from_bytes(digest[:8], 'little')
+
+    # endregion
+
+    # region Execution engine and app calls
+
+    def GetExecutingScriptHash(self):
+        self.charge_syscall('System.ExecutionEngine.GetExecutingScriptHash')
+        return VMBytes(self.script_hash)
+
+    def GetCallingScriptHash(self):
+        self.charge_syscall('System.ExecutionEngine.GetCallingScriptHash')
+        return VMBytes(self.calling_script_hash)
+
+    def GetEntryScriptHash(self):
+        self.charge_syscall('System.ExecutionEngine.GetEntryScriptHash')
+        return VMBytes(self.calling_script_hash or self.script_hash)
+
+    def RegisterAppCall(self, script_hash, *arg_names):
+        """ Returns a callable which invokes another contract through the app call handler. """
+        def app_call(operation, args):
+            self.charge_opcode('APPCALL')
+            self.stats.app_calls += 1
+            if self.app_call_handler is None:
+                return True
+            return self.app_call_handler(script_hash, operation, plain(args))
+        return app_call
+
+    # endregion
+
+    # region Builtins with a price
+
+    def sha256(self, data):
+        self.charge_opcode('SHA256')
+        self.stats.hashes += 1
+        return sha256(data)
+
+    def hash160(self, data):
+        self.charge_opcode('HASH160')
+        self.stats.hashes += 1
+        return hash160(data)
+
+    def hash256(self, data):
+        self.charge_opcode('HASH256')
+        self.stats.hashes += 1
+        return hash256(data)
+
+    def verify_signature(self, public_key, signature, message):
+        self.charge_opcode('VERIFY')
+        self.stats.signature_checks += 1
+        if self.signature_verifier is not None:
+            return bool(self.signature_verifier(to_bytes(public_key), to_bytes(signature), to_bytes(message)))
+        return to_bytes(signature) == sign_message(public_key, message)
+
+    # endregion
+
+    def unsupported(self, name):
+        """ A stand-in for interop services the harness does not emulate. """
+        def call(*args):
+            raise VMFault("%s is not supported by the offline harness" % name)
+        return call
+
+
+def sign_message(public_key, message):
+    """
+    The harness's stand-in for an ECDSA signature: a 64 byte digest over the public key and message.
+    It is deterministic and cheap, and is only accepted by the offline harness.
+    """
+    public_key = to_bytes(public_key)
+    message = to_bytes(message)
+    return hashlib.sha256(b'sig' + public_key + message).digest() + hashlib.sha256(message + public_key).digest()
+
+
+class Account(object):
+    """ A key pair known to the harness, with the address the contract derives from its public key. """
+
+    def __init__(self, name):
+        self.name = name
+        self.public_key = b'\x02' + hashlib.sha256(to_bytes(name)).digest()
+        # The contract derives the script hash with this redeem script, see verify_order.
+        self.address = bytes(hash160(b'21' + self.public_key + b'ac'))
+
+    def sign(self, operation, fields, suffix):
+        """
+        Sign an order the way verify_order checks it, over the digest of the encoded order.
+        :param operation: str The operation being signed.
+        :param fields: list|bytes The order fields, or a body already encoded with encode_order.
+        :param suffix: bytes The signer's suffix, usually its order salt.
+        :return: bytes The signature.
+        """
+        body = fields if isinstance(fields, bytes) else encode_order(fields)
+        return sign_message(self.public_key, hash_order(operation, body, suffix))
+
+    def __repr__(self):
+        return 'Account(%r)' % self.name
+
@@ -0,0 +1,504 @@
+"""
+In-memory order book for the put_offer and buy_offer orders the exchange operation settles.
+
+An order is the tuple its owner signs, ["put_offer", marketplace, item_id, price, salt]
+or ["buy_offer", marketplace, item_id, price, salt], with the signer's address,
+signature and public key. The book keeps the orders of each marketplace and item id
+in price levels: asks are listed lowest price first and bids highest price first,
+and orders within a level in the order they arrived.
+
+Both parties to an exchange sign the same price, so an incoming order only matches
+resting orders at exactly its price, the oldest first. A match carries everything the
+marketplace owner needs: the digest to sign, and the exchange or exchange_batch
+arguments once signed.
+
+    book = OrderBook()
+    book.add(Order.put_offer('LootClicker', 735, 100000000, salt, seller, signature, public_key))
+    match = book.add(Order.buy_offer('LootClicker', 735, 100000000, salt, buyer, signature, public_key))
+    owner_signature = sign(match.owner_digest())
+    args = match.exchange_args(owner_signature, owner_address, owner_public_key)
+
+Run `python -m lootframework.orderbook` to measure matches per second against a book
+of resting offers.
+"""
+
+import argparse
+import heapq
+import sys
+import time
+from collections import deque
+
+from lootframework.orders import encode_order, hash_order
+
+PUT_OFFER = 'put_offer'
+BUY_OFFER = 'buy_offer'
+
+# The first bytes of a compact salt are the block height the order expires at, see order_complete.
+ORDER_SALT_LENGTH = 16
+ORDER_EXPIRY_LENGTH = 4
+
+
+class Order(object):
+    """ A signed put_offer or buy_offer. """
+
+    __slots__ = ('side', 'marketplace', 'item_id', 'price', 'salt', 'address', 'signature', 'public_key',
+                 'sequence', 'cancelled', 'filled')
+
+    def __init__(self, side, marketplace, item_id, price, salt, address, signature, public_key):
+        if side not in (PUT_OFFER, BUY_OFFER):
+            raise ValueError("An order is a %s or a %s, not %r" % (PUT_OFFER, BUY_OFFER, side))
+        if price <= 0:
+            raise ValueError("The price must be > 0.")
+        self.side = side
+        self.marketplace = marketplace
+        self.item_id = item_id
+        self.price = price
+        self.salt = salt
+        self.address = address
+        self.signature = signature
+        self.public_key = public_key
+        self.sequence = None
+        self.cancelled = False
+        self.filled = False
+
+    @classmethod
+    def put_offer(cls, marketplace, item_id, price, salt, address, signature, public_key):
+        return cls(PUT_OFFER, marketplace, item_id, price, salt, address, signature, public_key)
+
+    @classmethod
+    def buy_offer(cls, marketplace, item_id, price, salt, address, signature, public_key):
+        return cls(BUY_OFFER, marketplace, item_id, price, salt, address, signature, public_key)
+
+    @property
+    def args(self):
+        """ The order as its owner signs it. """
+        return [self.side, self.marketplace, self.item_id, self.price, self.salt]
+
+    @property
+    def expiry(self):
+        """ The block height a compact salt expires at, None for legacy salts that never expire. """
+        if len(self.salt) != ORDER_SALT_LENGTH:
+            return None
+        return int.from_bytes(self.salt[:ORDER_EXPIRY_LENGTH], 'little')
+
+    def expired(self, height):
+        expiry = self.expiry
+        return expiry is not None and expiry < height
+
+    def __repr__(self):
+        return 'Order(%r, %r, %r, %r, %r)' % (self.side, self.marketplace, self.item_id, self.price, self.salt)
+
+
+class Match(object):
+    """ A put_offer and a buy_offer at the same price, ready for the marketplace owner to sign. """
+
+    __slots__ = ('ask', 'bid')
+
+    def __init__(self, ask, bid):
+        self.ask = ask
+        self.bid = bid
+
+    @property
+    def marketplace(self):
+        return self.ask.marketplace
+
+    @property
+    def item_id(self):
+        return self.ask.item_id
+
+    @property
+    def price(self):
+        return self.ask.price
+
+    def owner_digest(self):
+        """ The digest the marketplace owner signs to permit the exchange, see exchange in the contract. """
+        body = encode_order([self.marketplace, self.item_id, self.price])
+        return hash_order('exchange', body, self.ask.address + self.bid.address)
+
+    def fill(self):
+        """ The match in the form exchange_batch settles it. """
+        ask = self.ask
+        bid = self.bid
+        return [ask.address, ask.signature, ask.public_key, bid.address, bid.signature, bid.public_key,
+                self.item_id, self.price, ask.salt, bid.salt]
+
+    def exchange_args(self, owner_signature, owner_address=None, owner_public_key=None, signer_index=None):
+        """
+        The arguments of the exchange operation.
+        :param owner_signature: bytes The marketplace owner's signature of owner_digest().
+        :param owner_address: bytes The marketplace owner's address, with owner_public_key.
+        :param owner_public_key: bytes The marketplace owner's public key.
+        :param signer_index: int Instead of the address and public key, the owner's registered signer.
+        :return: list
+        """
+        ask = self.ask
+        bid = self.bid
+        if signer_index is not None:
+            args = [self.marketplace, signer_index, owner_signature]
+        else:
+            args = [self.marketplace, owner_address, owner_signature, owner_public_key]
+        return args + [ask.address, ask.signature, ask.public_key, bid.address, bid.signature, bid.public_key,
+                       self.item_id, self.price, ask.salt, bid.salt]
+
+    def __repr__(self):
+        return 'Match(%r, %r, price=%r)' % (self.ask.salt, self.bid.salt, self.price)
+
+
+class _Level(object):
+    """
+    The resting orders at one price, a FIFO queue for each address. A heap of the sequence of the
+    first order of each queue finds the oldest order, or the oldest from another address without
+    passing over the orders of the address being matched. Orders that are no longer live are
+    removed lazily when they reach the front of their queue.
+    """
+
+    __slots__ = ('queues', 'heads')
+
+    def __init__(self):
+        self.queues = {}
+        # One (sequence, address) entry for each queue, of its first order or of an order that has since left the
+        # front. A stale entry is corrected when it reaches the top, and a queue is only dropped with its entry.
+        self.heads = []
+
+    def append(self, order):
+        queue = self.queues.get(order.address)
+        if queue is None:
+            queue = self.queues[order.address] = deque()
+            heapq.heappush(self.heads, (order.sequence, order.address))
+        queue.append(order)
+
+    def oldest(self, skipped, height, expired):
+        """
+        The oldest live order not from the skipped address, None if there is none.
+        :param height: int If given, orders that expired before this height are cancelled and appended to expired.
+        """
+        heads = self.heads
+        held = None
+        order = None
+        while heads:
+            sequence, address = heads[0]
+            queue = self.queues[address]
+            while queue:
+                front = queue[0]
+                if front.cancelled or front.filled:
+                    queue.popleft()
+                elif height is not None and front.expired(height):
+                    front.cancelled = True
+                    expired.append(front)
+                    queue.popleft()
+                else:
+                    break
+            if not queue:
+                del self.queues[address]
+                heapq.heappop(heads)
+            elif queue[0].sequence != sequence:
+                heapq.heapreplace(heads, (queue[0].sequence, address))
+            elif address == skipped:
+                # Each queue has one entry, so the next live one is from another address.
+                held = heapq.heappop(heads)
+            else:
+                order = queue[0]
+                break
+        if held is not None:
+            heapq.heappush(heads, held)
+        return order
+
+    def orders(self):
+        """ Every live order, oldest first. """
+        live = [order for queue in self.queues.values() for order in queue
+                if not order.cancelled and not order.filled]
+        live.sort(key=lambda order: order.sequence)
+        return live
+
+
+class _BookSide(object):
+    """
+    The resting orders on one side of an item's book.
+    Each price level is a _Level, a heap of prices finds the best level. Cancelled and filled orders
+    are only marked, they are removed lazily when they reach the front of their queue.
+    A level is dropped once it has no live orders left, and its price with it when the heap is next read.
+    """
+
+    __slots__ = ('levels', 'live', 'prices', 'heaped', 'sign')
+
+    def __init__(self, sign):
+        self.levels = {}
+        # The number of live orders of each level.
+        self.live = {}
+        self.prices = []
+        # The prices in the heap, a level recreated at a price still in the heap is not pushed again.
+        self.heaped = set()
+        # Asks keep the lowest price on top of the heap, bids the highest.
+        self.sign = sign
+
+    def add(self, order):
+        """ Rest an order, its sequence must be set and be the highest of the side. """
+        price = order.price
+        level = self.levels.get(price)
+        if level is None:
+            level = self.levels[price] = _Level()
+            self.live[price] = 0
+            if price not in self.heaped:
+                heapq.heappush(self.prices, self.sign * price)
+                self.heaped.add(price)
+        level.append(order)
+        self.live[price] += 1
+
+    def remove(self, order):
+        """ Account for a resting order that was cancelled, it stays in its level until it reaches the front. """
+        self._release(order.price)
+
+    def _release(self, price):
+        live = self.live[price] - 1
+        if live:
+            self.live[price] = live
+            return
+        del self.levels[price]
+        del self.live[price]
+        # Prices of dropped levels are popped when they reach the top of the heap, rebuild the heap
+        # if too many of them sit below it.
+        if len(self.prices) > 2 * len(self.levels) + 16:
+            self.prices = [self.sign * price for price in self.levels]
+            heapq.heapify(self.prices)
+            self.heaped = set(self.levels)
+
+    def take(self, price, address, height, expired):
+        """
+        Remove and return the oldest live order at a price from another address, None if there is none.
+        :param expired: list Orders of the level found to have expired are removed and appended here.
+        """
+        level = self.levels.get(price)
+        if level is None:
+            return None
+
+        dropped = len(expired)
+        order = level.oldest(address, height, expired)
+        for _ in range(len(expired) - dropped):
+            self._release(price)
+        if order is not None:
+            order.filled = True
+            self._release(price)
+        return order
+
+    def best(self):
+        """ The first live order at the best price, None if the side is empty. """
+        prices = self.prices
+        while prices:
+            price = self.sign * prices[0]
+            level = self.levels.get(price)
+            if level is not None:
+                return level.oldest(None, None, None)
+            heapq.heappop(prices)
+            self.heaped.discard(price)
+        return None
+
+    def orders(self):
+        """ Every live order, best price first and oldest first within a price. """
+        result = []
+        for price in sorted(self.levels, key=lambda p: self.sign * p):
+            result.extend(self.levels[price].orders())
+        return result
+
+
+class _ItemBook(object):
+    __slots__ = ('asks', 'bids')
+
+    def __init__(self):
+        self.asks = _BookSide(1)
+        self.bids = _BookSide(-1)
+
+
+class OrderBook(object):
+    """
+    Resting orders of every marketplace and item id, matched with price-time priority.
+    Adding, matching and cancelling an order take O(log n) amortized time, in the number of price levels of its item
+    and of addresses resting orders at its price. Cancelled, filled and expired orders are each removed once, by
+    whichever operation reaches them.
+    """
+
+    def __init__(self):
+        self._books = {}
+        self._orders = {}
+        self._sequence = 0
+
+    def __len__(self):
+        return len(self._orders)
+
+    def __contains__(self, salt):
+        return salt in self._orders
+
+    def _book(self, marketplace, item_id):
+        key = (marketplace, item_id)
+        book = self._books.get(key)
+        if book is None:
+            book = self._books[key] = _ItemBook()
+        return book
+
+    def add(self, order, height=None):
+        """
+        Match an order against the book, or rest it if nothing matches.
+        :param order: Order A signed order, its salt must be unique in the book.
+        :param height: int If given, resting orders that expired before this height are skipped and dropped.
+        :return: Match if the order matched a resting order, otherwise None.
+        """
+        if order.salt in self._orders:
+            raise ValueError("An order with salt %r is already in the book." % (order.salt,))
+        if height is not None and order.expired(height):
+            raise ValueError("The order expired at %d." % order.expiry)
+
+        book = self._book(order.marketplace, order.item_id)
+        expired = []
+        if order.side == PUT_OFFER:
+            resting = book.bids.take(order.price, order.address, height, expired)
+        else:
+            resting = book.asks.take(order.price, order.address, height, expired)
+        for dropped in expired:
+            del self._orders[dropped.salt]
+
+        if resting is not None:
+            del self._orders[resting.salt]
+            if order.side == PUT_OFFER:
+                return Match(order, resting)
+            return Match(resting, order)
+
+        self._sequence += 1
+        order.sequence = self._sequence
+        if order.side == PUT_OFFER:
+            book.asks.add(order)
+        else:
+            book.bids.add(order)
+        self._orders[order.salt] = order
+        return None
+
+    def cancel(self, salt):
+        """
+        Remove a resting order.
+        :return: Order The cancelled order, None if no order with the salt is resting.
+        """
+        order = self._orders.pop(salt, None)
+        if order is not None:
+            order.cancelled = True
+            book = self._books[(order.marketplace, order.item_id)]
+            if order.side == PUT_OFFER:
+                book.asks.remove(order)
+            else:
+                book.bids.remove(order)
+        return order
+
+    def get(self, salt):
+        return self._orders.get(salt)
+
+    def best_ask(self, marketplace, item_id):
+        """ The lowest priced put_offer for an item, the oldest at that price. """
+        book = self._books.get((marketplace, item_id))
+        return book.asks.best() if book is not None else None
+
+    def best_bid(self, marketplace, item_id):
+        """ The highest priced buy_offer for an item, the oldest at that price. """
+        book = self._books.get((marketplace, item_id))
+        return book.bids.best() if book is not None else None
+
+    def offers(self, marketplace, item_id=None):
+        """
+        The put_offers of a marketplace, sorted by item id, then price and time.
+        :param item_id: If given, only the offers of this item.
+        """
+        if item_id is not None:
+            book = self._books.get((marketplace, item_id))
+            return book.asks.orders() if book is not None else []
+        result = []
+        for key in sorted(key for key in self._books if key[0] == marketplace):
+            result.extend(self._books[key].asks.orders())
+        return result
+
+    def bids(self, marketplace, item_id):
+        """ The buy_offers of an item, highest price first. """
+        book = self._books.get((marketplace, item_id))
+        return book.bids.orders() if book is not None else []
+
+
+# region Benchmark
+
+def benchmark(resting, matches, items=1000, levels=50):
+    """
+    Rest put_offers spread over items and price levels, then match buy_offers against them.
+    Signatures are placeholders, the book does not verify them.
+    :return: (seconds to rest the offers, seconds to match, matches made)
+    """
+    book = OrderBook()
+    signature = b'\x00' * 64
+    public_key = b'\x02' * 33
+    seller = b'\x01' * 20
+    buyer = b'\x02' * 20
+
+    start = time.perf_counter()
+    for i in range(resting):
+        price = 100000000 + (i // items) % levels * 1000000
+        book.add(Order(PUT_OFFER, 'LootClicker', i % items, price, b'a%015d' % i, seller, signature, public_key))
+    rest_seconds = time.perf_counter() - start
+
+    made = 0
+    start = time.perf_counter()
+    for i in range(matches):
+        price = 100000000 + (i * 7 // items) % levels * 1000000
+        order = Order(BUY_OFFER, 'LootClicker', (i * 7) % items, price, b'b%015d' % i, buyer, signature,
+                      public_key)
+        if book.add(order) is not None:
+            made += 1
+    match_seconds = time.perf_counter() - start
+    return rest_seconds, match_seconds, made
+
+
+def benchmark_own_offers(own, matches):
+    """
+    Match buy_offers at a price where the buyer's own put_offers rest ahead of the other sellers', which every
+    match must skip.
+    :return: (seconds to match, matches made)
+    """
+    book = OrderBook()
+    signature = b'\x00' * 64
+    public_key = b'\x02' * 33
+    buyer = b'\x02' * 20
+
+    for i in range(own):
+        book.add(Order(PUT_OFFER, 'LootClicker', 735, 100000000, b'o%015d' % i, buyer, signature, public_key))
+    for i in range(matches):
+        seller = b'\x01' * 18 + (i % 1000).to_bytes(2, 'little')
+        book.add(Order(PUT_OFFER, 'LootClicker', 735, 100000000, b'a%015d' % i, seller, signature, public_key))
+
+    made = 0
+    start = time.perf_counter()
+    for i in range(matches):
+        order = Order(BUY_OFFER, 'LootClicker', 735, 100000000, b'b%015d' % i, buyer, signature, public_key)
+        if book.add(order) is not None:
+            made += 1
+    return time.perf_counter() - start, made
+
+
+# endregion
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure order book matching against resting offers.")
+    parser.add_argument('--resting', type=int, default=1000000, help="Number of resting put_offers.")
+    parser.add_argument('--matches', type=int, default=100000, help="Number of buy_offers to match.")
+    parser.add_argument('--items', type=int, default=1000, help="Number of item ids the offers are spread over.")
+    parser.add_argument('--levels', type=int, default=50, help="Number of price levels per item.")
+    parser.add_argument('--own-offers', type=int, default=50000,
+                        help="Number of the buyer's own put_offers resting ahead of the others at one price.")
+    options = parser.parse_args(argv)
+
+    rest_seconds, match_seconds, made = benchmark(options.resting, options.matches, options.items, options.levels)
+    print('Rested %d offers in %.2fs, %.0f orders/s' % (options.resting, rest_seconds,
+                                                         options.resting / rest_seconds))
+    print('Matched %d of %d buy_offers in %.2fs, %.0f matches/s' % (made, options.matches, match_seconds,
+                                                                   made / match_seconds))
+
+    match_seconds, made = benchmark_own_offers(options.own_offers, options.matches)
+    print('Matched %d of %d buy_offers past %d of their own in %.2fs, %.0f matches/s' % (
+        made, options.matches, options.own_offers, match_seconds, made / match_seconds))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,39 @@
+"""
+The canonical order encoding signed by every party to a marketplace order.
+
+The contract rebuilds the same digest with encode_order and hash_order before
+verifying a signature, so a relayer can use these functions to produce exactly
+the bytes a user or marketplace owner must sign.
+
+    body = encode_order([marketplace, item_id, price])
+    digest = hash_order('put_offer', body, salt)
+"""
+
+import hashlib
+
+from lootframework.vm import serialize, to_bytes
+
+
+def encode_order(fields):
+    """
+    Encode an order body, every field as a byte array serialized after its length.
+    :param fields: list The fields of the order, integers are encoded as the VM converts them to byte arrays.
+    :return: bytes The encoded body.
+    """
+    return bytes(serialize([to_bytes(field) for field in fields]))
+
+
+def hash_order(operation, body, suffix):
+    """
+    The digest a signature covers, sha256 over the operation, the encoded body and the signer's suffix.
+    :param operation: str The operation being signed, e.g. 'put_offer'.
+    :param body: bytes The order body from encode_order.
+    :param suffix: bytes What the signer adds to the body, usually its order salt.
+    :return: bytes The 32 byte digest.
+    """
+    return hashlib.sha256(to_bytes(operation) + body + to_bytes(suffix)).digest()
+
+
+def order_digest(operation, fields, suffix):
+    """ encode_order and hash_order in one step, for orders whose body is signed by a single party. """
+    return hash_order(operation, encode_order(fields), suffix)
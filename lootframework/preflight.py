@@ -0,0 +1,186 @@
+"""
+Pre-flight checks of orders before they are relayed to the chain.
+
+An order that fails on chain still spends its GAS: exchange returns False when a salt
+was already used, a signature does not verify, the item is not in the originator's
+inventory or the taker's balance is short. A Preflight runs the order through the
+contract itself against a snapshot of contract storage and reports whether it would
+succeed, so there is no second copy of the contract's rules to drift out of date.
+
+    preflight = Preflight(snapshot, height)
+    verdict = preflight.check('exchange', args)
+    if not verdict.ok:
+        print(verdict.reason)
+
+Orders never change the snapshot. Every check starts from it unless several orders
+are checked together with check_many(orders, cumulative=True), where each order sees
+the changes of the ones before it, as it would within the same block.
+"""
+
+from lootframework.harness import ContractHarness
+from lootframework.interop import MemoryStorage
+
+# Marks a key deleted in a SnapshotStorage.
+_DELETED = None
+
+
+class SnapshotStorage(object):
+    """
+    A copy-on-write view over contract storage. Reads fall through to the snapshot,
+    writes are kept aside until reset, so the snapshot itself is never modified.
+
+    :param snapshot: Contract storage, anything with get(key) and find(prefix), e.g. a MemoryStorage.
+    """
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self.changes = {}
+        self._journal = None
+
+    def get(self, key):
+        value = self.changes.get(key, self)
+        if value is self:
+            return self.snapshot.get(key)
+        return value if value is not _DELETED else b''
+
+    def put(self, key, value):
+        self._record(key)
+        self.changes[key] = value
+
+    def delete(self, key):
+        self._record(key)
+        self.changes[key] = _DELETED
+
+    def find(self, prefix):
+        """ All (key, value) pairs whose key starts with the prefix, ordered by key. """
+        entries = dict(self.snapshot.find(prefix))
+        for key, value in self.changes.items():
+            if key.startswith(prefix):
+                if value is _DELETED:
+                    entries.pop(key, None)
+                else:
+                    entries[key] = value
+        return sorted(entries.items())
+
+    def begin(self):
+        self._journal = {}
+
+    def commit(self):
+        self._journal = None
+
+    def rollback(self):
+        for key, value in self._journal.items():
+            if value is self:
+                self.changes.pop(key, None)
+            else:
+                self.changes[key] = value
+        self._journal = None
+
+    def reset(self):
+        """ Discard every change, back to the snapshot. """
+        self.changes.clear()
+
+    def _record(self, key):
+        if self._journal is not None and key not in self._journal:
+            self._journal[key] = self.changes.get(key, self)
+
+
+class Verdict(object):
+    """ Whether an order would succeed if it were relayed now, and why not. """
+
+    def __init__(self, operation, args, value, fault, reason, stats):
+        self.operation = operation
+        self.args = args
+        self.value = value
+        self.fault = fault
+        self.reason = reason
+        self.stats = stats
+
+    @property
+    def ok(self):
+        return self.fault is None and bool(self.value)
+
+    def __bool__(self):
+        return self.ok
+
+    def __repr__(self):
+        if self.ok:
+            return 'Verdict(%r, ok)' % self.operation
+        return 'Verdict(%r, rejected, %r)' % (self.operation, self.reason)
+
+
+class Preflight(object):
+    """
+    Checks orders against a storage snapshot by invoking the contract without broadcasting anything.
+
+    :param snapshot: Contract storage at the height the orders will run at, anything with get(key) and
+        find(prefix), or a dict of its items.
+    :param height: int The block height the contract sees, order expiry is checked against it.
+    :param contract_path: str Path of the contract source, LootMarketsContract.py by default.
+    :param owner: Account If given, replaces contract_owner, for snapshots of a ContractHarness run with an owner.
+    :param signature_verifier: callable(public_key, signature, message) returning whether a signature is valid.
+        Relayers checking orders signed by real wallets must supply one, the harness only knows its own signatures.
+    """
+
+    def __init__(self, snapshot, height, contract_path=None, owner=None, signature_verifier=None):
+        if isinstance(snapshot, dict):
+            snapshot = MemoryStorage(snapshot)
+        self.storage = SnapshotStorage(snapshot)
+        # Counting executed lines slows every check down several times, costs are not what is asked here.
+        self.harness = ContractHarness(contract_path, storage=self.storage, height=height, owner=owner,
+                                       trace_steps=False)
+        self.harness.interop.signature_verifier = signature_verifier
+
+    @property
+    def height(self):
+        return self.harness.height
+
+    def refresh(self, snapshot=None, height=None):
+        """
+        Check later orders against a new snapshot or height, e.g. after every block.
+        Loading the contract is the expensive part of a Preflight, so one is kept and refreshed.
+        """
+        if snapshot is not None:
+            if isinstance(snapshot, dict):
+                snapshot = MemoryStorage(snapshot)
+            self.storage.snapshot = snapshot
+        if height is not None:
+            self.harness.height = height
+        self.storage.reset()
+
+    def check(self, operation, args):
+        """
+        Run an order against the snapshot.
+        :param operation: str The operation the order will be relayed as, e.g. 'exchange'.
+        :param args: list Its arguments, exactly as they will be relayed.
+        :return: Verdict
+        """
+        verdict = self._check(operation, args)
+        self.storage.reset()
+        return verdict
+
+    def check_many(self, orders, cumulative=False):
+        """
+        Run several orders against the snapshot.
+        :param orders: iterable of (operation, args).
+        :param cumulative: bool Run each order after the ones before it, as if they were relayed in this order
+            into the same block. Otherwise every order is checked on its own.
+        :return: list of Verdict
+        """
+        verdicts = []
+        for operation, args in orders:
+            verdicts.append(self._check(operation, args))
+            if not cumulative:
+                self.storage.reset()
+        self.storage.reset()
+        return verdicts
+
+    def _check(self, operation, args):
+        invocation = self.harness.invoke(operation, args)
+        reason = None
+        if invocation.fault is not None:
+            reason = 'FAULT: %s' % invocation.fault
+        elif not invocation.value:
+            errors = [log for log in invocation.logs if log.startswith('ERROR!')]
+            reason = errors[-1] if errors else '%s returned %r' % (operation, invocation.value)
+        return Verdict(operation, args, invocation.value, invocation.fault, reason, invocation.stats)
@@ -0,0 +1,498 @@
+"""
+Inventories, LOOT balances, marketplace fees and the registered marketplaces
+materialized from the contract's events.
+
+The API answers /inventory/[marketplace]/[address] and /wallet/[address] by reading
+contract storage, and get_inventory only returns its result through a Notify. These
+views are instead kept up to date from the events the indexer decodes, in a local
+SQLite database, and answer the same lookups in microseconds.
+
+    views = MaterializedViews('views.db')
+    indexer = Indexer(views)
+    views.attach(indexer, storage, reconcile_interval=1000)
+    indexer.ingest(read_recording('blocks.jsonl'))
+    views.inventory('LootClicker', address)
+
+The views double as the indexer's checkpoint: the last applied height is committed
+in the same transaction as the changes it covers, so a restart neither skips nor
+applies an event twice. Every reconcile_interval blocks the views are compared with
+direct storage reads and any drift is corrected.
+
+The API's /marketplaces/get can be answered from the views, or straight from a
+storage snapshot with read_marketplaces(storage), which enumerates the contract's
+marketplace registry.
+"""
+
+import sqlite3
+from collections import namedtuple
+
+from lootframework.indexer import (BRReceivedRewardEvent, DepositEvent, ExchangeBatchEvent, ExchangeEvent,
+                                   GiveItemEvent, GiveItemsBatchEvent, MigrateInventoryEvent,
+                                   RegisterMarketplaceEvent, RemoveItemEvent, SweepFeesEvent, TradeEvent,
+                                   TransferEvent, WithdrawEvent)
+from lootframework.vm import bytes_to_int, int_to_bytes, to_bytes
+
+# The storage layout of LootMarketsContract, see get_inventory_item_key, get_balance_key, get_accrued_fees_key,
+# get_marketplace_key and get_registry_entry_key.
+INVENTORY_KEY = b'Inventory'
+INVENTORY_ITEM_SEPARATOR = b'/'
+BALANCE_KEY = b'Balance'
+ACCRUED_FEES_KEY = b'Accrued'
+MARKETPLACE_KEY = b'Marketplace'
+REGISTRY_KEY = b'Registry'
+REGISTRY_SEPARATOR = b'/'
+ADDRESS_LENGTH = 20
+
+# A marketplace record as encode_marketplace lays it out, decoded by decode_marketplace.
+Marketplace = namedtuple('Marketplace', ('name', 'version', 'state', 'maker_fee', 'taker_fee', 'owner_count',
+                                         'fee_address'))
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS inventory (
+    marketplace TEXT NOT NULL,
+    address BLOB NOT NULL,
+    item_id INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (marketplace, address, item_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS holder (
+    marketplace TEXT NOT NULL,
+    address BLOB NOT NULL,
+    PRIMARY KEY (marketplace, address)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS balance (
+    address BLOB PRIMARY KEY,
+    balance INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS fees (
+    marketplace TEXT PRIMARY KEY,
+    accrued INTEGER NOT NULL,
+    swept INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS marketplace (
+    name TEXT PRIMARY KEY,
+    address BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS unknown_inventory (
+    marketplace TEXT NOT NULL,
+    address BLOB NOT NULL,
+    PRIMARY KEY (marketplace, address)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS unknown_marketplace (
+    marketplace TEXT PRIMARY KEY
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS checkpoint (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    height INTEGER NOT NULL
+);
+'''
+
+
+def inventory_prefix(marketplace, address):
+    """ The storage key prefix of every item an address owns on a marketplace. """
+    return INVENTORY_KEY + to_bytes(marketplace) + to_bytes(address) + INVENTORY_ITEM_SEPARATOR
+
+
+def inventory_item_key(marketplace, address, item_id):
+    """ The storage key holding how many of an item an address owns, as the contract concatenates it. """
+    return inventory_prefix(marketplace, address) + int_to_bytes(item_id)
+
+
+def balance_key(address):
+    """ The storage key holding the LOOT balance of an address. """
+    return BALANCE_KEY + to_bytes(address)
+
+
+def accrued_fees_key(marketplace):
+    """ The storage key holding the fees a marketplace has charged since they were last swept. """
+    return ACCRUED_FEES_KEY + to_bytes(marketplace)
+
+
+def marketplace_key(marketplace):
+    """ The storage key holding the record of a marketplace. """
+    return MARKETPLACE_KEY + to_bytes(marketplace)
+
+
+def is_balance_key(key):
+    """
+    Whether a storage key holds a LOOT balance. Marketplace names are free text and the owner keys of a marketplace
+    start with its name, so a prefix match alone also finds the owners of a marketplace named e.g. BalanceRush.
+    """
+    return len(key) == len(BALANCE_KEY) + ADDRESS_LENGTH and key.startswith(BALANCE_KEY)
+
+
+def is_registry_entry_key(key):
+    """ Whether a storage key holds the name of a registered marketplace, rather than the registry's count. """
+    return key.startswith(REGISTRY_KEY + REGISTRY_SEPARATOR)
+
+
+def decode_marketplace(name, record):
+    """
+    Decode a marketplace record: the version, the state, 2 byte little endian maker fee, taker fee and owner count,
+    then the 20 byte fee address.
+    :return: Marketplace, or None if there is no record.
+    """
+    record = to_bytes(record)
+    if not record:
+        return None
+    return Marketplace(name, record[0], record[1:2], bytes_to_int(record[2:4]), bytes_to_int(record[4:6]),
+                       bytes_to_int(record[6:8]), record[8:28])
+
+
+def read_marketplaces(storage):
+    """
+    Every registered marketplace, in the order they were registered, read from contract storage.
+    :param storage: Anything with get(key) and find(prefix), e.g. a MemoryStorage.
+    :return: list of Marketplace
+    """
+    return [decode_marketplace(name, storage.get(marketplace_key(name))) for name in read_registry(storage)]
+
+
+def read_registry(storage):
+    """
+    The name of every registered marketplace, in the order they were registered, read from contract storage.
+    :param storage: Anything with find(prefix), e.g. a MemoryStorage.
+    :return: list of str
+    """
+    prefix = REGISTRY_KEY + REGISTRY_SEPARATOR
+    entries = sorted((bytes_to_int(key[len(prefix):]), to_bytes(value).decode()) for key, value in storage.find(prefix))
+    return [name for index, name in entries]
+
+
+def read_holders(storage, marketplaces):
+    """
+    Every address holding an item on any of the marketplaces, read from contract storage.
+    A prefix scan of a marketplace's inventories also finds those of marketplaces named after it, their keys are
+    told apart with the registry.
+    :param storage: Anything with find(prefix), e.g. a MemoryStorage.
+    :return: set of (marketplace, address)
+    """
+    holders = set()
+    if not marketplaces:
+        return holders
+    registry = read_registry(storage)
+    for marketplace in marketplaces:
+        prefix = INVENTORY_KEY + to_bytes(marketplace)
+        others = [INVENTORY_KEY + to_bytes(name) for name in registry
+                  if name != marketplace and name.startswith(marketplace)]
+        for key, value in storage.find(prefix):
+            if any(key.startswith(other) for other in others):
+                continue
+            address = key[len(prefix):len(prefix) + ADDRESS_LENGTH]
+            if key[len(prefix) + ADDRESS_LENGTH:len(prefix) + ADDRESS_LENGTH + 1] == INVENTORY_ITEM_SEPARATOR:
+                holders.add((marketplace, address))
+    return holders
+
+
+class Drift(object):
+    """ A value the views held that differed from contract storage, found by reconcile. """
+
+    def __init__(self, kind, key, view_value, storage_value):
+        self.kind = kind
+        self.key = key
+        self.view_value = view_value
+        self.storage_value = storage_value
+
+    def __repr__(self):
+        return 'Drift(%s, %r, view=%r, storage=%r)' % (self.kind, self.key, self.view_value, self.storage_value)
+
+
+class MaterializedViews(object):
+    """
+    Inventory, balance, fee and marketplace views, updated incrementally from exchange, exchange_batch, trade,
+    give_item, remove_item, deposit, withdraw, transfer, sweep_fees and register_marketplace events.
+    give_items_batch only notifies how many items were given, they are read from storage at the next reconcile.
+
+    :param path: str The SQLite database, an in-memory database by default.
+    """
+
+    def __init__(self, path=':memory:'):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+        self.db.commit()
+        self._storage = None
+        self._reconcile_interval = None
+        self._last_reconciled = None
+
+    # region Lookups
+
+    def inventory(self, marketplace, address):
+        """ :return: dict item id -> count of every item the address owns on the marketplace. """
+        rows = self.db.execute('SELECT item_id, count FROM inventory WHERE marketplace = ? AND address = ?',
+                               (marketplace, to_bytes(address)))
+        return dict(rows)
+
+    def item_count(self, marketplace, address, item_id):
+        row = self.db.execute('SELECT count FROM inventory WHERE marketplace = ? AND address = ? AND item_id = ?',
+                              (marketplace, to_bytes(address), item_id)).fetchone()
+        return row[0] if row else 0
+
+    def balance(self, address):
+        """ :return: int The LOOT balance of the address within the contract. """
+        row = self.db.execute('SELECT balance FROM balance WHERE address = ?', (to_bytes(address),)).fetchone()
+        return row[0] if row else 0
+
+    def accrued_fees(self, marketplace):
+        """ :return: int The fees the marketplace has charged since they were last swept. """
+        return self._fees(marketplace)[0]
+
+    def swept_fees(self, marketplace):
+        """ :return: int The fees swept to the marketplace's fee address so far. """
+        return self._fees(marketplace)[1]
+
+    def marketplaces(self):
+        """ :return: list of the names of every registered marketplace, in the order they were registered. """
+        return [row[0] for row in self.db.execute('SELECT name FROM marketplace ORDER BY rowid')]
+
+    def _fees(self, marketplace):
+        row = self.db.execute('SELECT accrued, swept FROM fees WHERE marketplace = ?', (marketplace,)).fetchone()
+        return row if row else (0, 0)
+
+    # endregion
+
+    # region Checkpoint
+
+    def load(self):
+        """ The last height applied to the views, -1 if none. Used by the Indexer as its checkpoint. """
+        row = self.db.execute('SELECT height FROM checkpoint WHERE id = 0').fetchone()
+        return row[0] if row else -1
+
+    def save(self, height):
+        """ Commit the changes applied so far together with the height they cover. """
+        self.db.execute('INSERT OR REPLACE INTO checkpoint (id, height) VALUES (0, ?)', (height,))
+        self.db.commit()
+
+    # endregion
+
+    # region Updates
+
+    def add_items(self, marketplace, address, item_id, quantity):
+        address = to_bytes(address)
+        count = self.item_count(marketplace, address, item_id) + quantity
+        self._set_item(marketplace, address, item_id, count)
+        # Every inventory ever held is remembered, so reconcile checks it even once it is empty.
+        self.db.execute('INSERT OR IGNORE INTO holder (marketplace, address) VALUES (?, ?)', (marketplace, address))
+
+    def add_balance(self, address, amount):
+        address = to_bytes(address)
+        self._set_balance(address, self.balance(address) + amount)
+
+    def add_fees(self, marketplace, accrued, swept=0):
+        accrued_fees, swept_fees = self._fees(marketplace)
+        self.db.execute('INSERT OR REPLACE INTO fees (marketplace, accrued, swept) VALUES (?, ?, ?)',
+                        (marketplace, accrued_fees + accrued, swept_fees + swept))
+
+    def _set_item(self, marketplace, address, item_id, count):
+        # As in the contract, an item is removed from the inventory with its last copy.
+        if count > 0:
+            self.db.execute('INSERT OR REPLACE INTO inventory (marketplace, address, item_id, count) '
+                            'VALUES (?, ?, ?, ?)', (marketplace, address, item_id, count))
+        else:
+            self.db.execute('DELETE FROM inventory WHERE marketplace = ? AND address = ? AND item_id = ?',
+                            (marketplace, address, item_id))
+
+    def _set_balance(self, address, balance):
+        if balance > 0:
+            self.db.execute('INSERT OR REPLACE INTO balance (address, balance) VALUES (?, ?)', (address, balance))
+        else:
+            self.db.execute('DELETE FROM balance WHERE address = ?', (address,))
+
+    def attach(self, indexer, storage=None, reconcile_interval=None):
+        """
+        Keep the views up to date with the events of an indexer.
+        :param storage: Contract storage to reconcile against, anything with get(key) and optionally find(prefix),
+            e.g. a MemoryStorage.
+        :param reconcile_interval: int Reconcile every this many blocks, None to only reconcile when asked.
+        """
+        indexer.subscribe(ExchangeEvent, self.on_exchange)
+        indexer.subscribe(ExchangeBatchEvent, self.on_exchange_batch)
+        indexer.subscribe(TradeEvent, self.on_trade)
+        indexer.subscribe(GiveItemEvent, self.on_give_item)
+        indexer.subscribe(GiveItemsBatchEvent, self.on_give_items_batch)
+        indexer.subscribe(RemoveItemEvent, self.on_remove_item)
+        indexer.subscribe(BRReceivedRewardEvent, self.on_received_reward)
+        indexer.subscribe(MigrateInventoryEvent, self.on_migrate_inventory)
+        indexer.subscribe(DepositEvent, self.on_deposit)
+        indexer.subscribe(WithdrawEvent, self.on_withdraw)
+        indexer.subscribe(TransferEvent, self.on_transfer)
+        indexer.subscribe(SweepFeesEvent, self.on_sweep_fees)
+        indexer.subscribe(RegisterMarketplaceEvent, self.on_register_marketplace)
+
+        self._storage = storage
+        self._reconcile_interval = reconcile_interval
+        if storage is not None and reconcile_interval:
+            indexer.subscribe_blocks(self.on_block)
+
+    def on_exchange(self, event):
+        if not event.result or event.taker is None:
+            return
+        self.apply_exchange(event.marketplace, event.originator, event.taker, event.item_id, event.price,
+                            event.maker_fee or 0, event.taker_fee or 0)
+
+    def on_exchange_batch(self, event):
+        # Only the fills that were settled are listed, whether or not the whole batch was.
+        for fill in event.fills or ():
+            self.apply_exchange(event.marketplace, fill.originator, fill.taker, fill.item_id, fill.price,
+                                fill.maker_fee, fill.taker_fee)
+
+    def apply_exchange(self, marketplace, originator, taker, item_id, price, maker_fee, taker_fee):
+        if originator == taker:
+            return
+        self.add_items(marketplace, originator, item_id, -1)
+        self.add_items(marketplace, taker, item_id, 1)
+        # The taker pays its fee on top of the price, the maker fee is taken from what the originator receives.
+        # Both accrue to the marketplace until they are swept to its fee address.
+        self.add_balance(taker, -price - taker_fee)
+        self.add_balance(originator, price - maker_fee)
+        if maker_fee + taker_fee:
+            self.add_fees(marketplace, maker_fee + taker_fee)
+
+    def on_trade(self, event):
+        if not event.result or event.taker is None:
+            return
+        if event.originator != event.taker:
+            self.add_items(event.marketplace, event.originator, event.item_id, -1)
+            self.add_items(event.marketplace, event.taker, event.item_id, 1)
+
+    def on_give_item(self, event):
+        if not event.result or event.address is None:
+            return
+        # Orders signed with a quantity of 0 give a single item.
+        self.add_items(event.marketplace, event.address, event.item_id, event.quantity or 1)
+
+    def on_give_items_batch(self, event):
+        # The notification is a summary, every inventory of the marketplace is enumerated at the next reconcile.
+        if event.result:
+            self.db.execute('INSERT OR IGNORE INTO unknown_marketplace (marketplace) VALUES (?)',
+                            (event.marketplace,))
+
+    def on_remove_item(self, event):
+        if not event.result or event.address is None:
+            return
+        self.add_items(event.marketplace, event.address, event.item_id, -1)
+
+    def on_received_reward(self, event):
+        if event.marketplace is None:
+            return
+        self.add_items(event.marketplace, event.address, event.reward, 1)
+
+    def on_migrate_inventory(self, event):
+        # The event does not describe the items migrated, the inventory is read at the next reconcile.
+        # It is kept in the database so a restart before then does not forget it.
+        if event.result:
+            self.db.execute('INSERT OR IGNORE INTO unknown_inventory (marketplace, address) VALUES (?, ?)',
+                            (event.marketplace, to_bytes(event.address)))
+
+    def on_deposit(self, event):
+        self.add_balance(event.address, event.amount)
+
+    def on_withdraw(self, event):
+        self.add_balance(event.address, -event.amount)
+
+    def on_transfer(self, event):
+        if not event.result or event.taker is None:
+            return
+        if event.originator != event.taker:
+            self.add_balance(event.originator, -event.amount)
+            self.add_balance(event.taker, event.amount)
+
+    def on_sweep_fees(self, event):
+        if not event.amount:
+            return
+        self.add_balance(event.fee_address, event.amount)
+        self.add_fees(event.marketplace, -event.amount, event.amount)
+
+    def on_register_marketplace(self, event):
+        if event.result:
+            self.db.execute('INSERT OR IGNORE INTO marketplace (name, address) VALUES (?, ?)',
+                            (event.marketplace, to_bytes(event.address)))
+
+    def on_block(self, height):
+        if self._last_reconciled is None:
+            self._last_reconciled = height
+        elif height - self._last_reconciled >= self._reconcile_interval:
+            self.reconcile(self._storage)
+            self._last_reconciled = height
+
+    # endregion
+
+    # region Reconciliation
+
+    def reconcile(self, storage):
+        """
+        Compare the views with contract storage, correcting and returning any drift.
+        Every balance, item and accrued fee held in the views is read directly. If the storage can be searched by
+        prefix, every balance, the accrued fees of every registered marketplace, every inventory the views have
+        seen and every inventory of a marketplace given a give_items_batch are also enumerated, to find what the
+        views are missing.
+        Storage should be read at the height the views have reached, corrections are committed with the next save.
+        :param storage: Anything with get(key) returning the stored bytes, and optionally find(prefix).
+        :return: list of Drift
+        """
+        drift = []
+        can_find = hasattr(storage, 'find')
+
+        held = dict((bytes(address), balance)
+                    for address, balance in self.db.execute('SELECT address, balance FROM balance').fetchall())
+        if can_find:
+            stored = dict((key[len(BALANCE_KEY):], bytes_to_int(value)) for key, value in storage.find(BALANCE_KEY)
+                          if is_balance_key(key))
+        else:
+            stored = dict((address, bytes_to_int(to_bytes(storage.get(balance_key(address))))) for address in held)
+
+        for address in sorted(set(held) | set(stored)):
+            if held.get(address, 0) != stored.get(address, 0):
+                drift.append(Drift('balance', balance_key(address), held.get(address, 0), stored.get(address, 0)))
+                self._set_balance(address, stored.get(address, 0))
+
+        held = dict(self.db.execute('SELECT marketplace, accrued FROM fees').fetchall())
+        # A prefix scan of the accrued fees would also find the keys of marketplaces named after the prefix,
+        # so the fees of each registered marketplace are read by their exact key instead.
+        marketplaces = set(held)
+        if can_find:
+            marketplaces.update(read_registry(storage))
+        stored = dict((marketplace, bytes_to_int(to_bytes(storage.get(accrued_fees_key(marketplace)))))
+                      for marketplace in marketplaces)
+
+        for marketplace in sorted(set(held) | set(stored)):
+            if held.get(marketplace, 0) != stored.get(marketplace, 0):
+                drift.append(Drift('fees', accrued_fees_key(marketplace), held.get(marketplace, 0),
+                                   stored.get(marketplace, 0)))
+                self.add_fees(marketplace, stored.get(marketplace, 0) - held.get(marketplace, 0))
+
+        inventories = self.db.execute('SELECT marketplace, address FROM holder').fetchall()
+        inventories = set((marketplace, bytes(address)) for marketplace, address in inventories)
+        unknown = self.db.execute('SELECT marketplace, address FROM unknown_inventory').fetchall()
+        inventories.update((marketplace, bytes(address)) for marketplace, address in unknown)
+        if can_find:
+            unknown = [row[0] for row in self.db.execute('SELECT marketplace FROM unknown_marketplace')]
+            holders = read_holders(storage, unknown)
+            self.db.executemany('INSERT OR IGNORE INTO holder (marketplace, address) VALUES (?, ?)', holders)
+            inventories.update(holders)
+
+        for marketplace, address in sorted(inventories):
+            held = self.inventory(marketplace, address)
+            if can_find:
+                prefix = inventory_prefix(marketplace, address)
+                stored = dict((bytes_to_int(key[len(prefix):]), bytes_to_int(value))
+                              for key, value in storage.find(prefix))
+            else:
+                stored = dict((item_id, bytes_to_int(to_bytes(storage.get(
+                    inventory_item_key(marketplace, address, item_id))))) for item_id in held)
+
+            for item_id in set(held) | set(stored):
+                if held.get(item_id, 0) != stored.get(item_id, 0):
+                    drift.append(Drift('inventory', inventory_item_key(marketplace, address, item_id),
+                                       held.get(item_id, 0), stored.get(item_id, 0)))
+                    self._set_item(marketplace, address, item_id, stored.get(item_id, 0))
+
+        self.db.execute('DELETE FROM unknown_inventory')
+        if can_find:
+            self.db.execute('DELETE FROM unknown_marketplace')
+        return drift
+
+    # endregion
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,448 @@
+"""
+NEO virtual machine value semantics for running the contract under CPython.
+
+The contract is written for neo-boa: a storage value is a byte array that turns
+into an integer when it is used in arithmetic, `list.remove` removes by index,
+division truncates and Runtime.Serialize produces NEO's binary stack item format.
+These helpers reproduce enough of that behaviour for the offline harness to run
+LootMarketsContract.py unmodified.
+"""
+
+import hashlib
+
+
+class VMFault(Exception):
+    """Raised when the contract would have FAULTed the NEO virtual machine."""
+
+
+# region Integer and byte array conversion
+
+def int_to_bytes(value):
+    """
+    Convert an integer to the minimal little endian two's complement form used by BigInteger.
+    :param value: int The integer to convert.
+    :return: bytes The encoded integer, zero is the empty byte array.
+    """
+    if value == 0:
+        return b''
+    length = (value.bit_length() + 8) // 8
+    data = value.to_bytes(length, 'little', signed=True)
+    # Strip redundant sign extension bytes.
+    while len(data) > 1 and ((data[-1] == 0 and data[-2] < 0x80) or (data[-1] == 0xff and data[-2] >= 0x80)):
+        data = data[:-1]
+    return data
+
+
+def bytes_to_int(data):
+    """
+    Convert a little endian two's complement byte array to an integer.
+    :param data: bytes The byte array.
+    :return: int The integer, the empty byte array is zero.
+    """
+    if len(data) == 0:
+        return 0
+    return int.from_bytes(data, 'little', signed=True)
+
+
+def to_bytes(value):
+    """
+    Convert any stack value to its byte array form.
+    :param value: The stack value.
+    :return: bytes
+    """
+    if isinstance(value, bool):
+        return b'\x01' if value else b''
+    if isinstance(value, int):
+        return int_to_bytes(value)
+    if isinstance(value, str):
+        return value.encode('utf-8')
+    if isinstance(value, (bytes, bytearray)):
+        return bytes(value)
+    if value is None:
+        return b''
+    raise VMFault("Cannot convert %r to a byte array" % (value,))
+
+
+def to_int(value):
+    """
+    Convert any stack value to its integer form.
+    :param value: The stack value.
+    :return: int
+    """
+    if isinstance(value, bool):
+        return 1 if value else 0
+    if isinstance(value, int):
+        return value
+    if isinstance(value, (bytes, bytearray)):
+        return bytes_to_int(value)
+    if isinstance(value, str):
+        return bytes_to_int(value.encode('utf-8'))
+    if value is None:
+        return 0
+    raise VMFault("Cannot convert %r to an integer" % (value,))
+
+
+def vm_div(a, b):
+    """ DIV opcode, BigInteger division truncates towards zero. """
+    a = to_int(a)
+    b = to_int(b)
+    if b == 0:
+        raise VMFault("Division by zero")
+    quotient = abs(a) // abs(b)
+    return quotient if (a < 0) == (b < 0) else -quotient
+
+
+def vm_mod(a, b):
+    """ MOD opcode, the remainder takes the sign of the dividend. """
+    a = to_int(a)
+    b = to_int(b)
+    if b == 0:
+        raise VMFault("Division by zero")
+    return a - b * vm_div(a, b)
+
+
+# endregion
+
+
+# region Stack types
+
+class VMBytes(bytes):
+    """
+    A byte array on the evaluation stack.
+    Behaves as bytes, but is converted to an integer when used in arithmetic
+    or compared against an integer, as the NEO virtual machine does.
+    """
+
+    def __eq__(self, other):
+        if isinstance(other, (bytes, bytearray)):
+            return bytes.__eq__(self, bytes(other))
+        if isinstance(other, (int, str)):
+            return bytes.__eq__(self, to_bytes(other))
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    __hash__ = bytes.__hash__
+
+    def __bool__(self):
+        return any(self)
+
+    def __lt__(self, other):
+        if isinstance(other, int):
+            return to_int(self) < other
+        return bytes.__lt__(self, other)
+
+    def __le__(self, other):
+        if isinstance(other, int):
+            return to_int(self) <= other
+        return bytes.__le__(self, other)
+
+    def __gt__(self, other):
+        if isinstance(other, int):
+            return to_int(self) > other
+        return bytes.__gt__(self, other)
+
+    def __ge__(self, other):
+        if isinstance(other, int):
+            return to_int(self) >= other
+        return bytes.__ge__(self, other)
+
+    def __add__(self, other):
+        if isinstance(other, int):
+            return to_int(self) + other
+        return VMBytes(bytes(self) + to_bytes(other))
+
+    def __radd__(self, other):
+        if isinstance(other, int):
+            return other + to_int(self)
+        return VMBytes(to_bytes(other) + bytes(self))
+
+    def __sub__(self, other):
+        return to_int(self) - to_int(other)
+
+    def __rsub__(self, other):
+        return to_int(other) - to_int(self)
+
+    def __mul__(self, other):
+        return to_int(self) * to_int(other)
+
+    __rmul__ = __mul__
+
+    def __truediv__(self, other):
+        return vm_div(self, other)
+
+    def __rtruediv__(self, other):
+        return vm_div(other, self)
+
+    __floordiv__ = __truediv__
+    __rfloordiv__ = __rtruediv__
+
+    def __mod__(self, other):
+        return vm_mod(self, other)
+
+    def __rmod__(self, other):
+        return vm_mod(other, self)
+
+    def __neg__(self):
+        return -to_int(self)
+
+    def __and__(self, other):
+        return to_int(self) & to_int(other)
+
+    __rand__ = __and__
+
+    def __or__(self, other):
+        return to_int(self) | to_int(other)
+
+    __ror__ = __or__
+
+    def __xor__(self, other):
+        return to_int(self) ^ to_int(other)
+
+    __rxor__ = __xor__
+
+    def __lshift__(self, other):
+        return to_int(self) << to_int(other)
+
+    def __rshift__(self, other):
+        return to_int(self) >> to_int(other)
+
+    def __index__(self):
+        return to_int(self)
+
+    def __repr__(self):
+        return 'VMBytes(%s)' % bytes.__repr__(self)
+
+
+class VMList(list):
+    """
+    An array on the evaluation stack.
+    In neo-boa `remove` takes the index of the item to remove, not the item itself.
+    """
+
+    def remove(self, index):
+        del self[to_int(index)]
+
+
+def vm_list(length=0):
+    """ boa.builtins.list, creates an array of a fixed length. """
+    return VMList([0] * length)
+
+
+def normalize(value):
+    """
+    Convert a Python value passed into the contract to the form it would have on the stack.
+    Strings and bytes become VMBytes, lists become VMList.
+    """
+    if isinstance(value, bool) or isinstance(value, int):
+        return value
+    if isinstance(value, (str, bytes, bytearray)):
+        return VMBytes(to_bytes(value))
+    if isinstance(value, (list, tuple)):
+        return VMList(normalize(item) for item in value)
+    if isinstance(value, dict):
+        return dict((normalize(k), normalize(v)) for k, v in value.items())
+    if value is None:
+        return VMBytes(b'')
+    raise VMFault("Unsupported argument type %r" % (value,))
+
+
+def plain(value):
+    """
+    Convert a stack value back to plain Python types, e.g. for notifications and reports.
+    """
+    if isinstance(value, VMBytes):
+        return bytes(value)
+    if isinstance(value, list):
+        return [plain(item) for item in value]
+    if isinstance(value, dict):
+        return dict((plain(k), plain(v)) for k, v in value.items())
+    return value
+
+
+# endregion
+
+
+# region boa.builtins
+
+def vm_len(value):
+    """ ARRAYSIZE opcode, neo-boa compiles len to it: the length of an array or map, the size of anything else. """
+    if isinstance(value, (list, tuple, dict)):
+        return len(value)
+    return len(to_bytes(value))
+
+
+def concat(a, b):
+    """ CAT opcode. """
+    return VMBytes(to_bytes(a) + to_bytes(b))
+
+
+def take(data, count):
+    """ LEFT opcode. """
+    return VMBytes(to_bytes(data)[:to_int(count)])
+
+
+def substr(data, start, length):
+    """ SUBSTR opcode. """
+    start = to_int(start)
+    return VMBytes(to_bytes(data)[start:start + to_int(length)])
+
+
+def has_key(items, key):
+    """ HASKEY opcode. """
+    return key in items
+
+
+def keys(items):
+    """ KEYS opcode. """
+    return VMList(items.keys())
+
+
+def values(items):
+    """ VALUES opcode. """
+    return VMList(items.values())
+
+
+def sha256(data):
+    return VMBytes(hashlib.sha256(to_bytes(data)).digest())
+
+
+def hash160(data):
+    digest = hashlib.sha256(to_bytes(data)).digest()
+    return VMBytes(hashlib.new('ripemd160', digest).digest())
+
+
+def hash256(data):
+    digest = hashlib.sha256(to_bytes(data)).digest()
+    return VMBytes(hashlib.sha256(digest).digest())
+
+
+# endregion
+
+
+# region Runtime.Serialize
+
+STACK_BYTE_ARRAY = 0x00
+STACK_BOOLEAN = 0x01
+STACK_INTEGER = 0x02
+STACK_ARRAY = 0x80
+STACK_STRUCT = 0x81
+STACK_MAP = 0x82
+
+
+def _write_var_int(out, value):
+    if value < 0xfd:
+        out.append(value)
+    elif value <= 0xffff:
+        out.append(0xfd)
+        out.extend(value.to_bytes(2, 'little'))
+    elif value <= 0xffffffff:
+        out.append(0xfe)
+        out.extend(value.to_bytes(4, 'little'))
+    else:
+        out.append(0xff)
+        out.extend(value.to_bytes(8, 'little'))
+
+
+def _write_var_bytes(out, data):
+    _write_var_int(out, len(data))
+    out.extend(data)
+
+
+def _serialize_item(out, item):
+    if isinstance(item, bool):
+        out.append(STACK_BOOLEAN)
+        out.append(1 if item else 0)
+    elif isinstance(item, int):
+        out.append(STACK_INTEGER)
+        _write_var_bytes(out, int_to_bytes(item))
+    elif isinstance(item, (str, bytes, bytearray)):
+        out.append(STACK_BYTE_ARRAY)
+        _write_var_bytes(out, to_bytes(item))
+    elif isinstance(item, (list, tuple)):
+        out.append(STACK_ARRAY)
+        _write_var_int(out, len(item))
+        for element in item:
+            _serialize_item(out, element)
+    elif isinstance(item, dict):
+        out.append(STACK_MAP)
+        _write_var_int(out, len(item))
+        for key, value in item.items():
+            _serialize_item(out, key)
+            _serialize_item(out, value)
+    else:
+        raise VMFault("Cannot serialize %r" % (item,))
+
+
+def serialize(item):
+    """
+    Runtime.Serialize, encode a stack item in NEO's binary format.
+    :param item: The stack item.
+    :return: VMBytes The serialized item.
+    """
+    out = bytearray()
+    _serialize_item(out, item)
+    return VMBytes(bytes(out))
+
+
+def _read_var_int(data, offset):
+    prefix = data[offset]
+    if prefix < 0xfd:
+        return prefix, offset + 1
+    size = {0xfd: 2, 0xfe: 4, 0xff: 8}[prefix]
+    return int.from_bytes(data[offset + 1:offset + 1 + size], 'little'), offset + 1 + size
+
+
+def _read_var_bytes(data, offset):
+    length, offset = _read_var_int(data, offset)
+    if offset + length > len(data):
+        raise VMFault("Serialized data is truncated")
+    return data[offset:offset + length], offset + length
+
+
+def _deserialize_item(data, offset):
+    if offset >= len(data):
+        raise VMFault("Serialized data is truncated")
+    item_type = data[offset]
+    offset += 1
+    if item_type == STACK_BYTE_ARRAY:
+        value, offset = _read_var_bytes(data, offset)
+        return VMBytes(value), offset
+    if item_type == STACK_BOOLEAN:
+        return data[offset] != 0, offset + 1
+    if item_type == STACK_INTEGER:
+        value, offset = _read_var_bytes(data, offset)
+        return bytes_to_int(value), offset
+    if item_type in (STACK_ARRAY, STACK_STRUCT):
+        count, offset = _read_var_int(data, offset)
+        items = VMList()
+        for i in range(count):
+            item, offset = _deserialize_item(data, offset)
+            items.append(item)
+        return items, offset
+    if item_type == STACK_MAP:
+        count, offset = _read_var_int(data, offset)
+        items = {}
+        for i in range(count):
+            key, offset = _deserialize_item(data, offset)
+            value, offset = _deserialize_item(data, offset)
+            items[key] = value
+        return items, offset
+    raise VMFault("Unknown stack item type %d" % item_type)
+
+
+def deserialize(data):
+    """
+    Runtime.Deserialize, decode a stack item serialized by Runtime.Serialize.
+    :param data: bytes The serialized item.
+    :return: The stack item, byte arrays are returned as VMBytes and arrays as VMList.
+    """
+    data = to_bytes(data)
+    item, offset = _deserialize_item(data, 0)
+    return item
+
+# endregion
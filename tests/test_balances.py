@@ -0,0 +1,60 @@
+import io
+
+from lootframework.balances import export_balances, iter_accrued_fees, iter_balances, main
+from lootframework.benchmark import MARKETPLACE, run_scenario
+from lootframework.interop import read_storage_dump
+from lootframework.views import accrued_fees_key, balance_key
+from lootframework.vm import int_to_bytes
+
+
+def prefix_named_marketplaces(fixture):
+    # Owner keys start with the marketplace name, these share the prefix of balances and accrued fees.
+    for marketplace in ('BalanceRush', 'AccruedRush'):
+        fixture.invoke('register_marketplace', [marketplace, fixture.marketplace_owner.address, 0, 0],
+                       witnesses=[fixture.owner.address])
+    seller = fixture.harness.account('seller')
+    buyer = fixture.harness.account('buyer')
+    fixture.set_fees(50, 50)
+    fixture.give_item(seller.address, 735)
+    fixture.deposit(buyer, 10000)
+    fixture.exchange(seller, buyer, 735, 1000)
+
+
+def test_only_balance_keys_are_exported():
+    address = b'\x01' * 20
+    entries = [(balance_key(address), int_to_bytes(1000)),
+               (b'BalanceRushkey' + address, address),
+               (b'Inventory', int_to_bytes(1))]
+
+    assert list(iter_balances(entries)) == [(address, 1000)]
+    out = io.StringIO()
+    assert export_balances(entries, out) == (1, 1000)
+    assert out.getvalue() == 'address,balance\n%s,1000\n' % address.hex()
+
+
+def test_only_registered_marketplaces_accrue_fees():
+    address = b'\x01' * 20
+    entries = [(accrued_fees_key(MARKETPLACE), int_to_bytes(9)),
+               (b'AccruedRushkey' + address, address)]
+
+    assert list(iter_accrued_fees(entries, [MARKETPLACE, 'AccruedRush'])) == [(MARKETPLACE, 9)]
+
+
+def test_the_export_reconciles_with_the_nep5_balance(tmp_path, capsys):
+    dump = str(tmp_path / 'storage.jsonl')
+    run_scenario(prefix_named_marketplaces, dump=dump)
+    storage = dict(read_storage_dump(dump))
+    count, total = export_balances(storage.items(), io.StringIO())
+    accrued = sum(amount for marketplace, amount in iter_accrued_fees(storage.items(), [MARKETPLACE]))
+    assert accrued > 0
+
+    out = str(tmp_path / 'balances.csv')
+    assert main([dump, '--out', out, '--nep5-balance', str(total + accrued)]) == 0
+    report = capsys.readouterr().out
+    assert '%d balances, %d LOOT in total' % (count, total) in report
+    assert '%d LOOT of marketplace fees not swept yet' % accrued in report
+    with open(out) as f:
+        assert len(f.readlines()) == count + 1
+
+    assert main([dump, '--out', out, '--nep5-balance', str(total + accrued + 1)]) == 1
+    assert 'MISMATCH' in capsys.readouterr().out
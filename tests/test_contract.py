@@ -0,0 +1,391 @@
+import pytest
+
+from lootframework.benchmark import MARKETPLACE, ORDER_LIFETIME, MarketFixture
+from lootframework.views import INVENTORY_KEY, inventory_item_key
+from lootframework.vm import bytes_to_int, deserialize, int_to_bytes, serialize, to_int
+
+
+@pytest.fixture
+def fixture():
+    return MarketFixture()
+
+
+@pytest.mark.parametrize('args', [[], [MARKETPLACE]])
+def test_add_owner_wallet_rejects_missing_arguments(fixture, args):
+    owner = fixture.marketplace_owner
+    invocation = fixture.harness.invoke('add_owner_wallet', args, witnesses=[owner.address])
+    assert invocation.fault is None
+    assert not invocation.value
+
+
+def test_add_owner_wallet_registers_a_signer(fixture):
+    assert fixture.register_signer().value == 1
+
+
+def test_migrate_inventory_writes_each_item_once(fixture):
+    storage = fixture.harness.storage
+    address = fixture.harness.account('player').address
+    legacy_key = INVENTORY_KEY + MARKETPLACE.encode() + address
+    storage.put(legacy_key, serialize([735, 735, 736, 735]))
+
+    invocation = fixture.harness.invoke('migrate_inventory', [MARKETPLACE, address])
+    assert invocation.value
+    assert invocation.stats.storage_writes == 2
+    assert bytes_to_int(storage.get(inventory_item_key(MARKETPLACE, address, 735))) == 3
+    assert bytes_to_int(storage.get(inventory_item_key(MARKETPLACE, address, 736))) == 1
+    assert storage.get(legacy_key) == b''
+
+
+def br_details(fixture, event_code):
+    return deserialize(fixture.harness.storage.get(b'BRDetails' + event_code.encode()))
+
+
+def br_zones(fixture, event_code):
+    """ The slots in each occupied zone of an event, from its zone index. """
+    prefix = b'BRZone' + event_code.encode() + b'/'
+    return dict((bytes_to_int(key[len(prefix):]), [to_int(slot) for slot in deserialize(value)])
+                for key, value in fixture.harness.storage.find(prefix))
+
+
+def start_br_event(fixture, event_code, zones):
+    """ An event whose players landed in the zones, one player for each, and finished round 0. """
+    players = [fixture.harness.account('entrant%d' % i) for i in range(len(zones))]
+    fixture.br_create(event_code, [1, 2, 3])
+    for player in players:
+        fixture.br_sign_up(event_code, player)
+    fixture.br_start(event_code)
+    for player, zone in zip(players, zones):
+        fixture.br_choose_initial_zone(event_code, player, zone)
+    fixture.harness.advance()
+    assert fixture.br_finish_round(event_code).value
+    return players
+
+
+def test_br_players_outside_the_live_area_are_removed(fixture):
+    players = start_br_event(fixture, 'BR', [0, 1, 2, 3])
+    # The WEST side reached 2 columns deep, as marking it twice leaves it.
+    details = br_details(fixture, 'BR')
+    details[11] = 2
+    fixture.harness.storage.put(b'BRDetails' + b'BR', serialize(details))
+
+    for player in players:
+        fixture.br_do_action('BR', player, 'hide', 0)
+    fixture.harness.advance()
+    invocation = fixture.br_finish_round('BR')
+    assert invocation.value
+    removed = [payload[3] for payload in invocation.notifications if payload[2] == b'removed_player']
+    assert sorted(removed) == sorted(player.address for player in players[:2])
+    grid_length = to_int(details[8])
+    assert [to_int(value) for value in br_details(fixture, 'BR')[9:]] == [0, grid_length - 1, 2, grid_length - 1]
+
+
+def test_br_zone_index_follows_moves_and_removals(fixture):
+    players = start_br_event(fixture, 'BR', [0, 14, 21, 35])
+    assert br_zones(fixture, 'BR') == {0: [0], 14: [1], 21: [2], 35: [3]}
+
+    # Moving right leaves zone 0, whose key is deleted once it is empty.
+    fixture.br_do_action('BR', players[0], 'move', 2)
+    assert br_zones(fixture, 'BR') == {1: [0], 14: [1], 21: [2], 35: [3]}
+
+    # The last player does not act before the round times out, and is removed from its zone.
+    for player in players[1:3]:
+        fixture.br_do_action('BR', player, 'hide', 0)
+    fixture.harness.advance(fixture.harness.contract.BR_ROUND_TIMEOUT + 1)
+    assert fixture.br_finish_round('BR').value
+    assert br_zones(fixture, 'BR') == {1: [0], 14: [1], 21: [2]}
+
+
+def test_br_removes_several_players_in_one_round(fixture):
+    players = start_br_event(fixture, 'BR', [0, 0, 14, 21, 35, 7])
+    # The two players sharing zone 0 and the player in zone 21 do not act before the round times out.
+    for player in (players[2], players[4], players[5]):
+        fixture.br_do_action('BR', player, 'hide', 0)
+    fixture.harness.advance(fixture.harness.contract.BR_ROUND_TIMEOUT + 1)
+    invocation = fixture.br_finish_round('BR')
+    assert invocation.value
+
+    removed = [players[0].address, players[1].address, players[3].address]
+    assert [payload[3] for payload in invocation.notifications if payload[2] == b'removed_player'] == removed
+    storage = fixture.harness.storage
+    assert storage.get(b'BRAliveBR') == b'\x00\x00\x01\x00\x01\x01'
+    assert not any(storage.get(b'BRSlotBR' + address) for address in removed)
+    assert br_zones(fixture, 'BR') == {7: [5], 14: [2], 35: [4]}
+    invocation = fixture.harness.invoke('BR_get_leaderboard', ['BR'])
+    assert invocation.notifications == [[b'BR', b'BR', b'leaderboard', removed]]
+    # The removed players can no longer act.
+    invocation = fixture.harness.invoke('BR_do_action', ['BR', players[0].address, 'hide', 0],
+                                        witnesses=[players[0].address])
+    assert invocation.value is False
+
+
+def test_br_alive_map_has_a_byte_for_each_slot(fixture):
+    players = [fixture.harness.account('entrant%d' % i) for i in range(3)]
+    fixture.br_create('BR', [1])
+    for count, player in enumerate(players, 1):
+        fixture.br_sign_up('BR', player)
+        assert fixture.harness.storage.get(b'BRAliveBR') == b'\x01' * count
+
+
+# 47 players are removed in round 0 and 2 more cross into the second page, or 48 fill the first page exactly.
+@pytest.mark.parametrize('entrants,first_pages,second_pages', [(51, [940], [960, 20]), (52, [960], [960, 40])])
+def test_br_leaderboard_pages_hold_48_players(fixture, entrants, first_pages, second_pages):
+    players = [fixture.harness.account('entrant%d' % i) for i in range(entrants)]
+    fixture.br_create('BR', [1])
+    for player in players:
+        fixture.br_sign_up('BR', player)
+    fixture.br_start('BR')
+    # Only the last four land, every other player is removed when round 0 times out.
+    landed = players[-4:]
+    for i, player in enumerate(landed):
+        fixture.br_choose_initial_zone('BR', player, i * 60)
+    storage = fixture.harness.storage
+    timeout = fixture.harness.contract.BR_ROUND_TIMEOUT + 1
+
+    def finish_round(pages):
+        fixture.harness.advance(timeout)
+        invocation = fixture.br_finish_round('BR')
+        assert [len(page) for key, page in storage.find(b'BRLeaderboardBR/')] == pages
+        return [payload[3] for payload in invocation.notifications if payload[2] == b'removed_player']
+
+    removed = finish_round(first_pages)
+    # Two of the landed players do not act in round 1.
+    for player in landed[:2]:
+        fixture.br_do_action('BR', player, 'hide', 0)
+    removed += finish_round(second_pages)
+
+    assert removed == [player.address for player in players[:-4] + landed[2:]]
+    assert bytes_to_int(storage.get(b'BRLeaderboardBR')) == entrants - 2
+    invocation = fixture.harness.invoke('BR_get_leaderboard', ['BR'])
+    assert invocation.notifications == [[b'BR', b'BR', b'leaderboard', removed]]
+
+
+def br_entrant_record(fixture, event_code, slot):
+    """ The address and the zone, round, action and direction of the entrant in a slot, from its page. """
+    page = fixture.harness.storage.get(b'BREntrants' + event_code.encode() + b'/' + int_to_bytes(slot // 32))
+    record = page[slot % 32 * 28:slot % 32 * 28 + 28]
+    return record[:20], [bytes_to_int(record[20:24]), bytes_to_int(record[24:26]), record[26], record[27]]
+
+
+def test_br_entrants_are_packed_into_pages_of_32(fixture):
+    players = [fixture.harness.account('entrant%d' % i) for i in range(33)]
+    fixture.br_create('BR', [1])
+    for player in players:
+        fixture.br_sign_up('BR', player)
+
+    storage = fixture.harness.storage
+    assert [len(page) for key, page in storage.find(b'BREntrantsBR/')] == [32 * 28, 28]
+    # Slots are 2 bytes, so slot 0 is not empty.
+    assert storage.get(b'BRSlotBR' + players[0].address) == b'\x00\x00'
+    assert storage.get(b'BRSlotBR' + players[32].address) == b'\x20\x00'
+    # Unknown action and no direction until the entrant lands.
+    assert br_entrant_record(fixture, 'BR', 32) == (players[32].address, [0, 0, 0, 4])
+
+    fixture.br_start('BR')
+    for i, player in enumerate(players):
+        fixture.br_choose_initial_zone('BR', player, 3 * i)
+    assert br_entrant_record(fixture, 'BR', 32) == (players[32].address, [96, 1, 0, 4])
+    fixture.harness.advance()
+    assert fixture.br_finish_round('BR').value
+
+    # Moving left, action 1 and direction 3, only rewrites the entrant's own record.
+    page = storage.get(b'BREntrantsBR/')
+    fixture.br_do_action('BR', players[32], 'move', 3)
+    assert br_entrant_record(fixture, 'BR', 32) == (players[32].address, [95, 2, 1, 3])
+    assert storage.get(b'BREntrantsBR/') == page
+    assert br_entrant_record(fixture, 'BR', 5) == (players[5].address, [15, 1, 0, 4])
+
+
+def make_baseline_br_event(fixture, event_code, players):
+    """ Store a running event as the contract before entrant slots stored it, every value serialized whole. """
+    storage = fixture.harness.storage
+    code = event_code.encode()
+    owner = fixture.marketplace_owner.address
+    storage.put(b'BattleRoyaleDetails' + code, serialize([1, 15, owner, True, 0, 0, 10, MARKETPLACE, 4]))
+    storage.put(b'BattleRoyaleRewards' + code, serialize([1, 2, 3]))
+    for zone, player in enumerate(players):
+        storage.put(b'BattleRoyaleInformation' + code + player.address, serialize([zone, 1, b'hide', 0]))
+    storage.put(b'BattleRoyaleCurrentPlayers' + code, serialize([player.address for player in players]))
+    storage.put(b'BREventResults' + code, serialize([players[0].address]))
+
+
+def test_baseline_br_events_are_refused(fixture):
+    players = [fixture.harness.account('entrant%d' % i) for i in range(3)]
+    make_baseline_br_event(fixture, 'BR', players)
+    stored = dict(fixture.harness.storage.items)
+    owner = fixture.marketplace_owner.address
+
+    invocations = [
+        fixture.harness.invoke('BR_create', ['BR', owner, MARKETPLACE, 1, 2, 3], witnesses=[owner]),
+        fixture.harness.invoke('BR_sign_up', ['BR', players[0].address], witnesses=[players[0].address]),
+        fixture.harness.invoke('BR_start', ['BR', owner], witnesses=[owner]),
+        fixture.harness.invoke('BR_choose_initial_zone', ['BR', players[1].address, 1],
+                               witnesses=[players[1].address]),
+        fixture.harness.invoke('BR_do_action', ['BR', players[1].address, 'hide', 0],
+                               witnesses=[players[1].address]),
+        fixture.harness.invoke('BR_finish_round', ['BR']),
+    ]
+    for invocation in invocations:
+        assert invocation.fault is None
+        assert not invocation.value
+    assert fixture.harness.storage.items == stored
+
+    invocation = fixture.harness.invoke('BR_get_leaderboard', ['BR'])
+    assert invocation.fault is None
+    assert invocation.notifications == [[b'BR', b'BR', b'leaderboard', []]]
+
+
+def completed_salts(fixture, count):
+    player = fixture.harness.account('player')
+    return [fixture.give_item(player.address, 1000 + i).notifications[0][1] for i in range(count)]
+
+
+def test_prune_orders_deletes_the_completion_of_expired_salts(fixture):
+    salts = completed_salts(fixture, 3)
+    fixture.harness.advance(ORDER_LIFETIME + 1)
+
+    invocation = fixture.invoke('prune_orders', salts)
+    assert invocation.value == 3
+    assert invocation.notifications == [[b'prune_orders', 3]]
+    assert not any(key.startswith(b'Order') for key in fixture.harness.storage.items)
+
+
+def test_prune_orders_keeps_salts_that_have_not_expired(fixture):
+    salts = completed_salts(fixture, 2)
+
+    assert fixture.invoke('prune_orders', salts, expect=None).value == 0
+    assert len([key for key in fixture.harness.storage.items if key.startswith(b'Order')]) == 2
+
+
+# A 16 byte integer and a 16 element array pass the length check, only a byte array is a salt.
+@pytest.mark.parametrize('element', [int.from_bytes(b'\x01' * 16, 'little'), [1] * 16, b'\x01' * 15, 'ab' * 16])
+def test_prune_orders_skips_elements_that_are_not_compact_salts(fixture, element):
+    salts = completed_salts(fixture, 1)
+    fixture.harness.advance(ORDER_LIFETIME + 1)
+
+    invocation = fixture.harness.invoke('prune_orders', [element] + salts)
+    assert invocation.fault is None
+    assert invocation.value == 1
+
+
+def give_item_args(fixture, address, salt, marketplace=MARKETPLACE):
+    owner = fixture.marketplace_owner
+    signature = owner.sign('give_item', [marketplace, address, 735, 0], salt)
+    return [marketplace, address, 735, owner.address, signature, owner.public_key, salt]
+
+
+def compact_salt(expiry, guid=1):
+    return expiry.to_bytes(4, 'little') + guid.to_bytes(12, 'little')
+
+
+def test_orders_are_refused_once_their_salt_expired(fixture):
+    address = fixture.harness.account('player').address
+    height = fixture.harness.height
+
+    invocation = fixture.harness.invoke('give_item', give_item_args(fixture, address, compact_salt(height - 1)))
+    assert invocation.value is False
+    assert 'ERROR! This order has expired!' in invocation.logs
+    # An order can still be completed at the height it expires at.
+    assert fixture.harness.invoke('give_item', give_item_args(fixture, address, compact_salt(height))).value
+
+
+def test_orders_are_refused_if_their_salt_expires_too_far_ahead(fixture):
+    address = fixture.harness.account('player').address
+    latest = fixture.harness.height + fixture.harness.contract.MAX_ORDER_LIFETIME
+
+    invocation = fixture.harness.invoke('give_item', give_item_args(fixture, address, compact_salt(latest + 1)))
+    assert invocation.value is False
+    assert 'ERROR! This order expires too far in the future!' in invocation.logs
+    assert fixture.harness.invoke('give_item', give_item_args(fixture, address, compact_salt(latest))).value
+
+
+def test_salts_can_only_be_used_once(fixture):
+    address = fixture.harness.account('player').address
+    for salt in (compact_salt(fixture.harness.height + 10), '%032x' % 1):
+        args = give_item_args(fixture, address, salt)
+        assert fixture.harness.invoke('give_item', args).value
+        invocation = fixture.harness.invoke('give_item', args)
+        assert invocation.value is False
+        assert 'ERROR! This order has already occurred!' in invocation.logs
+
+
+def register_marketplace(fixture, marketplace, address=None):
+    address = address or fixture.harness.account(marketplace).address
+    return fixture.harness.invoke('register_marketplace', [marketplace, address, 0, 0],
+                                  witnesses=[fixture.owner.address])
+
+
+def test_marketplaces_are_listed_in_the_order_they_were_registered(fixture):
+    for marketplace in ('LootRaid', 'LootArena'):
+        assert register_marketplace(fixture, marketplace).value
+
+    assert fixture.harness.invoke('get_marketplace_count', []).value == 3
+    listed = fixture.harness.invoke('get_marketplaces', [1, 3]).value
+    assert listed == [MARKETPLACE.encode(), b'LootRaid', b'LootArena']
+    assert fixture.harness.invoke('get_marketplaces', [2, 10]).value == [b'LootRaid', b'LootArena']
+    assert fixture.harness.invoke('get_marketplaces', [4, 10]).value == []
+
+
+def test_a_marketplace_cannot_be_registered_twice(fixture):
+    storage = fixture.harness.storage
+    stored = dict(storage.items)
+
+    invocation = register_marketplace(fixture, MARKETPLACE)
+    assert invocation.value is False
+    assert 'ERROR! The marketplace is already registered.' in invocation.logs
+    assert invocation.notifications == [[b'register_marketplace', MARKETPLACE.encode(),
+                                         fixture.harness.account(MARKETPLACE).address, False]]
+    assert storage.items == stored
+    assert fixture.harness.invoke('get_marketplace_count', []).value == 1
+
+
+def set_marketplace_state(fixture, marketplace, state):
+    invocation = fixture.harness.invoke('set_marketplace_state', [marketplace, state],
+                                        witnesses=[fixture.owner.address])
+    assert invocation.value
+    return invocation
+
+
+def terminated_trade(fixture, marketplace, seller, buyer):
+    return fixture.harness.invoke('trade', [marketplace, seller.address, buyer.address, 735],
+                                  witnesses=[seller.address])
+
+
+def test_paused_marketplaces_refuse_orders(fixture):
+    seller = fixture.harness.account('seller')
+    buyer = fixture.harness.account('buyer')
+    fixture.give_item(seller.address, 735)
+    fixture.deposit(buyer, 1000)
+    assert register_marketplace(fixture, 'LootRaid', fixture.marketplace_owner.address).value
+    set_marketplace_state(fixture, MARKETPLACE, b'\x02')
+
+    invocation = fixture.harness.invoke('give_item', give_item_args(fixture, buyer.address, fixture.salt()))
+    assert invocation.value is False
+    assert 'ERROR! The marketplace is paused.' in invocation.logs
+    invocation = fixture.exchange(seller, buyer, 735, 100, expect=False)
+    assert 'ERROR! The marketplace is paused.' in invocation.logs
+    # The other marketplaces keep trading.
+    args = give_item_args(fixture, buyer.address, fixture.salt(), 'LootRaid')
+    assert fixture.harness.invoke('give_item', args).value
+
+    set_marketplace_state(fixture, MARKETPLACE, b'\x03')
+    assert fixture.exchange(seller, buyer, 735, 100).value
+
+
+def test_terminated_forms_open_per_marketplace(fixture):
+    seller = fixture.harness.account('seller')
+    buyer = fixture.harness.account('buyer')
+    assert register_marketplace(fixture, 'LootRaid', fixture.marketplace_owner.address).value
+    fixture.give_item(seller.address, 735)
+    args = give_item_args(fixture, seller.address, fixture.salt(), 'LootRaid')
+    assert fixture.harness.invoke('give_item', args).value
+
+    set_marketplace_state(fixture, 'LootRaid', b'\x01')
+    assert fixture.harness.invoke('get_marketplace_state', ['LootRaid']).value == b'\x01'
+    assert terminated_trade(fixture, 'LootRaid', seller, buyer).value
+    assert not terminated_trade(fixture, MARKETPLACE, seller, buyer).value
+
+    # The contract's TERMINATED state overrides every marketplace's own.
+    fixture.harness.invoke('set_contract_state', [b'\x01'], witnesses=[fixture.owner.address])
+    assert fixture.harness.invoke('get_marketplace_state', [MARKETPLACE]).value == b'\x01'
+    assert terminated_trade(fixture, MARKETPLACE, seller, buyer).value
+    assert bytes_to_int(fixture.harness.storage.get(inventory_item_key(MARKETPLACE, buyer.address, 735))) == 1
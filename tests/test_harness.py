@@ -0,0 +1,138 @@
+import pytest
+
+from lootframework.benchmark import MARKETPLACE, BenchmarkError, MarketFixture
+from lootframework.views import INVENTORY_KEY
+from lootframework.vm import to_int
+
+
+@pytest.fixture
+def fixture():
+    return MarketFixture()
+
+
+@pytest.fixture
+def seller(fixture):
+    return fixture.harness.account('seller')
+
+
+@pytest.fixture
+def buyer(fixture):
+    return fixture.harness.account('buyer')
+
+
+def balance(fixture, account):
+    return to_int(fixture.invoke('balance_of', [account.address], expect=None).value)
+
+
+def accrued_fees(fixture):
+    return to_int(fixture.invoke('get_accrued_fees', [MARKETPLACE], expect=None).value)
+
+
+def inventory(fixture, account):
+    invocation = fixture.invoke('get_inventory', [MARKETPLACE, account.address], expect=None)
+    return dict((to_int(item_id), to_int(count)) for item_id, count in invocation.notifications[0][3])
+
+
+@pytest.fixture
+def market(fixture, seller, buyer):
+    """ A seller owning item 735 and a buyer with 1000 LOOT each, the seller pays a 4% fee and the buyer 5%. """
+    fixture.set_fees(400, 500)
+    fixture.give_item(seller.address, 735)
+    fixture.deposit(seller, 1000)
+    fixture.deposit(buyer, 1000)
+    return fixture
+
+
+def test_a_settled_exchange_moves_the_item_price_and_fees(market, seller, buyer):
+    invocation = market.exchange(seller, buyer, 735, 100)
+
+    assert invocation.stats.gas_units > 0
+    assert balance(market, seller) == 1096
+    assert balance(market, buyer) == 895
+    assert accrued_fees(market) == 9
+    assert inventory(market, seller) == {}
+    assert inventory(market, buyer) == {735: 1}
+    payload = invocation.notifications[-1]
+    assert payload[0] == b'exchange'
+    assert [to_int(value) for value in payload[-2:]] == [4, 5]
+
+
+def test_sweeping_fees_pays_the_fee_address(market, seller, buyer):
+    market.exchange(seller, buyer, 735, 100)
+
+    market.sweep_fees()
+    assert accrued_fees(market) == 0
+    assert balance(market, market.marketplace_owner) == 9
+
+
+def test_an_exchange_batch_settles_every_fill(market, seller, buyer):
+    market.give_item(seller.address, 736, 2)
+
+    invocation = market.exchange_batch([market.fill(seller, buyer, 735, 100), market.fill(seller, buyer, 736, 200),
+                                        market.fill(seller, buyer, 736, 200)])
+    assert invocation.value
+    # 500 changes hands, the seller pays 4% of it and the buyer 5% on top.
+    assert balance(market, seller) == 1000 + 500 - 20
+    assert balance(market, buyer) == 1000 - 500 - 25
+    assert accrued_fees(market) == 45
+    assert inventory(market, seller) == {}
+    assert inventory(market, buyer) == {735: 1, 736: 2}
+
+
+def test_an_exchange_the_buyer_can_not_afford_changes_nothing(market, seller, buyer):
+    # The price is the whole balance, the taker fee on top of it is not covered.
+    with pytest.raises(BenchmarkError, match='returned False'):
+        market.exchange(seller, buyer, 735, 1000)
+
+    assert balance(market, seller) == 1000
+    assert balance(market, buyer) == 1000
+    assert accrued_fees(market) == 0
+    assert inventory(market, seller) == {735: 1}
+
+
+def test_an_exchange_of_an_item_the_seller_does_not_own_changes_nothing(market, seller, buyer):
+    with pytest.raises(BenchmarkError, match='returned False'):
+        market.exchange(seller, buyer, 736, 100)
+
+    assert balance(market, seller) == 1000
+    assert balance(market, buyer) == 1000
+    assert inventory(market, buyer) == {}
+
+
+def test_give_item_stacks_copies(fixture, seller):
+    fixture.give_item(seller.address, 735)
+    fixture.give_item(seller.address, 735, 3)
+    fixture.give_items_batch([(seller.address, 736), (seller.address, 735)])
+
+    assert inventory(fixture, seller) == {735: 5, 736: 1}
+
+
+def test_withdraw_lowers_the_balance(fixture, seller):
+    fixture.deposit(seller, 1000)
+    fixture.withdraw(seller, 400)
+
+    assert balance(fixture, seller) == 600
+
+
+def test_faults_roll_back_and_return_false(fixture, seller):
+    # A legacy inventory that does not deserialize.
+    legacy_key = INVENTORY_KEY + MARKETPLACE.encode() + seller.address
+    fixture.harness.storage.put(legacy_key, b'\x80\x05')
+    fixture.give_item(seller.address, 735)
+
+    invocation = fixture.harness.invoke('migrate_inventory', [MARKETPLACE, seller.address])
+    assert invocation.fault is not None
+    assert invocation.value is False
+    assert invocation.notifications == []
+    assert fixture.harness.storage.get(legacy_key) == b'\x80\x05'
+    assert inventory(fixture, seller) == {735: 1}
+
+
+@pytest.mark.parametrize('error', [AttributeError, TypeError, IndexError, KeyError])
+def test_harness_errors_are_not_taken_for_faults(fixture, seller, monkeypatch, error):
+    def balance_of(address):
+        raise error('a bug outside the contract')
+
+    monkeypatch.setattr(fixture.harness.contract, 'balance_of', balance_of)
+    with pytest.raises(error):
+        fixture.harness.invoke('balance_of', [seller.address])
@@ -0,0 +1,86 @@
+from lootframework.benchmark import SCENARIOS, run_scenario
+from lootframework.indexer import (BRZoneMarkedEvent, Block, Checkpoint, ExchangeEvent, GiveItemEvent, Indexer,
+                                   Notification, UnknownEvent, decode_event, decode_parameter, encode_parameter,
+                                   read_recording)
+
+SELLER = b'\x01' * 20
+BUYER = b'\x02' * 20
+
+
+def test_payloads_decode_into_event_records():
+    event = decode_event(5, 'tx', [b'exchange', b'salt', b'LootClicker', True, SELLER, BUYER, 735, 100, 4, 5])
+
+    assert isinstance(event, ExchangeEvent)
+    assert (event.height, event.txid, event.marketplace) == (5, 'tx', 'LootClicker')
+    assert (event.item_id, event.price) == (735, 100)
+    assert (event.originator, event.taker, event.maker_fee, event.taker_fee) == (SELLER, BUYER, 4, 5)
+
+
+def test_missing_trailing_fields_are_none():
+    event = decode_event(5, 'tx', [b'exchange', b'salt', b'LootClicker', False])
+
+    assert event.result is False
+    assert event.taker is None and event.maker_fee is None
+
+
+def test_battle_royale_payloads_decode_with_their_event_code():
+    event = decode_event(5, 'tx', [b'BR', b'BR10', b'zone_marked', 2, 0, 5, 0, 4])
+
+    assert isinstance(event, BRZoneMarkedEvent)
+    assert (event.event_code, event.side, event.max_row, event.max_column) == ('BR10', 2, 5, 4)
+
+
+def test_unknown_payloads_are_kept_whole():
+    assert decode_event(5, 'tx', [b'unknown', 1]) == UnknownEvent(5, 'tx', [b'unknown', 1])
+    assert decode_event(5, 'tx', b'') == UnknownEvent(5, 'tx', b'')
+
+
+def test_parameters_round_trip():
+    payload = [b'give_item', b'salt', b'LootClicker', True, SELLER, 735, 3]
+    assert decode_event(1, 'tx', decode_parameter(encode_parameter(payload))) == decode_event(1, 'tx', payload)
+
+
+def test_subscribers_receive_events_in_chain_order():
+    indexer = Indexer()
+    seen = []
+    indexer.subscribe(GiveItemEvent, lambda event: seen.append(('give_item', event.height)))
+    indexer.subscribe(None, lambda event: seen.append(('any', event.height)))
+    give_item = encode_parameter([b'give_item', b'salt', b'LootClicker', True, SELLER, 735, 1])
+    blocks = [Block(1, [Notification('tx1', '0x01', give_item)]),
+              Block(2, [Notification('tx2', '0x02', give_item)])]
+
+    assert indexer.ingest(blocks) == 2
+    assert seen == [('give_item', 1), ('any', 1), ('give_item', 2), ('any', 2)]
+
+
+def test_other_contracts_are_skipped():
+    indexer = Indexer(script_hash='0x01')
+    give_item = encode_parameter([b'give_item', b'salt', b'LootClicker', True, SELLER, 735, 1])
+
+    assert indexer.ingest([Block(1, [Notification('tx1', '0x01', give_item),
+                                     Notification('tx2', '0x02', give_item)])]) == 1
+
+
+def test_a_restart_resumes_after_the_checkpoint(tmp_path):
+    give_item = encode_parameter([b'give_item', b'salt', b'LootClicker', True, SELLER, 735, 1])
+    blocks = [Block(height, [Notification('tx%d' % height, '0x01', give_item)]) for height in range(1, 11)]
+    checkpoint = Checkpoint(str(tmp_path / 'checkpoint.json'))
+
+    assert Indexer(checkpoint).ingest(blocks[:4]) == 4
+    assert checkpoint.load() == 4
+
+    indexer = Indexer(checkpoint)
+    assert indexer.ingest(blocks) == 6
+    assert checkpoint.load() == 10
+
+
+def test_a_recording_replays_every_notification(tmp_path):
+    record = str(tmp_path / 'record.jsonl')
+    run_scenario(dict(SCENARIOS)['exchange_fills_30'], record)
+    exchanges = []
+    indexer = Indexer()
+    indexer.subscribe(ExchangeEvent, exchanges.append)
+    indexer.ingest(read_recording(record))
+
+    assert len(exchanges) == 30
+    assert all(event.result and event.price == 100000000 for event in exchanges)
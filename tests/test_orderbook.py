@@ -0,0 +1,144 @@
+from lootframework.orderbook import Order, OrderBook
+
+SIGNATURE = b'\x00' * 64
+PUBLIC_KEY = b'\x02' * 33
+SELLER = b'\x01' * 20
+BUYER = b'\x02' * 20
+OTHER_SELLER = b'\x03' * 20
+
+
+def put_offer(price, salt, address=SELLER, item_id=735):
+    return Order.put_offer('LootClicker', item_id, price, salt, address, SIGNATURE, PUBLIC_KEY)
+
+
+def buy_offer(price, salt, address=BUYER, item_id=735):
+    return Order.buy_offer('LootClicker', item_id, price, salt, address, SIGNATURE, PUBLIC_KEY)
+
+
+def test_offers_are_listed_by_price_then_time():
+    book = OrderBook()
+    book.add(put_offer(300, b'a'))
+    book.add(put_offer(100, b'b'))
+    book.add(put_offer(100, b'c'))
+    book.add(put_offer(200, b'd'))
+
+    assert [order.salt for order in book.offers('LootClicker', 735)] == [b'b', b'c', b'd', b'a']
+    assert book.best_ask('LootClicker', 735).salt == b'b'
+
+
+def test_bids_are_listed_highest_price_first():
+    book = OrderBook()
+    book.add(buy_offer(100, b'a'))
+    book.add(buy_offer(300, b'b'))
+    book.add(buy_offer(300, b'c'))
+
+    assert [order.salt for order in book.bids('LootClicker', 735)] == [b'b', b'c', b'a']
+    assert book.best_bid('LootClicker', 735).salt == b'b'
+
+
+def test_a_match_takes_the_oldest_order_at_the_price():
+    book = OrderBook()
+    book.add(put_offer(100, b'a'))
+    book.add(put_offer(100, b'b'))
+
+    match = book.add(buy_offer(100, b'c'))
+    assert (match.ask.salt, match.bid.salt, match.price) == (b'a', b'c', 100)
+    match = book.add(buy_offer(100, b'd'))
+    assert match.ask.salt == b'b'
+    assert len(book) == 0
+    assert book.best_ask('LootClicker', 735) is None
+
+
+def test_an_order_only_matches_its_own_price():
+    book = OrderBook()
+    book.add(put_offer(100, b'a'))
+
+    assert book.add(buy_offer(200, b'b')) is None
+    assert len(book) == 2
+
+
+def test_own_orders_are_skipped():
+    book = OrderBook()
+    book.add(put_offer(100, b'a', address=BUYER))
+    book.add(put_offer(100, b'b'))
+    book.add(put_offer(100, b'c'))
+
+    assert book.add(buy_offer(100, b'd')).ask.salt == b'b'
+    assert book.add(buy_offer(100, b'e')).ask.salt == b'c'
+    assert book.add(buy_offer(100, b'f')) is None
+    assert [order.salt for order in book.offers('LootClicker', 735)] == [b'a']
+
+
+def test_cancelled_orders_do_not_match():
+    book = OrderBook()
+    book.add(put_offer(100, b'a'))
+    book.add(put_offer(100, b'b'))
+
+    assert book.cancel(b'a').salt == b'a'
+    assert book.cancel(b'a') is None
+    assert book.add(buy_offer(100, b'c')).ask.salt == b'b'
+    assert book.best_ask('LootClicker', 735) is None
+
+
+def test_expired_orders_are_dropped():
+    book = OrderBook()
+    expiring = (10).to_bytes(4, 'little') + b'\x00' * 12
+    book.add(put_offer(100, expiring))
+    book.add(put_offer(100, b'b'))
+
+    assert book.add(buy_offer(100, b'c'), height=11).ask.salt == b'b'
+    assert expiring not in book
+    assert len(book) == 0
+
+
+def test_the_price_heap_does_not_grow_with_repeated_fills():
+    book = OrderBook()
+    for i in range(10000):
+        book.add(put_offer(100 + i % 3, b'a%d' % i))
+        assert book.add(buy_offer(100 + i % 3, b'b%d' % i)) is not None
+
+    asks = book._books[('LootClicker', 735)].asks
+    assert len(asks.prices) <= 3
+    assert not asks.levels
+
+
+def test_the_price_heap_is_rebuilt_when_levels_are_dropped():
+    book = OrderBook()
+    for i in range(10000):
+        book.add(put_offer(100 + i, b'a%d' % i))
+        book.add(buy_offer(100 + i, b'b%d' % i))
+    book.add(put_offer(50, b'c'))
+
+    asks = book._books[('LootClicker', 735)].asks
+    assert len(asks.prices) <= 2 * len(asks.levels) + 16
+    assert book.best_ask('LootClicker', 735).salt == b'c'
+
+
+def test_own_orders_keep_their_place_when_others_are_matched():
+    book = OrderBook()
+    book.add(put_offer(100, b'a'))
+    book.add(put_offer(100, b'b', address=BUYER))
+    book.add(put_offer(100, b'c', address=OTHER_SELLER))
+    book.add(put_offer(100, b'd'))
+
+    assert book.add(buy_offer(100, b'e')).ask.salt == b'a'
+    assert book.add(buy_offer(100, b'f')).ask.salt == b'c'
+    assert [order.salt for order in book.offers('LootClicker', 735)] == [b'b', b'd']
+    assert book.best_ask('LootClicker', 735).salt == b'b'
+    # Another buyer takes the buyer's own offer first, it is the oldest.
+    assert book.add(buy_offer(100, b'g', address=OTHER_SELLER)).ask.salt == b'b'
+
+
+def test_matches_do_not_pass_over_deep_own_levels():
+    book = OrderBook()
+    for i in range(5000):
+        book.add(put_offer(100, b'own%d' % i, address=BUYER))
+    for i in range(5000):
+        book.add(put_offer(100, b'a%d' % i))
+    book.cancel(b'a0')
+
+    for i in range(1, 5000):
+        assert book.add(buy_offer(100, b'b%d' % i)).ask.salt == b'a%d' % i
+    assert book.add(buy_offer(100, b'c')) is None
+    assert len(book.offers('LootClicker', 735)) == 5000
+    assert book.best_ask('LootClicker', 735).salt == b'own0'
@@ -0,0 +1,76 @@
+import pytest
+
+from lootframework.benchmark import MARKETPLACE, MarketFixture
+from lootframework.orders import encode_order
+from lootframework.preflight import Preflight
+
+
+@pytest.fixture
+def fixture():
+    fixture = MarketFixture()
+    fixture.seller = fixture.harness.account('seller')
+    fixture.buyer = fixture.harness.account('buyer')
+    fixture.give_item(fixture.seller.address, 735)
+    fixture.deposit(fixture.buyer, 1000)
+    return fixture
+
+
+def exchange_args(fixture, price, seller_salt=None):
+    """ An exchange of item 735 from the seller to the buyer, signed as MarketFixture.exchange signs it. """
+    seller = fixture.seller
+    buyer = fixture.buyer
+    owner = fixture.marketplace_owner
+    seller_salt = seller_salt or fixture.salt()
+    buyer_salt = fixture.salt()
+    body = encode_order([MARKETPLACE, 735, price])
+    return [MARKETPLACE, owner.address, owner.sign('exchange', body, seller.address + buyer.address), owner.public_key,
+            seller.address, seller.sign('put_offer', body, seller_salt), seller.public_key,
+            buyer.address, buyer.sign('buy_offer', body, buyer_salt), buyer.public_key, 735, price,
+            seller_salt, buyer_salt]
+
+
+def preflight(fixture):
+    return Preflight(fixture.harness.storage.copy(), fixture.harness.height, owner=fixture.owner)
+
+
+def test_an_order_that_would_succeed_is_ok(fixture):
+    verdict = preflight(fixture).check('exchange', exchange_args(fixture, 100))
+
+    assert verdict.ok
+    assert verdict.reason is None
+
+
+def test_an_order_that_would_fail_gives_the_contract_error(fixture):
+    verdict = preflight(fixture).check('exchange', exchange_args(fixture, 5000))
+
+    assert not verdict.ok
+    assert verdict.reason.startswith('ERROR!')
+
+
+def test_checks_do_not_change_the_snapshot(fixture):
+    snapshot = fixture.harness.storage.copy()
+    checker = Preflight(snapshot, fixture.harness.height, owner=fixture.owner)
+    args = exchange_args(fixture, 100)
+
+    assert checker.check('exchange', args).ok
+    assert checker.check('exchange', args).ok
+    assert snapshot.items == fixture.harness.storage.items
+
+
+def test_cumulative_checks_see_the_orders_before_them(fixture):
+    checker = preflight(fixture)
+    salt = fixture.salt()
+    orders = [('exchange', exchange_args(fixture, 100, salt)), ('exchange', exchange_args(fixture, 100, salt))]
+
+    assert [verdict.ok for verdict in checker.check_many(orders)] == [True, True]
+    assert [verdict.ok for verdict in checker.check_many(orders, cumulative=True)] == [True, False]
+
+
+def test_refresh_checks_against_a_new_snapshot(fixture):
+    checker = preflight(fixture)
+    args = exchange_args(fixture, 100)
+    fixture.invoke('exchange', args)
+
+    assert checker.check('exchange', args).ok
+    checker.refresh(fixture.harness.storage.copy())
+    assert not checker.check('exchange', args).ok
@@ -0,0 +1,114 @@
+import pytest
+
+from lootframework.benchmark import MARKETPLACE, SCENARIOS, run_scenario
+from lootframework.indexer import Indexer, MigrateInventoryEvent, read_recording
+from lootframework.interop import Account, MemoryStorage, read_storage_dump
+from lootframework.views import (REGISTRY_KEY, REGISTRY_SEPARATOR, MaterializedViews, inventory_item_key,
+                                 read_holders)
+from lootframework.vm import int_to_bytes
+
+# The Battle Royale scenarios with hundreds of players take a while and add no views coverage.
+REPLAYED = [(name, scenario) for name, scenario in SCENARIOS if not name.startswith('battle_royale_200')]
+
+
+def replay(scenario, tmp_path):
+    """ Run a scenario, then build views from its events alone. :return: (views, storage left by the scenario) """
+    record = str(tmp_path / 'record.jsonl')
+    dump = str(tmp_path / 'storage.jsonl')
+    run_scenario(scenario, record, dump)
+    views = MaterializedViews()
+    indexer = Indexer(views)
+    views.attach(indexer)
+    indexer.ingest(read_recording(record))
+    return views, MemoryStorage(dict(read_storage_dump(dump)))
+
+
+@pytest.mark.parametrize('name,scenario', REPLAYED, ids=[name for name, scenario in REPLAYED])
+def test_replayed_views_match_storage(name, scenario, tmp_path):
+    views, storage = replay(scenario, tmp_path)
+    if name.startswith('give_items_batch'):
+        # The batches only notify a summary, the items given are read from storage by the first reconcile.
+        drift = views.reconcile(storage)
+        assert drift and set((entry.kind, entry.view_value) for entry in drift) == set([('inventory', 0)])
+    assert views.reconcile(storage) == []
+
+
+def test_exchange_batch_applies_only_settled_fills(tmp_path):
+    def scenario(fixture):
+        seller = fixture.harness.account('seller')
+        buyer = fixture.harness.account('buyer')
+        fixture.give_item(seller.address, 1000, 3)
+        fixture.deposit(buyer, 1000)
+        fill = fixture.fill(seller, buyer, 1000, 100)
+        # The repeated fill fails and the others are settled, nothing of a failed atomic batch is.
+        fixture.exchange_batch([fill, fill, fixture.fill(seller, buyer, 1000, 200)], atomic=False, expect=False)
+        fixture.exchange_batch([fixture.fill(seller, buyer, 1000, 300), fill], expect=False)
+
+    views, storage = replay(scenario, tmp_path)
+    assert views.reconcile(storage) == []
+    assert views.inventory(MARKETPLACE, Account('buyer').address) == {1000: 2}
+    assert views.balance(Account('buyer').address) == 700
+    assert views.balance(Account('seller').address) == 300
+
+
+def test_replayed_fees_and_balances(tmp_path):
+    scenario = dict(SCENARIOS)['exchange_fills_30_fees']
+    views, storage = replay(scenario, tmp_path)
+
+    assert views.accrued_fees(MARKETPLACE) + views.swept_fees(MARKETPLACE) > 0
+    assert views.reconcile(storage) == []
+
+
+def test_reconcile_skips_marketplaces_named_after_storage_prefixes(tmp_path):
+    def scenario(fixture):
+        # Owner keys start with the marketplace name, these share the prefix of balances and accrued fees.
+        for marketplace in ('BalanceRush', 'AccruedRush'):
+            fixture.invoke('register_marketplace', [marketplace, fixture.marketplace_owner.address, 0, 0],
+                           witnesses=[fixture.owner.address])
+        fixture.deposit(fixture.harness.account('player'), 1000)
+
+    views, storage = replay(scenario, tmp_path)
+    assert views.reconcile(storage) == []
+    # The fixture registers its own marketplace before recording starts.
+    assert views.marketplaces() == ['BalanceRush', 'AccruedRush']
+
+
+def test_reconcile_corrects_drift(tmp_path):
+    views, storage = replay(dict(SCENARIOS)['exchange_fills_30_fees'], tmp_path)
+    address = b'\x07' * 20
+    views.add_balance(address, 5)
+    views.add_fees(MARKETPLACE, 3)
+
+    drift = views.reconcile(storage)
+    assert sorted(entry.kind for entry in drift) == ['balance', 'fees']
+    assert views.balance(address) == 0
+    assert views.reconcile(storage) == []
+
+
+def test_migrated_inventories_are_reconciled_after_a_restart(tmp_path):
+    path = str(tmp_path / 'views.db')
+    address = b'\x01' * 20
+    views = MaterializedViews(path)
+    views.on_migrate_inventory(MigrateInventoryEvent(10, 'txid', MARKETPLACE, address, True))
+    views.save(10)
+    views.close()
+
+    storage = MemoryStorage({inventory_item_key(MARKETPLACE, address, 735): int_to_bytes(2)})
+    views = MaterializedViews(path)
+    assert views.load() == 10
+    drift = views.reconcile(storage)
+    assert [(entry.kind, entry.storage_value) for entry in drift] == [('inventory', 2)]
+    assert views.inventory(MARKETPLACE, address) == {735: 2}
+    views.close()
+
+
+def test_read_holders_skips_marketplaces_named_after_the_marketplace():
+    holder = b'\x01' * 20
+    other = b'\x02' * 20
+    storage = MemoryStorage({
+        REGISTRY_KEY + REGISTRY_SEPARATOR + int_to_bytes(1): MARKETPLACE.encode(),
+        REGISTRY_KEY + REGISTRY_SEPARATOR + int_to_bytes(2): (MARKETPLACE + 'Pro').encode(),
+        inventory_item_key(MARKETPLACE, holder, 1000): int_to_bytes(1),
+        inventory_item_key(MARKETPLACE + 'Pro', other, 1000): int_to_bytes(1),
+    })
+    assert read_holders(storage, [MARKETPLACE]) == set([(MARKETPLACE, holder)])